@@ -21,13 +21,27 @@
 " The LyX module has all the rules related with different lyx file formats."
 
 from parser_tools import get_value, check_token, find_token, \
-     find_tokens, find_end_of
+     find_tokens, find_end_of, IndexedLines, IndexedBlocks, LineIndexes, \
+     HeaderLines, IndexedPackedBlocks, PackedBlocks, LineRule, apply_rules, \
+     rewrite_lines, get_locality, paragraph_local, iter_paragraphs, \
+     intern_lines
+import copy
+import itertools
 import os.path
 import gzip
 import locale
 import sys
 import re
 import time
+import traceback
+from cStringIO import StringIO
+
+try:
+    import mmap
+    mmap_type = mmap.mmap
+except ImportError:
+    mmap = None
+    mmap_type = ()
 
 try:
     import lyx2lyx_version
@@ -60,6 +74,8 @@ def minor_versions(major, last_minor_version):
 ####################################################################
 
 
+gzip_magic = "\037\213"
+
 # Regular expressions used
 format_re = re.compile(r"(\d)[\.,]?(\d\d)")
 fileformat = re.compile(r"\\lyxformat\s*(\S*)")
@@ -107,6 +123,9 @@ def formats_list():
                 formats.append(format)
     return formats
 
+# looked up for every file read, the list above is only built once
+supported_formats = dict.fromkeys(formats_list())
+
 
 def format_info():
     " Returns a list with supported file formats."
@@ -151,6 +170,63 @@ def trim_eol(line):
         return line[:-1]
 
 
+def iter_lines(data):
+    """ Yields the lines of data, with their end of line, each one with
+    the position where the next line starts."""
+    pos = 0
+    size = len(data)
+    while pos < size:
+        end = data.find('\n', pos) + 1
+        if not end:
+            end = size
+        yield data[pos:end], end
+        pos = end
+
+
+def read_lines(input, size = 1 << 16):
+    """ Yields the lines of the file object input, with their end of
+    line, reading it size bytes at a time."""
+    rest = ""
+    while True:
+        data = input.read(size)
+        if not data:
+            break
+        lines = (rest + data).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if rest:
+        yield rest
+
+
+def split_lines(text):
+    """ Returns the lines of text, as trim_eol would leave them one by one.
+    Only '\\n' ends a line, as for readline."""
+    lines = text.split(u'\n')
+    last = lines.pop()
+    if u'\r' in text:
+        lines = [trim_eol(line + u'\n') for line in lines]
+    if last:
+        lines.append(trim_eol(last))
+    return lines
+
+
+def write_lines(output, lines, encoding, chunk = 4096):
+    """ Writes lines, each one followed by a newline, to output. The lines
+    are joined and encoded chunk lines at a time, so that neither the
+    number of writes nor the memory used grow with the document."""
+    for i in range(0, len(lines), chunk):
+        text = u"\n".join(lines[i:i + chunk])
+        output.write(text.encode(encoding) + "\n")
+
+
+def target_name(name, target):
+    """ Returns the file name name, with the version (or format) target
+    added before its extension, for the outputs of LyX_base.export."""
+    root, ext = os.path.splitext(name)
+    return "%s-%s%s" % (root, target, ext)
+
+
 def get_encoding(language, inputencoding, format, cjk_encoding):
     " Returns enconding of the lyx file"
     if format > 248:
@@ -175,32 +251,85 @@ def get_encoding(language, inputencoding, format, cjk_encoding):
         return "iso-8859-15"
     return inputencoding
 
+class LyX2LyXError(Exception):
+    """ Raised by LyX_base.error when the conversion can not go on.
+    lyx2lyx quits with an error status when it gets one."""
+    pass
+
+
+class InvalidLyXFile(LyX2LyXError):
+    " Raised when the input is not a LyX file that lyx2lyx can read."
+    pass
+
+
+class UnsupportedFormat(LyX2LyXError):
+    " Raised when lyx2lyx can not convert from or to the formats asked for."
+    pass
+
+
+class ConversionError(LyX2LyXError):
+    """ Raised by convert_bytes and convert_lines when a converter fails.
+    traceback has the formatted traceback of the original exception."""
+
+    def __init__(self, message, traceback = ""):
+        LyX2LyXError.__init__(self, message)
+        self.traceback = traceback
+
 ##
 # Class
 #
 class LyX_base:
     """This class carries all the information of the LyX file."""
 
+    # input files from this size on are mapped in memory
+    mmap_size = 1 << 20
+    # skip the converters whose triggers are not in the document
+    use_triggers = True
+    # apply the consecutive line rules in a single pass
+    use_rules = True
+    # the bytes of the body decoded at a time
+    read_chunk = 1 << 20
+
     def __init__(self, end_format = 0, input = "", output = "", error = "",
                  debug = default_debug__, try_hard = 0, cjk_encoding = '',
-                 final_version = "", language = "english", encoding = "auto"):
+                 final_version = "", language = "english", encoding = "auto",
+                 compresslevel = 9, compact = False, profile = None,
+                 output_name = None):
 
         """Arguments:
         end_format: final format that the file should be converted. (integer)
-        input: the name of the input source, if empty resort to standard input.
-        output: the name of the output file, if empty use the standard output.
-        error: the name of the error file, if empty use the standard error.
+        input: the name of the input source, or a file object, if empty
+               resort to standard input.
+        output: the name of the output file, or a file object, if empty use
+                the standard output.
+        error: the name of the error file, or a file object where the
+               messages are written, if empty use the standard error.
         debug: debug level, O means no debug, as its value increases be more verbose.
+        compresslevel: gzip compression level (1-9) of the output, used
+                       when the input is compressed.
+        compact: keep the body packed, see parser_tools.PackedBlocks, to
+                 use less memory at the cost of time.
+        profile: a profiling.ConversionProfile, that records the cost of
+                 every converter. The body of a profiled conversion is
+                 not streamed.
+        output_name: the name of the output file recorded in the gzip
+                     header of a compressed output, when output is written
+                     under another name first (by default its own name).
         """
-        self.choose_io(input, output)
+        self.choose_io(input, output, compresslevel, output_name)
 
-        if error:
+        if hasattr(error, "write"):
+            self.err = error
+        elif error:
             self.err = open(error, "w")
+            self.opened.append(self.err)
         else:
             self.err = sys.stderr
 
         self.debug = debug
         self.try_hard = try_hard
+        self.compact = compact
+        self.profile = profile
         self.cjk_encoding = cjk_encoding
 
         if end_format:
@@ -242,9 +371,15 @@ class LyX_base:
         # layout of the text class. LyX will parse it as default layout.
         # FIXME: Read the layout file and use the real default layout
         self.default_layout = ''
-        self.header = []
+        self.header = HeaderLines()
         self.preamble = []
-        self.body = []
+        self.body = IndexedLines()
+        # the body left in the input by read_stream, and its encoding
+        self.stream = None
+        # what convert_stream leaves for convert_paragraph
+        self.stages = []
+        # the formats written by write_copy
+        self.written = []
         self.status = 0
         self.encoding = encoding
         self.language = language
@@ -257,12 +392,13 @@ class LyX_base:
             self.err.write("Warning: " + message + "\n")
 
 
-    def error(self, message):
-        " Emits a warning and exits if not in try_hard mode."
+    def error(self, message, exception = LyX2LyXError):
+        """ Emits a warning and raises exception, LyX2LyXError or one of
+        its subclasses, if not in try_hard mode."""
         self.warning(message)
         if not self.try_hard:
             self.warning("Quitting.")
-            sys.exit(1)
+            raise exception(message)
 
         self.status = 2
 
@@ -271,18 +407,38 @@ class LyX_base:
         """Reads a file into the self.header and
         self.body parts, from self.input."""
 
-        while True:
-            line = self.input.readline()
-            if not line:
-                self.error("Invalid LyX file.")
+        data = self.read_input()
+        pos = self.read_header(iter_lines(data))
+        self.read_body_data(data, pos)
+        if isinstance(data, mmap_type):
+            data.close()
+
+
+    def read_stream(self):
+        """ Reads the header and the preamble from self.input, and leaves
+        the body there: write streams it through the conversion, when
+        convert finds that it can, see streamable."""
+        lines = iter(self.input.readline, "")
+        self.read_header(((line, 0) for line in lines))
+        self.stream = (self.input, self.encoding)
 
+
+    def load_body(self):
+        " Reads the body that read_stream left in self.input."
+        input, encoding = self.stream
+        self.stream = None
+        self.read_body_data(input.read(), 0)
+
+
+    def read_header(self, lines):
+        """ Reads the header, the preamble and the first line of the body
+        from lines, that yields each line with the position after it.
+        Returns the position after the last line read."""
+        pos = 0
+        for line, pos in lines:
             line = trim_eol(line)
             if check_token(line, '\\begin_preamble'):
-                while 1:
-                    line = self.input.readline()
-                    if not line:
-                        self.error("Invalid LyX file.")
-
+                for line, pos in lines:
                     line = trim_eol(line)
                     if check_token(line, '\\end_preamble'):
                         break
@@ -296,6 +452,9 @@ class LyX_base:
                                      "for the best.")
 
                     self.preamble.append(line)
+                else:
+                    self.error("Invalid LyX file.", InvalidLyXFile)
+                    break
 
             if check_token(line, '\\end_preamble'):
                 continue
@@ -310,6 +469,8 @@ class LyX_base:
                 break
 
             self.header.append(line)
+        else:
+            self.error("Invalid LyX file.", InvalidLyXFile)
 
         i = find_token(self.header, '\\textclass', 0)
         if i == -1:
@@ -330,21 +491,71 @@ class LyX_base:
         self.initial_version = self.read_version()
 
         # Second pass over header and preamble, now we know the file encoding
-        for i in range(len(self.header)):
-            self.header[i] = self.header[i].decode(self.encoding)
-        for i in range(len(self.preamble)):
-            self.preamble[i] = self.preamble[i].decode(self.encoding)
-
-        # Read document body
-        while 1:
-            line = self.input.readline().decode(self.encoding)
-            if not line:
-                break
-            self.body.append(trim_eol(line))
+        for lines in (self.header, self.preamble):
+            for i in range(len(lines)):
+                if isinstance(lines[i], str):
+                    lines[i] = lines[i].decode(self.encoding)
+        return pos
+
+
+    def read_body_data(self, data, pos):
+        """ Adds the lines of data, from pos on, to self.body. The body is
+        decoded one piece at a time, so that it is never in memory both
+        whole and in lines."""
+        size = len(data)
+        while pos < size:
+            end = data.find('\n', min(pos + self.read_chunk, size)) + 1
+            if not end:
+                end = size
+            self.read_body(split_lines(unicode(buffer(data, pos, end - pos),
+                                               self.encoding)))
+            pos = end
+
+
+    def read_body(self, lines):
+        " Adds lines, decoded, to self.body."
+        if self.compact:
+            if not isinstance(self.body, PackedBlocks):
+                self.body = IndexedPackedBlocks(self.body)
+            self.body.extend(lines)
+            return
+        # the short lines that repeat, as \end_layout, are kept only once
+        self.body.extend(intern_lines(lines))
+
+        if len(self.body) >= IndexedBlocks.least:
+            # the converters insert and delete lines all over the body
+            self.body = IndexedBlocks(self.body)
+
+
+    def read_input(self):
+        """ Returns the whole content of self.input. Large regular files
+        are mapped in memory instead of read."""
+        if mmap is not None and isinstance(self.input, file):
+            try:
+                fileno = self.input.fileno()
+                size = os.fstat(fileno).st_size
+                if size >= self.mmap_size and self.input.tell() == 0:
+                    return mmap.mmap(fileno, 0, access = mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError, mmap.error):
+                pass
+        return self.input.read()
 
 
     def write(self):
         " Writes the LyX file to self.output."
+        header = self.output_header()
+        write_lines(self.output, header, self.encoding)
+        self.output.write("\n")
+        if self.stream is None:
+            write_lines(self.output, self.body, self.encoding)
+        else:
+            self.write_stream()
+
+
+    def output_header(self):
+        """ Sets the version, format and text class of the header, and the
+        encoding of the output. Returns the lines of the header to write,
+        with the preamble."""
         self.set_version()
         self.set_format()
         self.set_textclass()
@@ -354,36 +565,82 @@ class LyX_base:
         if self.preamble:
             i = find_token(self.header, '\\textclass', 0) + 1
             preamble = ['\\begin_preamble'] + self.preamble + ['\\end_preamble']
-            header = self.header[:i] + preamble + self.header[i:]
-        else:
-            header = self.header
-
-        for line in header + [''] + self.body:
-            self.output.write(line.encode(self.encoding)+"\n")
-
-
-    def choose_io(self, input, output):
+            return self.header[:i] + preamble + self.header[i:]
+        return self.header
+
+
+    def write_stream(self, chunk = 4096):
+        """ Writes the body that read_stream left in self.input, converting
+        it one outermost paragraph at a time, see convert_paragraph. The
+        converted lines are written in chunks of about chunk lines, so that
+        the memory used grows only with the largest paragraph."""
+        input, input_encoding = self.stream
+        self.stream = None
+        encoding = self.encoding
+        state = self.__dict__.copy()
+        del state["status"]
+        body = itertools.chain([line + "\n" for line in self.body],
+                               read_lines(input))
+        pending = []
+        for paragraph in iter_paragraphs(body):
+            paragraph = split_lines(unicode("".join(paragraph), input_encoding))
+            pending.extend(self.convert_paragraph(paragraph))
+            if len(pending) >= chunk:
+                write_lines(self.output, pending, encoding)
+                pending = []
+        write_lines(self.output, pending, encoding)
+        # the converters saw the settings of their own steps
+        self.__dict__.update(state)
+        self.body = IndexedLines()
+
+
+    def choose_io(self, input, output, compresslevel = 9, output_name = None):
         """Choose input and output streams, dealing transparently with
-        compressed files."""
-
-        if output:
+        compressed files, that are written back with compresslevel, under
+        output_name in the gzip header if given. The streams opened here
+        are kept in self.opened, so that close() can release them."""
+
+        self.opened = []
+        # the output is compressed, with compresslevel, as the input
+        self.compressed = False
+        self.compresslevel = compresslevel
+        if hasattr(output, "write"):
+            self.output = output
+        elif output:
             self.output = open(output, "wb")
+            self.opened.append(self.output)
         else:
             self.output = sys.stdout
 
-        if input and input != '-':
+        if hasattr(input, "read"):
+            self.dir = ''
+            self.input = input
+        elif input and input != '-':
             self.dir = os.path.dirname(os.path.abspath(input))
-            try:
-                gzip.open(input).readline()
-                self.input = gzip.open(input)
-                self.output = gzip.GzipFile(mode="wb", fileobj=self.output)
-            except:
-                self.input = open(input)
+            self.input = open(input, "rb")
+            self.opened.append(self.input)
+            if self.input.read(2) == gzip_magic:
+                self.input.seek(0)
+                self.input = gzip.GzipFile(mode="rb", fileobj=self.input)
+                self.opened.append(self.input)
+                self.compressed = True
+                self.output = gzip.GzipFile(output_name, mode="wb",
+                                            fileobj=self.output,
+                                            compresslevel=compresslevel)
+                self.opened.append(self.output)
+            else:
+                self.input.seek(0)
         else:
             self.dir = ''
             self.input = sys.stdin
 
 
+    def close(self):
+        " Close the files opened by lyx2lyx."
+        while self.opened:
+            self.opened.pop().close()
+
+
     def lyxformat(self, format):
         " Returns the file format representation, an integer."
         result = format_re.match(format)
@@ -392,12 +649,14 @@ class LyX_base:
         elif format == '2':
             format = 200
         else:
-            self.error(str(format) + ": " + "Invalid LyX file.")
+            self.error(str(format) + ": " + "Invalid LyX file.",
+                       InvalidLyXFile)
 
-        if format in formats_list():
+        if format in supported_formats:
             return format
 
-        self.error(str(format) + ": " + "Format not supported.")
+        self.error(str(format) + ": " + "Format not supported.",
+                   UnsupportedFormat)
         return None
 
 
@@ -440,7 +699,7 @@ class LyX_base:
             if result:
                 return self.lyxformat(result.group(1))
         else:
-            self.error("Invalid LyX File.")
+            self.error("Invalid LyX File.", InvalidLyXFile)
         return None
 
 
@@ -450,26 +709,21 @@ class LyX_base:
             format = str(float(self.format)/100)
         else:
             format = str(self.format)
-        i = find_token(self.header, "\\lyxformat", 0)
-        self.header[i] = "\\lyxformat %s" % format
+        self.header.set("\\lyxformat", format)
 
 
     def set_textclass(self):
-        i = find_token(self.header, "\\textclass", 0)
-        self.header[i] = "\\textclass %s" % self.textclass
+        self.header.set("\\textclass", self.textclass)
 
 
     #Note that the module will be added at the END of the extant ones
     def add_module(self, module):
-      i = find_token(self.header, "\\begin_modules", 0)
+      i = self.header.position("\\begin_modules")
       if i == -1:
         #No modules yet included
-        i = find_token(self.header, "\\textclass", 0)
-        if i == -1:
-          self.warning("Malformed LyX document: No \\textclass!!")
-          return
         modinfo = ["\\begin_modules", module, "\\end_modules"]
-        self.header[i + 1: i + 1] = modinfo
+        if not self.header.insert_after("\\textclass", modinfo):
+          self.warning("Malformed LyX document: No \\textclass!!")
         return
       j = find_token(self.header, "\\end_modules", i)
       if j == -1:
@@ -482,7 +736,7 @@ class LyX_base:
 
 
     def get_module_list(self):
-      i = find_token(self.header, "\\begin_modules", 0)
+      i = self.header.position("\\begin_modules")
       if (i == -1):
         return []
       j = find_token(self.header, "\\end_modules", i)
@@ -490,16 +744,12 @@ class LyX_base:
 
 
     def set_module_list(self, mlist):
-      modbegin = find_token(self.header, "\\begin_modules", 0)
+      modbegin = self.header.position("\\begin_modules")
       newmodlist = ['\\begin_modules'] + mlist + ['\\end_modules']
       if (modbegin == -1):
         #No modules yet included
-        tclass = find_token(self.header, "\\textclass", 0)
-        if tclass == -1:
+        if not self.header.insert_after("\\textclass", newmodlist):
           self.warning("Malformed LyX document: No \\textclass!!")
-          return
-        modbegin = tclass + 1
-        self.header[modbegin:modbegin] = newmodlist
         return
       modend = find_token(self.header, "\\end_modules", modbegin)
       if modend == -1:
@@ -511,11 +761,8 @@ class LyX_base:
 
     def set_parameter(self, param, value):
         " Set the value of the header parameter."
-        i = find_token(self.header, '\\' + param, 0)
-        if i == -1:
+        if not self.header.set('\\' + param, str(value)):
             self.warning('Parameter not found in the header: %s' % param, 3)
-            return
-        self.header[i] = '\\%s %s' % (param, str(value))
 
 
     def is_default_layout(self, layout):
@@ -526,11 +773,129 @@ class LyX_base:
         return 0
 
 
-    def convert(self):
-        "Convert from current (self.format) to self.end_format."
+    def convert(self, outputs = {}):
+        """Convert from current (self.format) to self.end_format. outputs
+        maps formats on the way to the lists of outputs where the document
+        is written when it gets to them, see export."""
         mode, conversion_chain = self.chain()
         self.warning("conversion chain: " + str(conversion_chain), 3)
-
+        steps = self.conversion_steps(mode, conversion_chain)
+        if self.stream is not None:
+            steps = list(steps)
+            if not outputs and self.profile is None and \
+               self.streamable(steps):
+                self.convert_stream(steps)
+                return
+            self.load_body()
+        for output in outputs.get(self.format, ()):
+            self.write_copy(output)
+        # the line rules waiting to be applied
+        rules = []
+
+        for version, table in steps:
+            for conv in table:
+                if isinstance(conv, LineRule) and self.use_rules:
+                    # applied along with the rules that follow it
+                    rules.append(conv)
+                    continue
+                if rules:
+                    self.apply_rules(rules, version)
+                    rules = []
+                if not self.triggered(conv):
+                    self.warning("Skipped %s, nothing to convert" %
+                                 str(conv), default_debug__ + 1)
+                    if self.profile is not None:
+                        self.profile.skipped(self, str(conv), version)
+                    continue
+                self.run_converter(conv, str(conv), version)
+            self.format = version
+            if version in outputs:
+                if rules:
+                    self.apply_rules(rules, version)
+                    rules = []
+                for output in outputs[version]:
+                    self.write_copy(output)
+        if rules:
+            self.apply_rules(rules, self.format)
+
+
+    def export(self, targets):
+        """ Converts the document to several formats in a single run, and
+        writes it out as it gets to each one of them.
+
+        targets is a list of pairs (target, output), where target is a
+        version, as final_version, or a format, as end_format, and output
+        is a file name or a file object. The targets must all be older, or
+        all newer, than the document: the conversion goes to the farthest
+        one, through the others."""
+        outputs = {}
+        versions = {}
+        for target, output in targets:
+            format, version = self.target_format(target)
+            outputs.setdefault(format, []).append(output)
+            versions[format] = version
+        formats = outputs.keys()
+        formats.sort()
+        if formats[-1] <= self.format:
+            self.end_format = formats[0]
+        elif formats[0] >= self.format:
+            self.end_format = formats[-1]
+        else:
+            self.error("The targets are not all on the same side of"
+                       " format %d." % self.format, UnsupportedFormat)
+            return
+        self.final_version = versions[self.end_format]
+        self.convert(outputs)
+        for format in formats:
+            if format not in self.written:
+                self.warning("The conversion did not go through format"
+                             " %d, nothing written." % format)
+
+
+    def target_format(self, target):
+        """ Returns the format and the version of target, a version as
+        final_version or else a format as end_format."""
+        for step in format_relation:
+            if target in step[2]:
+                return step[1][-1], target
+        format = self.lyxformat(target)
+        for step in format_relation:
+            if format in step[1]:
+                return format, step[2][1]
+        return format, ""
+
+
+    def write_copy(self, output):
+        """ Writes the document as it is now to output, a file name or a
+        file object, and goes on with the conversion. Written to a file
+        name, the copy is compressed if the input was."""
+        self.written.append(self.format)
+        # write only changes the header
+        document = copy.copy(self)
+        document.header = HeaderLines(self.header)
+        document.preamble = self.preamble[:]
+        if hasattr(output, "write"):
+            document.output = output
+            document.write()
+            return
+        stream = open(output, "wb")
+        try:
+            document.output = stream
+            if self.compressed:
+                document.output = gzip.GzipFile(mode = "wb", fileobj = stream,
+                    compresslevel = self.compresslevel)
+            document.write()
+            if self.compressed:
+                document.output.close()
+        finally:
+            stream.close()
+
+
+    def conversion_steps(self, mode, conversion_chain):
+        """ Yields the steps of the modules in conversion_chain, each one
+        as a pair (version, table of converters), that take the document
+        from self.format to self.end_format."""
+        format = self.format
         for step in conversion_chain:
             steps = getattr(__import__("lyx_" + step), mode)
 
@@ -538,36 +903,133 @@ class LyX_base:
                          default_debug__ + 1)
             if not steps:
                 self.error("The conversion to an older "
-                "format (%s) is not implemented." % self.format)
+                "format (%s) is not implemented." % format, UnsupportedFormat)
 
             multi_conv = len(steps) != 1
             for version, table in steps:
                 if multi_conv and \
-                   (self.format >= version and mode == "convert") or\
-                   (self.format <= version and mode == "revert"):
+                   (format >= version and mode == "convert") or\
+                   (format <= version and mode == "revert"):
                     continue
-
-                for conv in table:
-                    init_t = time.time()
-                    try:
-                        conv(self)
-                    except:
-                        self.warning("An error ocurred in %s, %s" %
-                                     (version, str(conv)),
-                                     default_debug__)
-                        if not self.try_hard:
-                            raise
-                        self.status = 2
-                    else:
-                        self.warning("%lf: Elapsed time on %s" %
-                                     (time.time() - init_t,
-                                      str(conv)), default_debug__ +
-                                     1)
-                self.format = version
-                if self.end_format == self.format:
+                yield version, table
+                format = version
+                if self.end_format == format:
                     return
 
 
+    def streamable(self, steps):
+        """ Returns True if all the converters of steps are at most
+        paragraph_local (see parser_tools.get_locality), so that the
+        body can be streamed through them."""
+        for version, table in steps:
+            for conv in table:
+                if get_locality(conv) > paragraph_local:
+                    return False
+        return True
+
+
+    def convert_stream(self, steps):
+        """ Converts the header and the preamble along steps, and leaves
+        in self.stages what convert_paragraph applies to every paragraph
+        of the body, as write streams it. Each paragraph_local converter
+        is given the settings of the document at its own step."""
+        self.stages = []
+        rewrites = []
+        for version, table in steps:
+            for conv in table:
+                if isinstance(conv, LineRule):
+                    if conv.prepare is not None:
+                        self.run_converter(conv.prepare, str(conv), version)
+                    rewrites.extend(conv.rewrites)
+                    continue
+                if rewrites:
+                    self.stages.append((None, rewrites, version))
+                    rewrites = []
+                state = self.__dict__.copy()
+                state["header"] = HeaderLines(self.header)
+                state["preamble"] = self.preamble[:]
+                del state["body"], state["status"]
+                self.stages.append((conv, state, version))
+            self.format = version
+        if rewrites:
+            self.stages.append((None, rewrites, self.format))
+
+
+    def convert_paragraph(self, lines):
+        """ Applies self.stages, set by convert_stream, to lines, the
+        lines of an outermost paragraph. Returns the converted lines."""
+        for conv, state, version in self.stages:
+            if conv is None:
+                # the rewrites of consecutive LineRules
+                rewrite_lines(lines, state)
+                continue
+            self.__dict__.update(state)
+            self.body = lines
+            try:
+                conv(self)
+            except:
+                self.warning("An error ocurred in %s, %s" % (version, conv),
+                             default_debug__)
+                if not self.try_hard:
+                    raise
+                self.status = 2
+            lines = self.body
+        return lines
+
+
+    def apply_rules(self, rules, version):
+        " Applies the LineRules rules, with a single pass over the body."
+        self.run_converter(lambda document: apply_rules(document, rules),
+                           ", ".join(map(str, rules)), version)
+
+
+    def run_converter(self, conv, name, version):
+        " Runs the converter conv, named name, of the step to version."
+        init_t = time.time()
+        if self.profile is not None:
+            start = self.profile.start(self)
+        try:
+            conv(self)
+        except:
+            self.warning("An error ocurred in %s, %s" % (version, name),
+                         default_debug__)
+            if not self.try_hard:
+                raise
+            self.status = 2
+            if self.profile is not None:
+                self.profile.stop(start, self, name, version, "failed")
+        else:
+            self.warning("%lf: Elapsed time on %s" %
+                         (time.time() - init_t, name),
+                         default_debug__ + 1)
+            if self.profile is not None:
+                self.profile.stop(start, self, name, version)
+
+
+    def triggered(self, conv):
+        """ Returns False if conv declares its triggers (see
+        parser_tools.triggers) and the document has none of them, so
+        that running conv would not change anything."""
+        tokens = getattr(conv, "triggers", None)
+        if tokens is None or not self.use_triggers:
+            return True
+        # the header and preamble are short enough to be scanned, the
+        # body keeps a histogram that follows its changes
+        for line in self.header:
+            if line.startswith(tokens):
+                return True
+        for line in self.preamble:
+            if line.startswith(tokens):
+                return True
+        if not isinstance(self.body, LineIndexes):
+            return True
+        histogram = self.body.token_histogram()
+        for token in tokens:
+            if histogram.has(token):
+                return True
+        return False
+
+
     def chain(self):
         """ This is where all the decisions related with the
         conversion are taken.  It returns a list of modules needed to
@@ -595,7 +1057,7 @@ class LyX_base:
                     break
             else:
                 # This should not happen, really.
-                self.error("Format not supported.")
+                self.error("Format not supported.", UnsupportedFormat)
 
         # Find the final step
         for rel in format_relation:
@@ -603,7 +1065,7 @@ class LyX_base:
                 final_step = rel[0]
                 break
         else:
-            self.error("Format not supported.")
+            self.error("Format not supported.", UnsupportedFormat)
 
         # Convertion mode, back or forth
         steps = []
@@ -703,10 +1165,160 @@ class File(LyX_base):
 
     def __init__(self, end_format = 0, input = "", output = "", error = "",
                  debug = default_debug__, try_hard = 0, cjk_encoding = '',
-                 final_version = ''):
+                 final_version = '', compresslevel = 9, stream = False,
+                 compact = False, profile = None, output_name = None):
+        """ With stream, the body is converted while it is written, one
+        paragraph at a time, when the converters allow it."""
         LyX_base.__init__(self, end_format, input, output, error,
-                          debug, try_hard, cjk_encoding, final_version)
-        self.read()
+                          debug, try_hard, cjk_encoding, final_version,
+                          compresslevel = compresslevel, compact = compact,
+                          profile = profile, output_name = output_name)
+        if stream:
+            self.read_stream()
+        else:
+            self.read()
+
+
+class Warnings(list):
+    """ The list of the warnings of a conversion, that is also a file
+    object to give as the error argument of LyX_base."""
+
+    def write(self, text):
+        if text.startswith("Warning: "):
+            text = text[len("Warning: "):]
+        if text.endswith("\n"):
+            text = text[:-1]
+        self.append(text)
+
+
+def convert_data(data, error, compresslevel = 9, dir = "", **options):
+    """ Converts data, the content of a LyX file, compressed with gzip or
+    not, and writes the warnings to error, a file object. The options are
+    those of File. Returns the converted content, compressed as data was,
+    and the status of the conversion, see LyX_base.status."""
+    input = StringIO(data)
+    output = StringIO()
+    compressed = data[:2] == gzip_magic
+    if compressed:
+        input = gzip.GzipFile(mode = "rb", fileobj = input)
+        stream = gzip.GzipFile(mode = "wb", fileobj = output,
+                               compresslevel = compresslevel)
+    else:
+        stream = output
+    document = File(input = input, output = stream, error = error, **options)
+    document.dir = dir
+    document.convert()
+    document.write()
+    if compressed:
+        stream.close()
+    return output.getvalue(), document.status
+
+
+def run_conversion(conversion, *args, **options):
+    """ Returns conversion(*args, **options), with the exceptions that are
+    not a LyX2LyXError turned into a ConversionError."""
+    try:
+        return conversion(*args, **options)
+    except LyX2LyXError:
+        raise
+    except Exception, exception:
+        raise ConversionError("%s: %s" % (exception.__class__.__name__,
+                                          exception), traceback.format_exc())
+
+
+def convert_bytes(data, end_format = 0, final_version = "", try_hard = 0,
+                  cjk_encoding = "", debug = default_debug__,
+                  compresslevel = 9, dir = "", compact = False):
+    """ Converts data, the content of a LyX file, compressed with gzip or
+    not, to end_format or final_version, the latest one by default. dir
+    is the directory of the document, for the files it refers to.
+
+    Returns the converted content, compressed as data was, and the list of
+    the warnings. Raises InvalidLyXFile, UnsupportedFormat or else
+    LyX2LyXError if the document can not be converted, and ConversionError
+    if a converter fails. Nothing is kept between calls, so independent
+    documents can be converted at the same time by several threads. With
+    compact, the document takes less memory but longer to convert."""
+    warnings = Warnings()
+    data, status = run_conversion(convert_data, data, warnings,
+        compresslevel = compresslevel, dir = dir, end_format = end_format,
+        final_version = final_version, try_hard = try_hard,
+        cjk_encoding = cjk_encoding, debug = debug, compact = compact)
+    return data, warnings
+
+
+def convert_lines(header, body, end_format = 0, final_version = "",
+                  try_hard = 0, cjk_encoding = "", debug = default_debug__,
+                  dir = ""):
+    """ Converts the document with the lines header and body, without end
+    of line, either str as in the file or unicode, as convert_bytes does.
+    The header may include the preamble, as in the file.
+
+    Returns the lines of the converted header, preamble included, and
+    body, in unicode, and the list of the warnings."""
+    warnings = Warnings()
+    document = run_conversion(document_of_lines, header, body, warnings,
+        end_format = end_format, final_version = final_version,
+        try_hard = try_hard, cjk_encoding = cjk_encoding, debug = debug)
+    document.dir = dir
+    run_conversion(document.convert)
+    return document.output_header(), list(document.body), warnings
+
+
+def peek_header(path, end_format = 0, final_version = "", cjk_encoding = ""):
+    """ Reads only the header of the LyX file path, compressed with gzip
+    or not, up to the first line of the body. Returns a dictionary with
+
+      creator: the first line, that names the LyX that wrote the file,
+      version: the version of LyX of the file, or None,
+      format, textclass, modules (a list), language, inputencoding and
+      encoding: those of the file,
+      mode and chain: the conversion, as returned by LyX_base.chain, to
+        end_format or final_version, the latest format by default,
+      warnings: the list of the warnings.
+
+    Nothing is converted. Raises InvalidLyXFile or UnsupportedFormat as
+    convert_bytes does, and EnvironmentError if path can not be read."""
+    warnings = Warnings()
+    document = LyX_base(end_format = end_format, input = path,
+                        output = StringIO(), error = warnings,
+                        cjk_encoding = cjk_encoding,
+                        final_version = final_version)
+    try:
+        document.read_stream()
+        mode, chain = document.chain()
+    finally:
+        document.close()
+    creator = ""
+    if document.header and document.header[0][:1] == "#":
+        creator = document.header[0]
+    return {"creator": creator,
+            "version": document.initial_version,
+            "format": document.format,
+            "textclass": document.textclass,
+            "modules": document.get_module_list(),
+            "language": document.language,
+            "inputencoding": document.inputencoding,
+            "encoding": document.encoding,
+            "mode": mode,
+            "chain": chain,
+            "warnings": warnings}
+
+
+def document_of_lines(header, body, error, **options):
+    """ Returns the document, a LyX_base with the options, of the lines
+    header and body, for convert_lines. The warnings go to error."""
+    document = LyX_base(input = StringIO(), output = StringIO(),
+                        error = error, **options)
+    lines = itertools.chain(header, body)
+    document.read_header(((line + "\n", 0) for line in lines))
+    rest = []
+    for line in lines:
+        if isinstance(line, str):
+            line = line.decode(document.encoding)
+        rest.append(line)
+    document.read_body(rest)
+    return document
 
 
 #class NewFile(LyX_base):
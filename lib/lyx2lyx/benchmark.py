@@ -0,0 +1,500 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Benchmarks of lyx2lyx on synthetic documents, to catch the changes
+that make the conversions slower.
+
+generate(paragraphs[, features[, seed]]):
+  Returns the text of a document of format generated_format, with
+  about paragraphs paragraphs, made of the features, among
+    insets: notes, footnotes and branches, nested up to three deep,
+    tables: small tables, with multicolumn cells,
+    ert: ERT insets,
+    languages: paragraphs and words in other languages,
+    beamer: a beamer presentation, with frames, blocks and overlay
+      arguments, instead of an article.
+  The same seed gives the same document.
+
+scenarios:
+  The benchmarks, as (name, features, mode, format), that convert a
+  generated document from format to the latest one, with mode
+  "convert", or revert it from the latest one to format, with mode
+  "revert". The formats are those of the stable releases in
+  LyX.format_relation.
+
+inputs(names, paragraphs[, seed]):
+  Yields the scenarios named names, or all of them, as (name, the
+  document to convert, the format to convert it to).
+
+run(names, paragraphs, repeat):
+  Returns the results of the scenarios named names, with documents
+  of paragraphs paragraphs: the name of every scenario to its best
+  time of repeat conversions, in seconds, and the length of its
+  input, in lines.
+
+compare(results, baseline[, threshold]):
+  Returns the scenarios that are slower in results than in baseline
+  by more than the fraction threshold.
+
+Usage:
+        ./benchmark.py [--paragraphs 500] [--repeat 3] [--save FILE]
+                       [--compare FILE [--threshold 0.2]] [scenario...]
+        ./benchmark.py --generate FILE [--features insets,tables]
+
+Example, for a baseline and then a check against it, that exits with
+status 1 if a scenario got slower:
+        ./benchmark.py --save baseline.json
+        ./benchmark.py --compare baseline.json
+"""
+
+import sys
+import time
+import random
+import optparse
+
+import LyX
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    json = None
+
+# The format of the generated documents
+generated_format = 452
+
+all_features = ["insets", "tables", "ert", "languages", "beamer"]
+article = ["insets", "tables", "ert", "languages"]
+presentation = ["beamer", "insets", "ert", "languages"]
+
+# Scenarios slower than the baseline by less than that many seconds
+# are within the noise of the timings
+noise = 0.01
+
+
+def release_format(step):
+    " The last format of the step of LyX.format_relation named step."
+    for name, formats, versions in LyX.format_relation:
+        if name == step:
+            return formats[-1]
+    raise ValueError("no step %s" % step)
+
+
+scenarios = []
+for kind, features in (("article", article), ("beamer", presentation)):
+    scenarios.append(("%s-convert-%d" % (kind, release_format("1_3")),
+                      features, "convert", release_format("1_3")))
+    for step in ("2_0", "1_5"):
+        scenarios.append(("%s-revert-%d" % (kind, release_format(step)),
+                          features, "revert", release_format(step)))
+
+
+header = """#LyX 2.1 created this file. For more info see http://www.lyx.org/
+\\lyxformat %d
+\\begin_document
+\\begin_header
+\\textclass %s
+\\use_default_options true
+\\maintain_unincluded_children false
+\\language english
+\\language_package default
+\\inputencoding auto
+\\fontencoding global
+\\font_roman default
+\\font_sans default
+\\font_typewriter default
+\\font_math auto
+\\font_default_family default
+\\use_non_tex_fonts false
+\\font_sc false
+\\font_osf false
+\\font_sf_scale 100
+\\font_tt_scale 100
+\\graphics default
+\\default_output_format default
+\\output_sync 0
+\\bibtex_command default
+\\index_command default
+\\paperfontsize default
+\\spacing single
+\\use_hyperref false
+\\papersize default
+\\use_geometry false
+\\use_package amsmath 1
+\\use_package amssymb 1
+\\use_package esint 1
+\\use_package mathdots 1
+\\use_package mathtools 1
+\\use_package mhchem 1
+\\use_package undertilde 1
+\\cite_engine basic
+\\cite_engine_type numerical
+\\biblio_style plain
+\\use_bibtopic false
+\\use_indices false
+\\paperorientation portrait
+\\suppress_date false
+\\justification true
+\\use_refstyle 1
+\\branch sketch
+\\selected 1
+\\filename_suffix 0
+\\color #faf0e6
+\\end_branch
+\\index Index
+\\shortcut idx
+\\color #008000
+\\end_index
+\\secnumdepth 3
+\\tocdepth 3
+\\paragraph_separation indent
+\\paragraph_indentation default
+\\quotes_language english
+\\papercolumns 1
+\\papersides 1
+\\paperpagestyle default
+\\tracking_changes false
+\\output_changes false
+\\html_math_output 0
+\\html_css_as_file 0
+\\html_be_strict false
+\\end_header
+
+\\begin_body
+"""
+
+languages = ["french", "ngerman", "spanish", "italian", "dutch"]
+
+words = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+class Generator:
+    " The parts of a generated document, see generate."
+
+    def __init__(self, features, seed):
+        self.features = features
+        self.random = random.Random(seed)
+
+
+    def text(self, count = 12):
+        " Returns count random words, in a line."
+        return " ".join([self.random.choice(words) for k in range(count)])
+
+
+    def layout(self, name, content):
+        " Returns the lines of a layout named name, with content in it."
+        return ["\\begin_layout " + name] + content + ["\\end_layout", ""]
+
+
+    def inset(self, kind, content, status = "open"):
+        " Returns the lines of an inset of kind, with the layouts content."
+        return ["\\begin_inset " + kind, "status " + status, ""] + \
+               content + ["\\end_inset", ""]
+
+
+    def plain(self, content):
+        " Returns the lines of a Plain Layout with content in it."
+        return self.layout("Plain Layout", content)
+
+
+    def sentence(self):
+        """ Returns the lines of a sentence, with words in another
+        language, if there are languages."""
+        if "languages" not in self.features or self.random.random() < 0.5:
+            return [self.text()]
+        language = self.random.choice(languages)
+        return [self.text(6), "\\lang " + language, self.text(4),
+                "\\lang english", " " + self.text(4)]
+
+
+    def nested(self, depth):
+        " Returns the lines of insets nested depth deep."
+        content = self.sentence()
+        if depth > 1:
+            content = content + self.nested(depth - 1)
+        kind = self.random.choice(["Note Note", "Foot", "Branch sketch",
+                                   "Note Comment"])
+        status = "open"
+        if kind == "Foot":
+            status = "collapsed"
+        return self.inset(kind, self.plain(content), status)
+
+
+    def ert(self):
+        " Returns the lines of an ERT inset."
+        command = self.random.choice(["vspace", "hspace", "textcolor"])
+        return self.inset("ERT", self.plain(["", "\\backslash",
+                                             command + "{1em}"]),
+                          "collapsed")
+
+
+    def table(self):
+        " Returns the lines of a table inset."
+        rows = self.random.randint(2, 5)
+        columns = self.random.randint(2, 4)
+        lines = ["\\begin_inset Tabular",
+                 '<lyxtabular version="3" rows="%d" columns="%d">' %
+                 (rows, columns),
+                 '<features rotate="0" tabularvalignment="middle">']
+        for column in range(columns):
+            lines.append('<column alignment="center" valignment="top">')
+        for row in range(rows):
+            lines.append("<row>")
+            column = 0
+            while column < columns:
+                attributes = ""
+                if column < columns - 1 and self.random.random() < 0.2:
+                    attributes = ' multicolumn="1"'
+                lines.append('<cell%s alignment="center" valignment="top" '
+                             'topline="true" leftline="true" usebox="none">'
+                             % attributes)
+                lines += ["\\begin_inset Text", ""] + \
+                         self.plain([self.text(3)]) + \
+                         ["\\end_inset", "</cell>"]
+                if attributes:
+                    lines += ['<cell multicolumn="2" alignment="center" '
+                              'valignment="top" topline="true" '
+                              'usebox="none">',
+                              "\\begin_inset Text", ""] + \
+                             self.plain([]) + ["\\end_inset", "</cell>"]
+                    column += 1
+                column += 1
+            lines.append("</row>")
+        return lines + ["</lyxtabular>", "", "\\end_inset", ""]
+
+
+    def paragraph(self):
+        " Returns the lines of a paragraph, with some of the features."
+        content = self.sentence()
+        features = self.features
+        if "insets" in features and self.random.random() < 0.3:
+            content += self.nested(self.random.randint(1, 3))
+            content.append(self.text(5))
+        if "ert" in features and self.random.random() < 0.2:
+            content += self.ert()
+            content.append(self.text(5))
+        if "tables" in features and self.random.random() < 0.05:
+            content += self.table()
+        return self.layout("Standard", content)
+
+
+    def argument(self, name, text):
+        " Returns the lines of an argument inset named name."
+        return self.inset("Argument " + name, self.plain([text]))
+
+
+    def frame(self, count):
+        " Returns the lines of a beamer frame, with count paragraphs."
+        lines = self.layout("BeginFrame",
+                            self.argument("1", "<+->") + [self.text(3)])
+        k = 0
+        while k < count:
+            kind = self.random.random()
+            if kind < 0.3:
+                lines += self.layout("Block", self.argument("2", self.text(2)))
+                lines += ["\\begin_deeper"] + self.paragraph() + \
+                         ["\\end_deeper"]
+            elif kind < 0.6:
+                lines += self.layout("Itemize",
+                                     self.argument("item:2", "%d-" % (k + 1))
+                                     + self.sentence())
+            else:
+                lines += self.paragraph()
+            k += 1
+        return lines + self.layout("EndFrame", [])
+
+
+    def body(self, paragraphs):
+        " Returns the lines of the body, with about paragraphs paragraphs."
+        lines = []
+        k = 0
+        while k < paragraphs:
+            if k % 20 == 0 and "beamer" not in self.features:
+                lines += self.layout("Section", [self.text(3)])
+            if "beamer" in self.features:
+                count = self.random.randint(2, 6)
+                if k % 30 == 0:
+                    lines += self.layout("Section", [self.text(3)])
+                lines += self.frame(count)
+                k += count
+            else:
+                lines += self.paragraph()
+                k += 1
+        return lines
+
+
+def generate(paragraphs, features = all_features, seed = 0):
+    " Returns the text of a document, see the module help."
+    textclass = "article"
+    if "beamer" in features:
+        textclass = "beamer"
+    body = Generator(features, seed).body(paragraphs)
+    return header % (generated_format, textclass) + "\n" + \
+           "\n".join(body) + "\n\\end_body\n\\end_document\n"
+
+
+def convert(data, end_format = 0):
+    " Returns data converted to end_format, the latest one by default."
+    return LyX.convert_bytes(data, end_format)[0]
+
+
+def best_time(data, end_format, repeat):
+    " The best time of repeat conversions of data to end_format."
+    best = None
+    for k in range(repeat):
+        start = time.time()
+        convert(data, end_format)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def inputs(names = None, paragraphs = 500, seed = 0):
+    " Yields the scenarios to time, see the module help."
+    latest = LyX.get_end_format()
+    documents = {}
+    for name, features, mode, format in scenarios:
+        if names and name not in names:
+            continue
+        key = tuple(features)
+        if key not in documents:
+            documents[key] = convert(generate(paragraphs, features, seed))
+        data = documents[key]
+        if mode == "convert":
+            # the document reverted to format, which is not timed
+            yield name, convert(data, str(format)), str(latest)
+        else:
+            yield name, data, str(format)
+
+
+def run(names = None, paragraphs = 500, repeat = 3, seed = 0):
+    " Returns the results of the scenarios named names, or all of them."
+    results = {}
+    for name, data, end_format in inputs(names, paragraphs, seed):
+        results[name] = {"seconds": best_time(data, end_format, repeat),
+                         "lines": data.count("\n")}
+    return results
+
+
+def compare(results, baseline, threshold = 0.2):
+    """ Returns the scenarios slower in results than in baseline by more
+    than threshold, as (name, baseline seconds, seconds)."""
+    slower = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]["seconds"]
+        new = results[name]["seconds"]
+        if new > old * (1 + threshold) and new - old > noise:
+            slower.append((name, old, new))
+    return slower
+
+
+def read_results(path):
+    " Returns the results saved in the file path."
+    stream = open(path)
+    try:
+        return json.load(stream)["scenarios"]
+    finally:
+        stream.close()
+
+
+def write_results(path, results, options):
+    " Saves results, obtained with options, in the file path."
+    stream = open(path, "w")
+    try:
+        json.dump({"paragraphs": options.paragraphs,
+                   "repeat": options.repeat, "seed": options.seed,
+                   "python": sys.version.split()[0],
+                   "scenarios": results}, stream, indent = 1,
+                  sort_keys = True)
+        stream.write("\n")
+    finally:
+        stream.close()
+
+
+def main(args = None):
+    parser = optparse.OptionParser(usage = "usage: %prog [options] "
+                                   "[scenario...]")
+    parser.add_option("--paragraphs", type="int", default=500,
+                      help = "the size of the documents, in paragraphs")
+    parser.add_option("--repeat", type="int", default=3,
+                      help = "the conversions of every scenario, of "
+                             "which the fastest one counts")
+    parser.add_option("--seed", type="int", default=0)
+    parser.add_option("--save", metavar="FILE",
+                      help = "save the results in FILE, as a baseline")
+    parser.add_option("--compare", metavar="FILE",
+                      help = "compare the results with the baseline FILE, "
+                             "and fail if a scenario is slower")
+    parser.add_option("--threshold", type="float", default=0.2,
+                      help = "the fraction of its baseline time that a "
+                             "scenario may be slower by, default: 0.2")
+    parser.add_option("--list", action="store_true",
+                      help = "list the scenarios")
+    parser.add_option("--generate", metavar="FILE",
+                      help = "only write a generated document to FILE")
+    parser.add_option("--features", default=",".join(all_features),
+                      help = "the features of the generated document")
+    (options, names) = parser.parse_args(args)
+
+    if options.list:
+        for name, features, mode, format in scenarios:
+            sys.stdout.write("%s: %s\n" % (name, ", ".join(features)))
+        return 0
+    if options.generate:
+        features = options.features.split(",")
+        for feature in features:
+            if feature not in all_features:
+                parser.error("unknown feature %s" % feature)
+        output = open(options.generate, "w")
+        output.write(generate(options.paragraphs, features, options.seed))
+        output.close()
+        return 0
+    for name in names:
+        if name not in [scenario[0] for scenario in scenarios]:
+            parser.error("unknown scenario %s" % name)
+    if json is None and (options.save or options.compare):
+        parser.error("the baselines need python 2.6 or later")
+
+    results = run(names, options.paragraphs, options.repeat, options.seed)
+    baseline = {}
+    if options.compare:
+        baseline = read_results(options.compare)
+    for name in sorted(results):
+        line = "%-22s %8.3fs" % (name, results[name]["seconds"])
+        if name in baseline:
+            line += "  baseline %8.3fs" % baseline[name]["seconds"]
+        sys.stdout.write(line + "\n")
+    if options.save:
+        write_results(options.save, results, options)
+    if options.compare:
+        slower = compare(results, baseline, options.threshold)
+        for name, old, new in slower:
+            sys.stderr.write("%s is %.0f%% slower than the baseline\n" %
+                             (name, (new / old - 1) * 100))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
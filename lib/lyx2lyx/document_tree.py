@@ -0,0 +1,185 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+A structured view of the body of a LyX document, as a tree of its
+layouts, insets and deeper blocks.
+
+Tree(lines):
+  The root of the tree of lines, usually document.body. The nodes
+  only keep the positions of their first and last lines in lines,
+  and the children of a node are only found when they are asked
+  for, so building the tree costs nothing until it is used, and
+  then only for the part of the document that is visited.
+  The tree describes lines as they are when it is built, a new
+  one is needed after lines change.
+
+Node:
+  A layout, an inset or a deeper block. Example, the Argument
+  insets of the Frame layouts:
+    for frame in Tree(document.body).find_all("layout", "Frame"):
+        for arg in frame.find_all("inset", "Argument"):
+            print arg.start, arg.end
+  and, from the other side, the layout that contains line i:
+    node = Tree(document.body).containing(i)
+    layout = node.ancestor("layout")
+'''
+
+from bisect import bisect_right
+
+# The kinds of nodes, by the tokens that start and end them
+begin_kinds = {"\\begin_layout": "layout",
+               "\\begin_inset": "inset",
+               "\\begin_deeper": "deeper"}
+end_kinds = {"\\end_layout": "layout",
+             "\\end_inset": "inset",
+             "\\end_deeper": "deeper"}
+
+
+class Node(object):
+    """ A layout, an inset or a deeper block of lines, that starts on
+    line start and ends on line end. name is what follows the token
+    that starts it, the layout name or the inset type and arguments,
+    as "Argument 1", and is empty for deeper blocks."""
+
+    __slots__ = ("lines", "kind", "name", "start", "end", "parent",
+                 "found", "starts")
+
+    def __init__(self, lines, kind, name, start, end, parent):
+        self.lines = lines
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.parent = parent
+        self.found = None
+        self.starts = None
+
+
+    def __repr__(self):
+        return "<%s %s %d-%d>" % (self.kind, self.name, self.start, self.end)
+
+
+    def children(self):
+        " Returns the nodes directly inside this one, in order."
+        if self.found is None:
+            self.found = self.find_children()
+        return self.found
+
+
+    def find_children(self):
+        """ Finds the nodes directly inside this one, with a single pass
+        over its lines. An end token that does not close the innermost
+        open node is not taken into account."""
+        lines = self.lines
+        children = []
+        # the kinds of the open nodes, the first one is a child
+        opened = []
+        i = self.start
+        for line in lines[self.start + 1:self.end]:
+            i += 1
+            if line[:5] == "\\begi":
+                token = line.split(" ", 1)[0]
+                kind = begin_kinds.get(token)
+                if kind is None:
+                    continue
+                if not opened:
+                    first = i
+                    name = line[len(token):].strip()
+                opened.append(kind)
+            elif line[:5] == "\\end_" and opened:
+                if end_kinds.get(line.split(" ", 1)[0]) != opened[-1]:
+                    continue
+                kind = opened.pop()
+                if not opened:
+                    children.append(Node(lines, kind, name, first, i, self))
+        if opened:
+            # malformed, the last node goes on to the end of this one
+            children.append(Node(lines, opened[0], name, first, self.end - 1,
+                                 self))
+        return children
+
+
+    def is_a(self, kind, name = None):
+        """ Returns True if this node is of kind and, if name is given, is
+        named name, or name followed by arguments, as "Argument 1" is an
+        "Argument" inset."""
+        if self.kind != kind:
+            return False
+        if name is None or self.name == name:
+            return True
+        return self.name[:len(name) + 1] == name + " "
+
+
+    def walk(self):
+        " Yields the nodes inside this one, depth first, in order."
+        stack = [iter(self.children())]
+        while stack:
+            for node in stack[-1]:
+                yield node
+                stack.append(iter(node.children()))
+                break
+            else:
+                stack.pop()
+
+
+    def find_all(self, kind, name = None):
+        " Yields the nodes inside this one of kind, named name, see is_a."
+        for node in self.walk():
+            if node.is_a(kind, name):
+                yield node
+
+
+    def ancestor(self, kind, name = None):
+        """ Returns the innermost node of kind, named name, see is_a, that
+        contains this one, or None."""
+        node = self.parent
+        while node is not None:
+            if node.is_a(kind, name):
+                return node
+            node = node.parent
+        return None
+
+
+    def containing(self, i):
+        """ Returns the innermost node inside this one that contains line
+        i, or this one if there is none."""
+        node = self
+        while True:
+            children = node.children()
+            if node.starts is None:
+                node.starts = [child.start for child in children]
+            k = bisect_right(node.starts, i) - 1
+            if k < 0 or children[k].end < i:
+                return node
+            node = children[k]
+
+
+    def to_lines(self):
+        " Returns the lines of this node, from start to end."
+        return self.lines[max(self.start, 0):self.end + 1]
+
+
+class Tree(Node):
+    """ The root of the tree of all the lines, which are the lines
+    between start = -1 and end = len(lines)."""
+
+    __slots__ = ()
+
+    def __init__(self, lines):
+        Node.__init__(self, lines, "document", "", -1, len(lines), None)
@@ -0,0 +1,96 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+ERT insets, from LaTeX text and back. The text and the lines are built
+as lists that are joined once, so that both take a time linear in the
+size of the inset, even for the unicode lines of the body, which are
+copied whole on every concatenation. lyx2lyx_tools exports both.
+
+put_cmd_in_ert(arg):
+  Here arg should be a list of strings (lines), or a string, which we
+  want to wrap in ERT. Returns a list of strings so wrapped.
+
+get_ert(lines, i):
+  Returns the LaTeX text of the ERT inset that starts on line i of
+  lines, or "" if there is none.
+
+ert_text(lines, start, end):
+  Returns the LaTeX text of the layouts of an ERT inset, that are in
+  lines from start to end, the \\end_inset line.
+'''
+
+from parser_tools import find_end_of_inset
+from unicode_symbols import chars2latex
+
+
+def put_cmd_in_ert(arg):
+    '''
+    arg should be a list of lines we want to wrap in ERT.
+    Returns a list of strings, with the lines so wrapped.
+    '''
+
+    ret = ["\\begin_inset ERT", "status collapsed", "", "\\begin_layout Plain Layout", ""]
+    # It will be faster for us to work with a single string internally.
+    # That way, we only go through the text once.
+    if type(arg) is list:
+      s = "\n".join(arg)
+    else:
+      s = arg
+    s = chars2latex(s)
+    s = s.replace('\\', "\\backslash\n")
+    ret += s.splitlines()
+    ret += ["\\end_layout", "", "\\end_inset"]
+    return ret
+
+
+def get_ert(lines, i):
+    'Convert an ERT inset into LaTeX.'
+    if not lines[i].startswith("\\begin_inset ERT"):
+        return ""
+    j = find_end_of_inset(lines, i)
+    if j == -1:
+        return ""
+    while i < j and not lines[i].startswith("status"):
+        i = i + 1
+    return ert_text(lines, i + 1, j)
+
+
+def ert_text(lines, start, end):
+    " The LaTeX text of the ERT layouts in lines[start:end]."
+    text = []
+    first = True
+    i = start
+    while i < end:
+        line = lines[i]
+        if line == "\\begin_layout Plain Layout":
+            if first:
+                first = False
+            else:
+                text.append("\n")
+            while i + 1 < end and lines[i+1] == "":
+                i = i + 1
+        elif line == "\\end_layout":
+            while i + 1 < end and lines[i+1] == "":
+                i = i + 1
+        elif line == "\\backslash":
+            text.append("\\")
+        else:
+            text.append(line)
+        i = i + 1
+    return "".join(text)
@@ -0,0 +1,287 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 The LyX Team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+""" Convert many LyX files in a single lyx2lyx run.
+
+The files are converted by a pool of worker processes, so that the
+interpreter startup and the import of the conversion modules is paid
+once per worker instead of once per file. The results are either
+written to a mirrored output tree or replace the original files, in
+which case the new file is first written next to the old one and then
+renamed over it."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import traceback
+from StringIO import StringIO
+
+import LyX
+
+try:
+    import multiprocessing
+except ImportError:
+    # python < 2.6, convert the files one after the other
+    multiprocessing = None
+
+
+def find_files(paths):
+    """ Returns a list of (path, relative path) for all the LyX files in
+    paths. Directories are searched recursively, the relative path is
+    the one of the file in the mirrored output tree."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            filenames.sort()
+            for name in filenames:
+                if not name.endswith(".lyx"):
+                    continue
+                fullname = os.path.join(dirpath, name)
+                files.append((fullname, fullname[len(path):].lstrip(os.sep)))
+    return files
+
+
+def read_format(path):
+    " Returns the file format of the LyX file path, or None if not found."
+    try:
+        return LyX.peek_header(path)["format"]
+    except (LyX.LyX2LyXError, EnvironmentError):
+        return None
+
+
+def peek(paths, end_format = 0, final_version = "", out = sys.stdout):
+    """ Writes to out the header of all the LyX files found in paths, as
+    read by LyX.peek_header, with the conversion to end_format or
+    final_version. Returns the exit status of lyx2lyx."""
+    status = 0
+    for input, relname in find_files(paths):
+        try:
+            info = LyX.peek_header(input, end_format, final_version)
+        except (LyX.LyX2LyXError, EnvironmentError), message:
+            out.write("%s\n  error: %s\n" % (input, message))
+            status = 1
+            continue
+        out.write("%s\n" % input)
+        for key in ("creator", "version", "format", "textclass", "modules",
+                    "language", "inputencoding", "encoding", "mode",
+                    "chain", "warnings"):
+            value = info[key]
+            if isinstance(value, list):
+                value = ", ".join(value)
+            if isinstance(value, unicode):
+                value = value.encode("utf8")
+            out.write("  %s: %s\n" % (key, value))
+    return status
+
+
+def make_dirs(path):
+    " Create the directory path, that may be created by other workers too."
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def convert_file(job):
+    """ Convert one file, job is a tuple (input, output, options).
+    Returns a tuple (input, status, elapsed time, messages). The status
+    is one of "converted", "skipped", "errors" (converted ignoring the
+    errors, in try hard mode) and "failed"."""
+    input, output, options = job
+    init_t = time.time()
+    messages = StringIO()
+    tmp = None
+    doc = None
+    try:
+        try:
+            if read_format(input) == options["end_format"]:
+                if output != input:
+                    make_dirs(os.path.dirname(output) or os.curdir)
+                    shutil.copy2(input, output)
+                return (input, "skipped", time.time() - init_t, "")
+
+            outdir = os.path.dirname(output) or os.curdir
+            make_dirs(outdir)
+            fd, tmp = tempfile.mkstemp(suffix = ".tmp", dir = outdir,
+                prefix = "." + os.path.basename(output))
+            os.close(fd)
+
+            if options["cache_dir"]:
+                status = convert_cached(input, tmp, messages, options)
+            else:
+                doc = LyX.File(input = input, output = tmp, error = messages,
+                               debug = options["debug"],
+                               try_hard = options["try_hard"],
+                               cjk_encoding = options["cjk_encoding"],
+                               end_format = str(options["end_format"]),
+                               final_version = options["final_version"],
+                               compresslevel = options["compresslevel"],
+                               stream = True, compact = options["compact"],
+                               output_name = output)
+                doc.convert()
+                doc.write()
+                doc.close()
+                status = doc.status
+
+            shutil.copymode(input, tmp)
+            if os.name == "nt" and os.path.exists(output):
+                # rename does not replace existing files on Windows
+                os.remove(output)
+            os.rename(tmp, output)
+            tmp = None
+            if status:
+                return (input, "errors", time.time() - init_t,
+                        messages.getvalue())
+            return (input, "converted", time.time() - init_t,
+                    messages.getvalue())
+        except LyX.LyX2LyXError:
+            return (input, "failed", time.time() - init_t,
+                    messages.getvalue())
+        except:
+            return (input, "failed", time.time() - init_t,
+                    messages.getvalue() + traceback.format_exc())
+    finally:
+        if tmp is not None:
+            if doc is not None:
+                doc.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def convert_cached(input, output, messages, options):
+    """ Convert input to output, through the cache in options["cache_dir"],
+    see lyx2lyx_cache. Returns the status of the conversion."""
+    import lyx2lyx_cache
+    stream = open(input, "rb")
+    try:
+        data = stream.read()
+    finally:
+        stream.close()
+    stream = open(output, "wb")
+    try:
+        return lyx2lyx_cache.convert(lyx2lyx_cache.Cache(options["cache_dir"]),
+            data, stream, messages, os.path.dirname(os.path.abspath(input)),
+            end_format = str(options["end_format"]),
+            final_version = options["final_version"],
+            try_hard = options["try_hard"],
+            cjk_encoding = options["cjk_encoding"], debug = options["debug"],
+            compresslevel = options["compresslevel"])
+    finally:
+        stream.close()
+
+
+def convert_files(jobs, processes):
+    " Run convert_file on all the jobs, using processes worker processes."
+    if multiprocessing is None or processes == 1 or len(jobs) < 2:
+        return map(convert_file, jobs)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, min(16, len(jobs) // (4 * processes)))
+        results = list(pool.imap_unordered(convert_file, jobs, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def write_summary(results, order, total_t, out):
+    " Write the status of every file, followed by the totals, to out."
+    results = sorted(results, key = lambda result: order[result[0]])
+    counts = {}
+    for input, status, elapsed, messages in results:
+        counts[status] = counts.get(status, 0) + 1
+        out.write("%-9s %8.3fs  %s\n" % (status, elapsed, input))
+        for line in messages.splitlines():
+            out.write("          %s\n" % line)
+
+    out.write("\n%d files in %.3fs:" % (len(results), total_t))
+    for status in ("converted", "skipped", "errors", "failed"):
+        out.write(" %d %s" % (counts.get(status, 0), status))
+    out.write("\n")
+    return counts
+
+
+def main(paths, output = None, jobs = 0, end_format = 0, final_version = "",
+         try_hard = 0, cjk_encoding = "", debug = LyX.default_debug__,
+         compresslevel = 9, compact = False, cache_dir = None):
+    """ Convert all the LyX files found in paths. If output is given,
+    it is the root of the tree where the converted files are written,
+    otherwise the files are converted in place. The files that would be
+    written to the same place fail, unconverted. With cache_dir, the
+    conversions are kept there, see lyx2lyx_cache. Returns the exit
+    status of lyx2lyx."""
+    init_t = time.time()
+
+    # Let LyX_base sort out the destination format and version.
+    target = LyX.LyX_base(end_format = end_format,
+                          final_version = final_version, debug = debug)
+    options = {"end_format" : target.end_format,
+               "final_version" : target.final_version,
+               "try_hard" : try_hard, "cjk_encoding" : cjk_encoding,
+               "debug" : debug, "compresslevel" : compresslevel,
+               "compact" : compact, "cache_dir" : cache_dir}
+
+    files = []
+    sources = {}
+    for input, relname in find_files(paths):
+        if output:
+            destination = os.path.join(output, relname)
+        else:
+            destination = input
+        files.append((input, destination))
+        key = os.path.normcase(os.path.abspath(destination))
+        sources.setdefault(key, []).append(input)
+
+    # The files written to the same destination would overwrite each
+    # other, and race when converted in parallel: none is converted.
+    jobs_list = []
+    results = []
+    order = {}
+    for input, destination in files:
+        order[input] = len(order)
+        key = os.path.normcase(os.path.abspath(destination))
+        if len(sources[key]) > 1:
+            results.append((input, "failed", 0.0,
+                            "Same output %s as %s\n" % (destination,
+                            ", ".join([other for other in sources[key]
+                                       if other != input]) or input)))
+            continue
+        jobs_list.append((input, destination, options))
+
+    if not jobs:
+        if multiprocessing is not None:
+            jobs = multiprocessing.cpu_count()
+        else:
+            jobs = 1
+
+    results.extend(convert_files(jobs_list, jobs))
+    counts = write_summary(results, order, time.time() - init_t, sys.stdout)
+
+    if counts.get("failed"):
+        return 1
+    if counts.get("errors"):
+        return 2
+    return 0
@@ -0,0 +1,339 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX Team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+""" A cache of the conversions, on disk, for the documents that are
+converted again and again unchanged.
+
+The entries are named by a hash of the content of the input, of the
+options that change the result (the destination format and version,
+the CJK encoding, try hard, the debug level and the compression level)
+and of the version of lyx2lyx. Every entry is a file with a header line,
+the warnings of the conversion, and the converted document, so that a
+hit costs the hash of the input and the copy of a file.
+
+An entry is written to a temporary file in the cache directory and then
+renamed, so that several lyx2lyx can share the cache: the readers see
+either the whole entry or none. The entries get the permissions of the
+files of the user, as set by the umask. The entries that are read are
+touched, and when the cache grows past its limit, the ones not read for
+the longest time are removed. The size of the cache is kept in the file
+"size", that every new entry adds to, so that the directory is only
+listed when the cache is full, or once in a while, to count again what
+the lyx2lyx that stored entries at the same time missed.
+
+The cache directory is given with --cache-dir, or else in the
+environment variable LYX2LYX_CACHE_DIR. The documents in the formats
+older than 1.4 are keyed by their directory too, since their conversion
+looks at the files next to them."""
+
+import os
+import re
+import sys
+import time
+import gzip
+import random
+import tempfile
+from StringIO import StringIO
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # python < 2.5
+    from sha import new as sha1
+
+import LyX
+
+# The environment variable with the cache directory
+environment = "LYX2LYX_CACHE_DIR"
+
+# The first word of the entries, with the version of their layout
+magic = "lyx2lyx-cache-1"
+
+# The first format of 1.4, the older ones are converted looking at the
+# files in the directory of the document
+first_format_1_4 = 222
+
+fileformat_re = re.compile(r"\\lyxformat\s+(\d+)")
+
+# The file with the size of the cache, in the cache directory
+size_file = "size"
+
+# The entries stored, on average, between two counts of the size
+recount = 256
+
+# The fraction of its limit that a full cache is brought down to, so
+# that it is not full again at the next entry
+low_water = 0.9
+
+
+def cache_dir(option):
+    """ The cache directory, option if it was given (the empty string
+    turns the cache off), else the one of the environment, or None."""
+    if option is None:
+        option = os.environ.get(environment)
+    return option or None
+
+
+def file_format(data):
+    " The format of data, a LyX file compressed with gzip or not, or 0."
+    head = data[:4096]
+    if data[:2] == LyX.gzip_magic:
+        try:
+            head = gzip.GzipFile(mode = "rb",
+                                 fileobj = StringIO(data)).read(4096)
+        except (IOError, EOFError):
+            return 0
+    match = fileformat_re.search(head)
+    if match is None:
+        return 0
+    return int(match.group(1))
+
+
+class Cache:
+    " The cache in directory, that takes up to limit bytes."
+
+    limit = 256 << 20
+
+    def __init__(self, directory, limit = None):
+        self.directory = directory
+        if limit is not None:
+            self.limit = limit
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another lyx2lyx made it
+                if not os.path.isdir(directory):
+                    raise
+
+
+    def key(self, data, dir = "", **options):
+        """ Returns the key of the conversion of data, in the directory
+        dir, with the options that LyX.convert_data takes."""
+        digest = sha1(magic)
+        digest.update(LyX.version__)
+        for name in ("end_format", "final_version", "cjk_encoding",
+                     "try_hard", "debug", "compresslevel"):
+            digest.update("\0%s=%s" % (name, options.get(name)))
+        if file_format(data) < first_format_1_4:
+            digest.update("\0dir=" + os.path.abspath(dir or os.curdir))
+        digest.update("\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+
+    def path(self, key):
+        " The path of the entry key."
+        return os.path.join(self.directory, key)
+
+
+    def get(self, key, output):
+        """ Copies the converted document of the entry key to output, a
+        file object, and returns its warnings, or returns None if there
+        is no such entry."""
+        try:
+            entry = open(self.path(key), "rb")
+        except IOError:
+            return None
+        try:
+            fields = entry.readline().split()
+            if len(fields) != 2 or fields[0] != magic:
+                return None
+            warnings = entry.read(int(fields[1]))
+            while True:
+                chunk = entry.read(1 << 16)
+                if not chunk:
+                    break
+                output.write(chunk)
+        finally:
+            entry.close()
+        try:
+            # the entries read last are removed last
+            os.utime(self.path(key), None)
+        except OSError:
+            pass
+        return warnings
+
+
+    def write(self, name, parts):
+        """ Writes the strings parts to the file name of the cache, through
+        a temporary file renamed to it. Returns False if it failed."""
+        fd, tmp = tempfile.mkstemp(prefix = ".", dir = self.directory)
+        try:
+            try:
+                stream = os.fdopen(fd, "wb")
+                try:
+                    for part in parts:
+                        stream.write(part)
+                finally:
+                    stream.close()
+                # mkstemp makes files that only the user can read
+                mask = os.umask(0)
+                os.umask(mask)
+                os.chmod(tmp, 0666 & ~mask)
+                if os.name == "nt" and os.path.exists(self.path(name)):
+                    # rename does not replace existing files on Windows
+                    os.remove(self.path(name))
+                os.rename(tmp, self.path(name))
+                tmp = None
+                return True
+            except (IOError, OSError):
+                # a cache that can not be written is no cache
+                return False
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+
+    def put(self, key, data, warnings):
+        " Stores the converted document data, with its warnings, as key."
+        header = "%s %d\n" % (magic, len(warnings))
+        if not self.write(key, (header, warnings, data)):
+            return
+        total = self.size()
+        if total is not None:
+            total += len(header) + len(warnings) + len(data)
+        if total is None or total > self.limit or \
+           random.random() < 1.0 / recount:
+            self.evict()
+        else:
+            self.write(size_file, (str(total),))
+
+
+    def size(self):
+        " The size of the cache in the size file, or None if it is unknown."
+        try:
+            stream = open(self.path(size_file))
+            try:
+                return int(stream.read())
+            finally:
+                stream.close()
+        except (IOError, ValueError):
+            return None
+
+
+    def evict(self):
+        """ Counts the size of the cache and, if it is past its limit,
+        removes the entries read least recently until it is down to
+        low_water of it. Removes as well the temporary files left by the
+        lyx2lyx that were stopped while writing them."""
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name == size_file:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                # removed by another lyx2lyx
+                continue
+            if name.startswith("."):
+                if now - status.st_mtime > 3600:
+                    remove(path)
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+            total += status.st_size
+        if total > self.limit:
+            entries.sort()
+            for mtime, size, path in entries:
+                remove(path)
+                total -= size
+                if total <= self.limit * low_water:
+                    break
+        self.write(size_file, (str(total),))
+
+
+def remove(path):
+    " Removes the file path, that other lyx2lyx may have removed."
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def convert(cache, data, output, error, dir = "", **options):
+    """ Writes data, the content of a LyX file, converted with the options
+    of LyX.convert_data, to the file object output, from cache or else
+    converting it and storing it in cache. The warnings are written to
+    the file object error. Returns the status of the conversion, see
+    LyX_base.status, the conversions with errors are not stored."""
+    key = cache.key(data, dir, **options)
+    warnings = cache.get(key, output)
+    if warnings is not None:
+        error.write(warnings)
+        return 0
+    messages = StringIO()
+    try:
+        converted, status = LyX.convert_data(data, messages, dir = dir,
+                                             **options)
+    finally:
+        warnings = messages.getvalue()
+        if isinstance(warnings, unicode):
+            warnings = warnings.encode("utf-8")
+        error.write(warnings)
+    output.write(converted)
+    if status == 0:
+        cache.put(key, converted, warnings)
+    return status
+
+
+def main(directory, input, output, error, **options):
+    """ Converts the file input to output with cache in directory, as
+    lyx2lyx does, and returns the exit status of lyx2lyx. The options
+    are those of LyX.File."""
+    cache = Cache(directory)
+    if input and input != "-":
+        stream = open(input, "rb")
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+        dir = os.path.dirname(os.path.abspath(input))
+    else:
+        data = sys.stdin.read()
+        dir = ""
+    # Let LyX_base sort out the destination format and version, for the
+    # same conversion to have the same key.
+    target = LyX.LyX_base(end_format = options.pop("end_format", 0),
+                          final_version = options.pop("final_version", ""),
+                          output = StringIO(), error = StringIO())
+    options["end_format"] = str(target.end_format)
+    options["final_version"] = target.final_version
+    options.pop("stream", None)
+
+    opened = []
+    try:
+        if error:
+            error = open(error, "w")
+            opened.append(error)
+        else:
+            error = sys.stderr
+        if output:
+            output = open(output, "wb")
+            opened.append(output)
+        else:
+            output = sys.stdout
+        try:
+            return convert(cache, data, output, error, dir, **options)
+        except LyX.LyX2LyXError:
+            return 1
+    finally:
+        for stream in opened:
+            stream.close()
@@ -0,0 +1,194 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 The LyX Team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+""" A long lived lyx2lyx that converts documents on request.
+
+All the conversion modules (and the unicode symbols table) are loaded
+once, when the server starts. The server then reads requests from the
+standard input, or from the connections to a Unix socket, and answers
+each one in turn.
+
+Every request is a line of the form
+
+  convert <length> [key=value ...]
+
+followed by <length> bytes with the document to convert, that may be
+compressed with gzip. The keys are end_format, final_version, try_hard,
+cjk_encoding, debug, compresslevel and dir (the directory of the
+document), with the same meaning as the lyx2lyx options. The values
+are quoted as in an URL.
+
+Every answer is a line of the form
+
+  <result> <status> <length> <messages length>
+
+followed by <length> bytes with the converted document, compressed if
+the request was, and by the messages of lyx2lyx. The result is "ok" if
+the document was converted, with status 0 or 2 (errors were ignored in
+try hard mode), and "error" otherwise, with status 1 and no document.
+A request with a malformed or unknown option is answered with an error
+as well, while a malformed request line ends the session.
+
+The request "quit" stops the server."""
+
+import os
+import sys
+import traceback
+import urllib
+from StringIO import StringIO
+
+import LyX
+import unicode_symbols
+
+
+# The keys of the options of a request
+option_keys = ("end_format", "final_version", "try_hard", "cjk_encoding",
+               "debug", "compresslevel", "dir")
+
+
+class RequestError(ValueError):
+    " A request that can not be converted, after which the server goes on."
+    pass
+
+
+def preload():
+    """ Import all the conversion modules, and load the unicodesymbols
+    file with the engines the converters use, for the forked servers to
+    share them."""
+    for step in LyX.format_relation:
+        __import__("lyx_" + step[0])
+    unicode_symbols.read_unicodesymbols()
+    unicode_symbols.command_engine()
+    # the (latex, suffix) of chars2latex and chars2commands in the modules
+    for latex, suffix in ((False, "{}"), (True, ""), (True, "{}")):
+        unicode_symbols.char_engine(latex, suffix)
+
+
+def read_request(input):
+    """ Reads a request from input. Returns the document and a dictionary
+    with the conversion options, or None when there are no more requests.
+    Raises RequestError if the options are malformed, once the document
+    is read, and ValueError if the request itself is."""
+    line = input.readline()
+    if not line:
+        return None
+    words = line.split()
+    if not words or words[0] == "quit":
+        return None
+    if words[0] != "convert" or len(words) < 2:
+        raise ValueError("Invalid request: %s" % line.strip())
+
+    try:
+        length = int(words[1])
+    except ValueError:
+        raise ValueError("Invalid request: %s" % line.strip())
+    data = input.read(length)
+    if len(data) != length:
+        raise ValueError("Truncated request.")
+
+    options = {}
+    for word in words[2:]:
+        if "=" not in word:
+            raise RequestError("Invalid option: %s" % word)
+        key, value = word.split("=", 1)
+        if key not in option_keys:
+            raise RequestError("Invalid option: %s" % word)
+        options[key] = urllib.unquote(value)
+    return data, options
+
+
+def write_answer(output, result, status, data, messages):
+    " Writes an answer to output."
+    if isinstance(messages, unicode):
+        messages = messages.encode("utf8")
+    output.write("%s %d %d %d\n" % (result, status, len(data), len(messages)))
+    output.write(data)
+    output.write(messages)
+    output.flush()
+
+
+def convert(data, options):
+    """ Converts the document data with the given options. Returns a
+    tuple (result, status, converted document, messages)."""
+    messages = StringIO()
+    try:
+        data, status = LyX.convert_data(data, messages,
+            compresslevel = int(options.get("compresslevel", 9)),
+            dir = options.get("dir", ""),
+            end_format = options.get("end_format", 0),
+            final_version = options.get("final_version", ""),
+            try_hard = int(options.get("try_hard", 0)),
+            cjk_encoding = options.get("cjk_encoding", ""),
+            debug = int(options.get("debug", LyX.default_debug__)))
+    except LyX.LyX2LyXError:
+        return ("error", 1, "", messages.getvalue())
+    except:
+        return ("error", 1, "", messages.getvalue() + traceback.format_exc())
+    return ("ok", status, data, messages.getvalue())
+
+
+def serve(input, output):
+    " Answers the requests read from input until there are no more."
+    while True:
+        try:
+            request = read_request(input)
+        except RequestError, message:
+            write_answer(output, "error", 1, "", str(message) + "\n")
+            continue
+        except ValueError, message:
+            write_answer(output, "error", 1, "", str(message) + "\n")
+            return
+        if request is None:
+            return
+        write_answer(output, *convert(*request))
+
+
+def serve_socket(path):
+    " Answers the requests from the connections to the Unix socket path."
+    import SocketServer
+
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            serve(self.rfile, self.wfile)
+
+    class Server(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+        pass
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = Server(path, Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def main(socket = None):
+    " Runs the server, on socket if given or else on stdin/stdout."
+    preload()
+    if socket:
+        serve_socket(socket)
+        return 0
+
+    if sys.platform == "win32":
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    serve(sys.stdin, sys.stdout)
+    return 0
@@ -46,6 +46,10 @@ put_cmd_in_ert(arg):
     content = lyx2latex(document[i:j + 1])
     ert = put_cmd_in_ert(content)
     document.body[i:j+1] = ert
+  It is defined, with get_ert, in the ert module.
+
+get_ert(lines, i):
+  Returns the LaTeX text of the ERT inset that starts at lines[i].
 
 lyx2latex(document, lines):
   Here, lines is a list of lines of LyX material we want to convert 
@@ -57,11 +61,17 @@ latex_length(slen):
     (bool, length), where the bool tells us if it was a percentage, and 
     the length is the LaTeX representation.
 
+rename_language(languages, new):
+  Returns a converter that sets the language of the document, and
+  of the text in the body, to new where it is one of languages.
+  Several such converters in a row take a single pass over the body.
+
 '''
 
 import string
-from parser_tools import find_token, find_end_of_inset
-from unicode_symbols import unicode_reps
+from parser_tools import find_token, find_end_of_inset, LineRule
+from unicode_symbols import chars2commands
+from ert import put_cmd_in_ert, get_ert
 
 
 # This will accept either a list of lines or a single line.
@@ -111,62 +121,10 @@ def insert_to_preamble(document, text, index = 0):
     document.preamble[index:index] = text
 
 
-def put_cmd_in_ert(arg):
-    '''
-    arg should be a list of lines we want to wrap in ERT.
-    Returns a list of strings, with the lines so wrapped.
-    '''
-    
-    ret = ["\\begin_inset ERT", "status collapsed", "", "\\begin_layout Plain Layout", ""]
-    # It will be faster for us to work with a single string internally. 
-    # That way, we only go through the unicode_reps loop once.
-    if type(arg) is list:
-      s = "\n".join(arg)
-    else:
-      s = arg
-    for rep in unicode_reps:
-      s = s.replace(rep[1], rep[0].replace('\\\\', '\\'))
-    s = s.replace('\\', "\\backslash\n")
-    ret += s.splitlines()
-    ret += ["\\end_layout", "", "\\end_inset"]
-    return ret
-
-
-def get_ert(lines, i):
-    'Convert an ERT inset into LaTeX.'
-    if not lines[i].startswith("\\begin_inset ERT"):
-        return ""
-    j = find_end_of_inset(lines, i)
-    if j == -1:
-        return ""
-    while i < j and not lines[i].startswith("status"):
-        i = i + 1
-    i = i + 1
-    ret = ""
-    first = True
-    while i < j:
-        if lines[i] == "\\begin_layout Plain Layout":
-            if first:
-                first = False
-            else:
-                ret = ret + "\n"
-            while i + 1 < j and lines[i+1] == "":
-                i = i + 1
-        elif lines[i] == "\\end_layout":
-            while i + 1 < j and lines[i+1] == "":
-                i = i + 1
-        elif lines[i] == "\\backslash":
-            ret = ret + "\\"
-        else:
-            ret = ret + lines[i]
-        i = i + 1
-    return ret
-
-
 def lyx2latex(document, lines):
     'Convert some LyX stuff into corresponding LaTeX stuff, as best we can.'
 
-    content = ""
+    content = []
     ert_end = 0
     note_end = 0
     hspace = ""
@@ -230,11 +188,6 @@ def lyx2latex(document, lines):
           #skip all that stuff
           continue
 
-      # this needs to be added to the preamble because of cases like
-      # \textmu, \textbackslash, etc.
-      add_to_preamble(document, ['% added by lyx2lyx for converted index entries',
-                                 '\\@ifundefined{textmu}',
-                                 ' {\\usepackage{textcomp}}{}'])
       # a lossless reversion is not possible
       # try at least to handle some common insets and settings
       if ert_end >= curline:
@@ -249,8 +202,7 @@ def lyx2latex(document, lines):
           line = line.replace('$', '\\$')
 
           # Do the LyX text --> LaTeX conversion
-          for rep in unicode_reps:
-            line = line.replace(rep[1], rep[0] + "{}")
+          line = chars2commands(line, "{}")
           line = line.replace(r'\backslash', r'\textbackslash{}')
           line = line.replace(r'\series bold', r'\bfseries{}').replace(r'\series default', r'\mdseries{}')
           line = line.replace(r'\shape italic', r'\itshape{}').replace(r'\shape smallcaps', r'\scshape{}')
@@ -261,8 +213,15 @@ def lyx2latex(document, lines):
           line = line.replace(r'\family sans', r'\sffamily{}').replace(r'\family default', r'\normalfont{}')
           line = line.replace(r'\family typewriter', r'\ttfamily{}').replace(r'\family roman', r'\rmfamily{}')
           line = line.replace(r'\InsetSpace ', r'').replace(r'\SpecialChar ', r'')
-      content += line
-    return content
+      content.append(line)
+
+    if content:
+      # this needs to be added to the preamble because of cases like
+      # \textmu, \textbackslash, etc.
+      add_to_preamble(document, ['% added by lyx2lyx for converted index entries',
+                                 '\\@ifundefined{textmu}',
+                                 ' {\\usepackage{textcomp}}{}'])
+    return "".join(content)
 
 
 def latex_length(slen):
@@ -436,3 +395,23 @@ def str2bool(s):
   "'true' goes to True, case-insensitively, and we strip whitespace."
   s = s.strip().lower()
   return s == "true"
+
+
+def rename_language(languages, new):
+  """ Returns a converter that replaces the languages (a list) with new,
+  for the document and in the body. """
+  def prepare(document):
+    if document.language in languages:
+      document.language = new
+      i = find_token(document.header, "\\language", 0)
+      if i != -1:
+        document.header[i] = "\\language " + new
+
+  rewrites = []
+  for language in languages:
+    old = "\\lang " + language
+    # bind old now, it changes with every language
+    rewrite = lambda line, old = old: line.replace(old, "\\lang " + new)
+    rewrites.append((old, rewrite))
+  return LineRule("rename_language %s %s" % (",".join(languages), new),
+                  rewrites, prepare)
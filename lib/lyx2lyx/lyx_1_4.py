@@ -27,6 +27,7 @@ from parser_tools import check_token, find_token, \
                          get_value, is_nonempty_line, \
                          find_tokens, find_end_of, find_beginning_of, find_token_exact, find_tokens_exact, \
                          find_re, find_tokens_backwards
+from parser_tools import triggers
 from sys import stdin
 
 from lyx_0_12 import update_latexaccents
@@ -102,6 +103,7 @@ def del_token(lines, token, start, end):
 # End of helper functions
 ####################################################################
 
+@triggers("\\color default")
 def remove_color_default(document):
     " Remove \color default"
     i = 0
@@ -118,6 +120,7 @@ def add_end_header(document):
     document.header.append("\\end_header");
 
 
+@triggers("\\end_header")
 def rm_end_header(document):
     " Remove \end_header"
     i = find_token(document.header, "\\end_header", 0)
@@ -261,6 +264,7 @@ def revert_bibtex(document):
                                                     "\\begin_inset LatexCommand \\BibTeX")
 
 
+@triggers("\\begin_inset LatexCommand \\lyxparent")
 def remove_insetparent(document):
     " Remove \lyxparent"
     i = 0
@@ -332,6 +336,7 @@ def revert_external_1(document):
         i = i + 1
 
 
+@triggers("\\begin_inset External")
 def revert_external_2(document):
     " Revert inset External. (part II)"
     draft_token = '\tdraft'
@@ -415,6 +420,7 @@ def convert_comment(document):
                 i = i + 1
 
 
+@triggers("\\begin_inset Comment", "\\begin_inset Greyedout")
 def revert_comment(document):
     " Revert comments"
     i = 0
@@ -427,6 +433,7 @@ def revert_comment(document):
         i = i + 1
 
 
+@triggers("\\layout")
 def add_end_layout(document):
     " Add \end_layout"
     i = find_token(document.body, '\\layout', 0)
@@ -501,6 +508,7 @@ def add_end_layout(document):
         return
 
 
+@triggers("\\end_layout")
 def rm_end_layout(document):
     " Remove \end_layout"
     i = 0
@@ -532,6 +540,7 @@ def rm_tracking_changes(document):
     del document.header[i]
 
 
+@triggers("\\change_")
 def rm_body_changes(document):
     " Remove body changes."
     i = 0
@@ -543,6 +552,7 @@ def rm_body_changes(document):
         del document.body[i]
 
 
+@triggers("\\layout")
 def layout2begin_layout(document):
     " \layout -> \begin_layout "
     i = 0
@@ -555,6 +565,7 @@ def layout2begin_layout(document):
         i = i + 1
 
 
+@triggers("\\begin_layout")
 def begin_layout2layout(document):
     " \begin_layout -> \layout "
     i = 0
@@ -832,6 +843,8 @@ parskip}
                 document.body[k:k] = paragraph_below
 
 
+@triggers("\\begin_inset Note", "\\begin_inset Comment",
+          "\\begin_inset Greyedout")
 def convert_note(document):
     " Convert Notes. "
     i = 0
@@ -859,6 +872,9 @@ def revert_note(document):
         i = i + 1
 
 
+@triggers("\\begin_inset Boxed", "\\begin_inset Doublebox",
+          "\\begin_inset Frameless", "\\begin_inset ovalbox",
+          "\\begin_inset Ovalbox", "\\begin_inset Shadowbox")
 def convert_box(document):
     " Convert Boxes. "
     i = 0
@@ -960,6 +976,7 @@ def revert_collapsable(document):
         i = i + 1
 
 
+@triggers("\\begin_inset ERT")
 def convert_ert(document):
     " Convert ERT. "
     i = 0
@@ -990,6 +1007,7 @@ def convert_ert(document):
         i = i + 1
 
 
+@triggers("\\begin_inset ERT")
 def revert_ert(document):
     " Revert ERT. "
     i = 0
@@ -1020,6 +1038,7 @@ def revert_ert(document):
         i = i + 1
 
 
+@triggers("\\begin_inset Minipage")
 def convert_minipage(document):
     """ Convert minipages to the box inset.
     We try to use the same order of arguments as lyx does.
@@ -1549,6 +1568,7 @@ def add_to_preamble(document, text):
     document.preamble.extend(text)
 
 
+@triggers("\\begin_inset Frameless")
 def convert_frameless_box(document):
     " Convert frameless box."
     pos = ['t', 'c', 'b']
@@ -1879,6 +1899,7 @@ def revert_float(document):
         i = i + 1
 
 
+@triggers("\\begin_inset Graphics")
 def convert_graphics(document):
     """ Add extension to documentnames of insetgraphics if necessary.
     """
@@ -2060,6 +2081,7 @@ def revert_cite_engine(document):
     document.header.insert(i, "\\use_natbib " + use_natbib)
 
 
+@triggers("\\paperpackage")
 def convert_paperpackage(document):
     " Convert paper package. "
     i = find_token(document.header, "\\paperpackage", 0)
@@ -2074,6 +2096,7 @@ def convert_paperpackage(document):
         document.header[i] = document.header[i] + ' widemarginsa4'
 
 
+@triggers("\\paperpackage")
 def revert_paperpackage(document):
     " Revert paper package. "
     i = find_token(document.header, "\\paperpackage", 0)
@@ -2089,6 +2112,7 @@ def revert_paperpackage(document):
     document.header[i] = document.header[i].replace(paperpackage, packages[paperpackage])
 
 
+@triggers("\\bullet")
 def convert_bullets(document):
     " Convert bullets. "
     i = 0
@@ -2107,6 +2131,7 @@ def convert_bullets(document):
         i = i + 1
 
 
+@triggers("\\bullet")
 def revert_bullets(document):
     " Revert bullets. "
     i = 0
@@ -2172,6 +2197,7 @@ def remove_begin_body(document):
         del document.body[i]
 
 
+@triggers("\\papersize")
 def normalize_papersize(document):
     r" Normalize \papersize"
     i = find_token(document.header, '\\papersize', 0)
@@ -2186,6 +2212,7 @@ def normalize_papersize(document):
         document.header[i] = '\\papersize custom'
 
 
+@triggers("\\papersize")
 def denormalize_papersize(document):
     r" Revert \papersize"
     i = find_token(document.header, '\\papersize', 0)
@@ -2262,6 +2289,7 @@ def convert_output_changes (document):
     document.header.insert(i+1, '\\output_changes true')
 
 
+@triggers("\\output_changes")
 def revert_output_changes (document):
     " Remove output_changes parameter. "
     i = find_token(document.header, '\\output_changes', 0)
@@ -2270,6 +2298,7 @@ def revert_output_changes (document):
     del document.header[i]
 
 
+@triggers("\\begin_inset ERT")
 def convert_ert_paragraphs(document):
     " Convert paragraph breaks and sanitize paragraphs. "
     forbidden_settings = [
@@ -2344,6 +2373,7 @@ def convert_ert_paragraphs(document):
         i = i + 1
 
 
+@triggers("\\begin_inset ERT")
 def revert_ert_paragraphs(document):
     " Remove double paragraph breaks. "
     i = 0
@@ -2410,6 +2440,7 @@ def convert_french(document):
         i = i + 1
 
 
+@triggers("\\paperpackage")
 def remove_paperpackage(document):
     " Remove paper package. "
     i = find_token(document.header, '\\paperpackage', 0)
@@ -2434,6 +2465,7 @@ def remove_paperpackage(document):
         document.header[i] = "\\papersize default"
 
 
+@triggers("\\quotes_times")
 def remove_quotestimes(document):
     " Remove quotestimes. "
     i = find_token(document.header, '\\quotes_times', 0)
@@ -24,7 +24,9 @@ import unicodedata
 import sys, os
 
 from parser_tools import find_re, find_token, find_token_backwards, find_token_exact, find_tokens, find_end_of, get_value, find_beginning_of, find_nonempty_line
+from parser_tools import triggers, line_rule, header_rule
 from LyX import get_encoding
+from unicode_symbols import get_unicode_chars
 
 
 ####################################################################
@@ -50,6 +52,7 @@ def find_beginning_of_layout(lines, i):
 #  Notes: Framed/Shaded
 #
 
+@triggers("\\begin_inset Note Framed", "\\begin_inset Note Shaded")
 def revert_framed(document):
     "Revert framed notes. "
     i = 0
@@ -201,6 +204,7 @@ def revert_font_settings(document):
         document.warning("Ignoring `\\font_osf = true'")
 
 
+@triggers("\\begin_inset Tabular")
 def revert_booktabs(document):
     " We remove the booktabs flag or everything else will become a mess. "
     re_row = re.compile(r'^<row.*space="[^"]+".*>$')
@@ -254,7 +258,7 @@ necessary parsing in modern formats than in ancient ones.
     lang_re = re.compile(r"^\\lang\s(\S+)")
     inset_re = re.compile(r"^\\begin_inset\s(\S+)")
     if not forward: # no need to read file unless we are reverting
-        spec_chars = read_unicodesymbols()
+        spec_chars = get_unicode_chars()
 
     if document.inputencoding == "auto" or document.inputencoding == "default":
         i = 0
@@ -334,26 +338,6 @@ def revert_utf8(document):
     convert_multiencoding(document, False)
 
 
-def read_unicodesymbols():
-    " Read the unicodesymbols list of unicode characters and corresponding commands."
-    pathname = os.path.abspath(os.path.dirname(sys.argv[0]))
-    fp = open(os.path.join(pathname.strip('lyx2lyx'), 'unicodesymbols'))
-    spec_chars = {}
-    for line in fp.readlines():
-        if line[0] != '#':
-            line=line.replace(' "',' ') # remove all quotation marks with spaces before
-            line=line.replace('" ',' ') # remove all quotation marks with spaces after
-            line=line.replace(r'\"','"') # replace \" by " (for characters with diaeresis)
-            try:
-                # flag1 and flag2 are preamble and other flags
-                [ucs4,command,flag1,flag2] =line.split(None,3)
-                spec_chars[unichr(eval(ucs4))] = [command, flag1, flag2]
-            except:
-                pass
-    fp.close()
-    return spec_chars
-
-
 def revert_unicode_line(document, i, insets, spec_chars, replacement_character = '???'):
     # Define strings to start and end ERT and math insets
     ert_intro='\n\n\\begin_inset ERT\nstatus collapsed\n\\begin_layout %s\n\\backslash\n' % document.default_layout
@@ -433,7 +417,7 @@ document encoding to commands according to the unicodesymbols
 file. Characters that can not be replaced by commands are replaced by
 an replacement string.  Flags other than 'combined' are currently not
 implemented.'''
-    spec_chars = read_unicodesymbols()
+    spec_chars = get_unicode_chars()
     insets = [] # list of active insets
 
     # Go through the document to capture all combining characters
@@ -458,6 +442,7 @@ implemented.'''
             i += len(mod_line.split('\n'))
 
 
+@triggers("\\begin_inset CharStyle")
 def revert_cs_label(document):
     " Remove status flag of charstyle label. "
     i = 0
@@ -480,6 +465,7 @@ def revert_cs_label(document):
         i = i + 1
 
 
+@triggers("\\bibitem")
 def convert_bibitem(document):
     """ Convert
 \bibitem [option]{argument}
@@ -563,6 +549,7 @@ commandparams_info = {
     "url"     : ["name", "", "target"]}
 
 
+@triggers("\\begin_inset LatexCommand")
 def convert_commandparams(document):
     """ Convert
 
@@ -668,6 +655,7 @@ def convert_commandparams(document):
         i = i + 1
 
 
+@triggers("\\begin_inset LatexCommand")
 def revert_commandparams(document):
     regex = re.compile(r'(\S+)\s+(.+)')
     i = 0
@@ -922,6 +910,7 @@ def revert_encodings(document):
     document.inputencoding = get_value(document.header, "\\inputencoding", 0)
 
 
+@triggers("\\begin_layout Caption")
 def convert_caption(document):
     " Convert caption layouts to caption insets. "
     i = 0
@@ -941,6 +930,7 @@ def convert_caption(document):
         i = i + 1
 
 
+@triggers("\\begin_inset Caption")
 def revert_caption(document):
     " Convert caption insets to caption layouts. "
     " This assumes that the text class has a caption style. "
@@ -1440,6 +1430,7 @@ def revert_utf8plain(document):
     document.inputencoding = get_value(document.header, "\\inputencoding", 0)
 
 
+@triggers("\\begin_inset CharStyle Alert")
 def revert_beamer_alert(document):
     " Revert beamer's \\alert inset back to ERT. "
     i = 0
@@ -1459,6 +1450,7 @@ def revert_beamer_alert(document):
         i = i + 1
 
 
+@triggers("\\begin_inset CharStyle Structure")
 def revert_beamer_structure(document):
     " Revert beamer's \\structure inset back to ERT. "
     i = 0
@@ -1526,11 +1518,13 @@ def revert_language_name(document):
 
 #
 #  \textclass cv -> \textclass simplecv
+@header_rule
 def convert_cv_textclass(document):
     if document.textclass == "cv":
         document.textclass = "simplecv"
 
 
+@header_rule
 def revert_cv_textclass(document):
     if document.textclass == "simplecv":
         document.textclass = "cv"
@@ -1538,6 +1532,7 @@ def revert_cv_textclass(document):
 
 #
 # add scaleBeforeRotation graphics param
+@triggers("\\begin_inset Graphics")
 def convert_graphics_rotation(document):
     " add scaleBeforeRotation graphics parameter. "
     i = 0
@@ -1560,6 +1555,7 @@ def convert_graphics_rotation(document):
 
 #
 # remove scaleBeforeRotation graphics param
+@triggers("\\begin_inset Graphics")
 def revert_graphics_rotation(document):
     " remove scaleBeforeRotation graphics parameter. "
     i = 0
@@ -1596,30 +1592,28 @@ def revert_graphics_rotation(document):
 
 
 
-def convert_tableborder(document):
+@line_rule("")
+def convert_tableborder(line):
     # The problem is: LyX doubles the table cell border as it ignores the "|" character in
     # the cell arguments. A fix takes care of this and therefore the "|" has to be removed
-    i = 0
-    while i < len(document.body):
-        h = document.body[i].find("leftline=\"true\"", 0, len(document.body[i]))
-        k = document.body[i].find("|>{", 0, len(document.body[i]))
-        # the two tokens have to be in one line
-        if (h != -1 and k != -1):
-            # delete the "|"
-            document.body[i] = document.body[i][:k] + document.body[i][k+1:len(document.body[i])]
-        i = i + 1
-
-
-def revert_tableborder(document):
-    i = 0
-    while i < len(document.body):
-        h = document.body[i].find("leftline=\"true\"", 0, len(document.body[i]))
-        k = document.body[i].find(">{", 0, len(document.body[i]))
-        # the two tokens have to be in one line
-        if (h != -1 and k != -1):
-            # add the "|"
-            document.body[i] = document.body[i][:k] + '|' + document.body[i][k:]
-        i = i + 1
+    h = line.find("leftline=\"true\"", 0, len(line))
+    k = line.find("|>{", 0, len(line))
+    # the two tokens have to be in one line
+    if (h != -1 and k != -1):
+        # delete the "|"
+        line = line[:k] + line[k+1:len(line)]
+    return line
+
+
+@line_rule("")
+def revert_tableborder(line):
+    h = line.find("leftline=\"true\"", 0, len(line))
+    k = line.find(">{", 0, len(line))
+    # the two tokens have to be in one line
+    if (h != -1 and k != -1):
+        # add the "|"
+        line = line[:k] + '|' + line[k:]
+    return line
 
 
 def revert_armenian(document):
@@ -1944,6 +1938,7 @@ def convert_ext_font_sizes(document):
         del document.header[i]
 
 
+@triggers("\\begin_layout --Separator--")
 def revert_separator_layout(document):
     r'''Revert --Separator-- to a lyx note
 From
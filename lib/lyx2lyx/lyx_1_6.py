@@ -23,6 +23,10 @@ import unicodedata
 import sys, os
 
 from parser_tools import find_token, find_end_of, find_tokens, get_value
+from parser_tools import triggers, line_rule, header_rule
+from lyx2lyx_tools import rename_language
+from tabular import Tabular
+from unicode_symbols import chars2latex, commands2chars
 
 ####################################################################
 # Private helper functions
@@ -66,8 +70,7 @@ def wrap_into_ert(string, src, dst):
       + dst + '\n\\end_layout\n\\end_inset\n')
 
 def put_cmd_in_ert(string):
-    for rep in unicode_reps:
-        string = string.replace(rep[1], rep[0].replace('\\\\', '\\'))
+    string = chars2latex(string)
     string = string.replace('\\', "\\backslash\n")
     string = "\\begin_inset ERT\nstatus collapsed\n\\begin_layout Standard\n" \
       + string + "\n\\end_layout\n\\end_inset"
@@ -145,44 +148,6 @@ def set_option(document, m, option, value):
     return l
 
 
-def read_unicodesymbols():
-    " Read the unicodesymbols list of unicode characters and corresponding commands."
-    pathname = os.path.abspath(os.path.dirname(sys.argv[0]))
-    fp = open(os.path.join(pathname.strip('lyx2lyx'), 'unicodesymbols'))
-    spec_chars = []
-    # Two backslashes, followed by some non-word character, and then a character
-    # in brackets. The idea is to check for constructs like: \"{u}, which is how
-    # they are written in the unicodesymbols file; but they can also be written
-    # as: \"u or even \" u.
-    r = re.compile(r'\\\\(\W)\{(\w)\}')
-    for line in fp.readlines():
-        if line[0] != '#' and line.strip() != "":
-            line=line.replace(' "',' ') # remove all quotation marks with spaces before
-            line=line.replace('" ',' ') # remove all quotation marks with spaces after
-            line=line.replace(r'\"','"') # replace \" by " (for characters with diaeresis)
-            try:
-                [ucs4,command,dead] = line.split(None,2)
-                if command[0:1] != "\\":
-                    continue
-                spec_chars.append([command, unichr(eval(ucs4))])
-            except:
-                continue
-            m = r.match(command)
-            if m != None:
-                command = "\\\\"
-                # If the character is a double-quote, then we need to escape it, too,
-                # since it is done that way in the LyX file.
-                if m.group(1) == "\"":
-                    command += "\\"
-                commandbl = command
-                command += m.group(1) + m.group(2)
-                commandbl += m.group(1) + ' ' + m.group(2)
-                spec_chars.append([command, unichr(eval(ucs4))])
-                spec_chars.append([commandbl, unichr(eval(ucs4))])
-    fp.close()
-    return spec_chars
-
-
 def extract_argument(line):
     'Extracts a LaTeX argument from the start of line. Returns (arg, rest).'
 
@@ -225,23 +190,23 @@ def extract_argument(line):
     return (line[:pos + 1], line[pos + 1:])
 
 
+## FIXME Escaped \ ??
+# This regex looks for a LaTeX command---i.e., something of the form
+# "\alPhaStuFF", or "\X", where X is any character---where the command
+# may also be preceded by an additional backslash, which is how it would
+# appear (e.g.) in an InsetIndex.
+labelre = re.compile(r'(.*?)\\?(\\(?:[a-zA-Z]+|.))(.*)')
+
 def latex2ert(line, isindex):
     '''Converts LaTeX commands into ERT. line may well be a multi-line
        string when it is returned.'''
     if not line:
         return line
 
-    retval = ""
-    ## FIXME Escaped \ ??
-    # This regex looks for a LaTeX command---i.e., something of the form
-    # "\alPhaStuFF", or "\X", where X is any character---where the command
-    # may also be preceded by an additional backslash, which is how it would
-    # appear (e.g.) in an InsetIndex.
-    labelre = re.compile(r'(.*?)\\?(\\(?:[a-zA-Z]+|.))(.*)')
-
+    retval = []
     m = labelre.match(line)
     while m != None:
-        retval += m.group(1)
+        retval.append(m.group(1))
         cmd = m.group(2)
         end = m.group(3)
 
@@ -256,7 +221,7 @@ def latex2ert(line, isindex):
         # appropriate action, i.e., to use arg to get the content and then
         # wrap it appropriately.
         cmd = put_cmd_in_ert(cmd)
-        retval += "\n" + cmd + "\n"
+        retval.append("\n" + cmd + "\n")
         line = end
         m = labelre.match(line)
     # put all remaining braces in ERT
@@ -265,11 +230,12 @@ def latex2ert(line, isindex):
     if isindex:
         # active character that is not available in all font encodings
         line = wrap_into_ert(line, '|', '|')
-    retval += line
-    return retval
+    retval.append(line)
+    return "".join(retval)
 
 
-unicode_reps = read_unicodesymbols()
+# The text before the first formula of a line, the formula and the rest
+mathre = re.compile('^(.*?)(\$.*?\$)(.*)')
 
 #Bug 5022....
 #Might should do latex2ert first, then deal with stuff that DOESN'T
@@ -288,26 +254,7 @@ def latex2lyx(data, isindex):
     retval = []
 
     # Convert LaTeX to Unicode
-    # Commands of this sort need to be checked to make sure they are
-    # followed by a non-alpha character, lest we replace too much.
-    hardone = re.compile(r'^\\\\[a-zA-Z]+$')
-
-    for rep in unicode_reps:
-        if hardone.match(rep[0]):
-            pos = 0
-            while True:
-                pos = data.find(rep[0], pos)
-                if pos == -1:
-                    break
-                nextpos = pos + len(rep[0])
-                if nextpos < len(data) and data[nextpos].isalpha():
-                    # not the end of that command
-                    pos = nextpos
-                    continue
-                data = data[:pos] + rep[1] + data[nextpos:]
-                pos = nextpos
-        else:
-            data = data.replace(rep[0], rep[1])
+    data = commands2chars(data)
 
     # Generic
     # \" -> ":
@@ -316,7 +263,6 @@ def latex2lyx(data, isindex):
     data = data.replace('\\\\', '\\')
 
     # Math:
-    mathre = re.compile('^(.*?)(\$.*?\$)(.*)')
     lines = data.split('\n')
     for line in lines:
         #document.warning("LINE: " + line)
@@ -344,7 +290,9 @@ def latex2lyx(data, isindex):
 
 
 def lyxline2latex(document, line, inert):
-    'Convert some LyX stuff into corresponding LaTeX stuff line-wise, as best we can.'
+    '''Convert some LyX stuff into corresponding LaTeX stuff line-wise, as best we can.
+       Returns None for the lines that are skipped, the callers add the
+       textcomp preamble once if there is any other.'''
     if line.startswith("\\begin_inset Formula"):
         line = line[20:]
     elif line.startswith("\\begin_inset Quotes"):
@@ -373,13 +321,8 @@ def lyxline2latex(document, line, inert):
           line.strip() == "status collapsed" or \
           line.strip() == "status open":
         #skip all that stuff
-        return ""
+        return None
 
-    # this needs to be added to the preamble because of cases like
-    # \textmu, \textbackslash, etc.
-    add_to_preamble(document, ['% added by lyx2lyx for converted entries',
-                               '\\@ifundefined{textmu}',
-                               ' {\\usepackage{textcomp}}{}'])
     # a lossless reversion is not possible
     # try at least to handle some common insets and settings
     if inert:
@@ -393,25 +336,33 @@ def lyxline2latex(document, line, inert):
         line = line.replace('$', '\\${}')
 
         # Do the LyX text --> LaTeX conversion
-        for rep in unicode_reps:
-            line = line.replace(rep[1], rep[0].replace('\\\\', '\\') + "{}")
-            line = line.replace(r'\backslash', r'\textbackslash{}')
-            line = line.replace(r'\series bold', r'\bfseries{}').replace(r'\series default', r'\mdseries{}')
-            line = line.replace(r'\shape italic', r'\itshape{}').replace(r'\shape smallcaps', r'\scshape{}')
-            line = line.replace(r'\shape slanted', r'\slshape{}').replace(r'\shape default', r'\upshape{}')
-            line = line.replace(r'\emph on', r'\em{}').replace(r'\emph default', r'\em{}')
-            line = line.replace(r'\noun on', r'\scshape{}').replace(r'\noun default', r'\upshape{}')
-            line = line.replace(r'\bar under', r'\underbar{').replace(r'\bar default', r'}')
-            line = line.replace(r'\family sans', r'\sffamily{}').replace(r'\family default', r'\normalfont{}')
-            line = line.replace(r'\family typewriter', r'\ttfamily{}').replace(r'\family roman', r'\rmfamily{}')
-            line = line.replace(r'\InsetSpace ', r'').replace(r'\SpecialChar ', r'')
+        line = chars2latex(line, "{}")
+        line = line.replace(r'\backslash', r'\textbackslash{}')
+        line = line.replace(r'\series bold', r'\bfseries{}').replace(r'\series default', r'\mdseries{}')
+        line = line.replace(r'\shape italic', r'\itshape{}').replace(r'\shape smallcaps', r'\scshape{}')
+        line = line.replace(r'\shape slanted', r'\slshape{}').replace(r'\shape default', r'\upshape{}')
+        line = line.replace(r'\emph on', r'\em{}').replace(r'\emph default', r'\em{}')
+        line = line.replace(r'\noun on', r'\scshape{}').replace(r'\noun default', r'\upshape{}')
+        line = line.replace(r'\bar under', r'\underbar{').replace(r'\bar default', r'}')
+        line = line.replace(r'\family sans', r'\sffamily{}').replace(r'\family default', r'\normalfont{}')
+        line = line.replace(r'\family typewriter', r'\ttfamily{}').replace(r'\family roman', r'\rmfamily{}')
+        line = line.replace(r'\InsetSpace ', r'').replace(r'\SpecialChar ', r'')
     return line
 
 
+def add_textcomp_to_preamble(document):
+    " Add the textcomp package needed by the lines converted by lyxline2latex."
+    # this needs to be added to the preamble because of cases like
+    # \textmu, \textbackslash, etc.
+    add_to_preamble(document, ['% added by lyx2lyx for converted entries',
+                               '\\@ifundefined{textmu}',
+                               ' {\\usepackage{textcomp}}{}'])
+
+
 def lyx2latex(document, lines):
     'Convert some LyX stuff into corresponding LaTeX stuff, as best we can.'
     # clean up multiline stuff
-    content = ""
+    content = []
     ert_end = 0
 
     for curline in range(len(lines)):
@@ -422,13 +373,18 @@ def lyx2latex(document, lines):
             ert_end = find_end_of_inset(lines, curline + 1)
             continue
         inert = ert_end >= curline
-        content += lyxline2latex(document, lines[curline], inert)
-      
-    return content
+        line = lyxline2latex(document, lines[curline], inert)
+        if line is not None:
+            content.append(line)
+
+    if content:
+        add_textcomp_to_preamble(document)
+    return "".join(content)
 
 
 ####################################################################
 
+@triggers("\\begin_inset Tabular")
 def convert_ltcaption(document):
     i = 0
     while True:
@@ -480,6 +436,7 @@ def convert_ltcaption(document):
 
 
 #FIXME Use of wrap_into_ert can confuse lyx2lyx
+@triggers("\\begin_inset Tabular")
 def revert_ltcaption(document):
     i = 0
     while True:
@@ -527,119 +484,97 @@ def convert_tablines(document):
                 return
             else:
                 document.body[i] = "\\begin_inset Tabular"
-        j = find_end_of_inset(document.body, i + 1)
-        if j == -1:
+        table = Tabular(document.body, i)
+        if table.end == -1:
             document.warning("Malformed LyX document: Could not find end of tabular.")
             i += 1
             continue
 
-        m = i + 1
-        nrows = int(document.body[i+1].split('"')[3])
-        ncols = int(document.body[i+1].split('"')[5])
+        ncols = len(table.columns)
 
         col_info = []
-        for k in range(ncols):
-            m = find_token(document.body, "<column", m)
-            left = get_option(document, m, 'leftline', 'false')
-            right = get_option(document, m, 'rightline', 'false')
+        for column in table.columns:
+            left = column.get('leftline', 'false')
+            right = column.get('rightline', 'false')
             col_info.append([left, right])
-            remove_option(document, m, 'leftline')
-            remove_option(document, m, 'rightline')
-            m = m + 1
+            column.remove('leftline')
+            column.remove('rightline')
 
         row_info = []
-        for k in range(nrows):
-            m = find_token(document.body, "<row", m)
-            top = get_option(document, m, 'topline', 'false')
-            bottom = get_option(document, m, 'bottomline', 'false')
+        for row in table.rows:
+            top = row.get('topline', 'false')
+            bottom = row.get('bottomline', 'false')
             row_info.append([top, bottom])
-            remove_option(document, m, 'topline')
-            remove_option(document, m, 'bottomline')
-            m = m + 1
-
-        m = i + 1
-        mc_info = []
-        for k in range(nrows*ncols):
-            m = find_token(document.body, "<cell", m)
-            mc_info.append(get_option(document, m, 'multicolumn', '0'))
-            m = m + 1
-        m = i + 1
-        for l in range(nrows):
-            for k in range(ncols):
-                m = find_token(document.body, '<cell', m)
-                if mc_info[l*ncols + k] == '0':
-                    r = set_option(document, m, 'topline', row_info[l][0])
-                    r = set_option(document, m, 'bottomline', row_info[l][1])
-                    r = set_option(document, m, 'leftline', col_info[k][0])
-                    r = set_option(document, m, 'rightline', col_info[k][1])
-                elif mc_info[l*ncols + k] == '1':
+            row.remove('topline')
+            row.remove('bottomline')
+
+        for l, row in enumerate(table.rows):
+            mc_info = [cell.get('multicolumn', '0') for cell in row.cells]
+            for k, cell in enumerate(row.cells[:ncols]):
+                if mc_info[k] == '0':
+                    cell.set('topline', row_info[l][0])
+                    cell.set('bottomline', row_info[l][1])
+                    cell.set('leftline', col_info[k][0])
+                    cell.set('rightline', col_info[k][1])
+                elif mc_info[k] == '1':
                     s = k + 1
-                    while s < ncols and mc_info[l*ncols + s] == '2':
+                    while s < ncols and mc_info[s] == '2':
                         s = s + 1
-                    if s < ncols and mc_info[l*ncols + s] != '1':
-                        r = set_option(document, m, 'rightline', col_info[k][1])
-                    if k > 0 and mc_info[l*ncols + k - 1] == '0':
-                        r = set_option(document, m, 'leftline', col_info[k][0])
-                m = m + 1
-        i = j + 1
+                    if s < ncols and mc_info[s] != '1':
+                        cell.set('rightline', col_info[k][1])
+                    if k > 0 and mc_info[k - 1] == '0':
+                        cell.set('leftline', col_info[k][0])
+        table.write()
+        # there could be a tabular inside this one
+        i += 1
 
 
+@triggers("\\begin_inset Tabular")
 def revert_tablines(document):
     i = 0
     while True:
         i = find_token(document.body, "\\begin_inset Tabular", i)
         if i == -1:
             return
-        j = find_end_of_inset(document.body, i)
-        if j == -1:
+        table = Tabular(document.body, i)
+        if table.end == -1:
             document.warning("Malformed LyX document: Could not find end of tabular.")
             i += 1
             continue
 
-        m = i + 1
-        nrows = int(document.body[i+1].split('"')[3])
-        ncols = int(document.body[i+1].split('"')[5])
+        rows = table.rows
+        ncols = len(table.columns)
 
         lines = []
-        for k in range(nrows*ncols):
-            m = find_token(document.body, "<cell", m)
-            top = get_option(document, m, 'topline', 'false')
-            bottom = get_option(document, m, 'bottomline', 'false')
-            left = get_option(document, m, 'leftline', 'false')
-            right = get_option(document, m, 'rightline', 'false')
-            lines.append([top, bottom, left, right])
-            m = m + 1
+        for row in rows:
+            for cell in row.cells[:ncols]:
+                top = cell.get('topline', 'false')
+                bottom = cell.get('bottomline', 'false')
+                left = cell.get('leftline', 'false')
+                right = cell.get('rightline', 'false')
+                lines.append([top, bottom, left, right])
 
         # we will want to ignore longtable captions
-        m = i + 1
         caption_info = []
-        for k in range(nrows):
-            m = find_token(document.body, "<row", m)
-            caption = get_option(document, m, 'caption', 'false')
+        for row in rows:
+            caption = row.get('caption', 'false')
             caption_info.append([caption])
-            m = m + 1
 
-        m = i + 1
-        col_info = []
-        for k in range(ncols):
-            m = find_token(document.body, "<column", m)
+        for k, column in enumerate(table.columns):
             left = 'true'
-            for l in range(nrows):
+            for l in range(len(rows)):
                 left = lines[l*ncols + k][2]
                 if left == 'false' and caption_info[l] == 'false':
                     break
-            set_option(document, m, 'leftline', left)
+            column.set('leftline', left)
             right = 'true'
-            for l in range(nrows):
+            for l in range(len(rows)):
                 right = lines[l*ncols + k][3]
                 if right == 'false' and caption_info[l] == 'false':
                     break
-            set_option(document, m, 'rightline', right)
-            m = m + 1
+            column.set('rightline', right)
 
-        row_info = []
-        for k in range(nrows):
-            m = find_token(document.body, "<row", m)
+        for k, row in enumerate(rows):
             top = 'true'
             for l in range(ncols):
                 top = lines[k*ncols + l][0]
@@ -647,7 +582,7 @@ def revert_tablines(document):
                     break
             if caption_info[k] == 'false':
                 top = 'false'
-            set_option(document, m, 'topline', top)
+            row.set('topline', top)
             bottom = 'true'
             for l in range(ncols):
                 bottom = lines[k*ncols + l][1]
@@ -655,12 +590,14 @@ def revert_tablines(document):
                     break
             if caption_info[k] == 'false':
                 bottom = 'false'
-            set_option(document, m, 'bottomline', bottom)
-            m = m + 1
+            row.set('bottomline', bottom)
 
-        i = j + 1
+        table.write()
+        # there could be a tabular inside this one
+        i += 1
 
 
+@triggers("\\begin_inset Tabular")
 def fix_wrong_tables(document):
     i = 0
     while True:
@@ -715,25 +652,16 @@ def close_begin_deeper(document):
     document.body[-2:-2] = ['\\end_deeper' for i in range(depth)]
 
 
-def long_charstyle_names(document):
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset CharStyle", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace("CharStyle ", "CharStyle CharStyle:")
-        i += 1
+@line_rule("\\begin_inset CharStyle")
+def long_charstyle_names(line):
+    return line.replace("CharStyle ", "CharStyle CharStyle:")
 
-def revert_long_charstyle_names(document):
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset CharStyle", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace("CharStyle CharStyle:", "CharStyle ")
-        i += 1
+@line_rule("\\begin_inset CharStyle")
+def revert_long_charstyle_names(line):
+    return line.replace("CharStyle CharStyle:", "CharStyle ")
 
 
+@triggers("\\begin_inset CharStyle")
 def axe_show_label(document):
     i = 0
     while True:
@@ -756,6 +684,7 @@ def axe_show_label(document):
         i += 1
 
 
+@triggers("\\begin_inset CharStyle")
 def revert_show_label(document):
     i = 0
     while True:
@@ -771,6 +700,7 @@ def revert_show_label(document):
                 document.warning("Malformed LyX document: no legal status line in CharStyle.")
         i += 1
 
+@triggers("\\begin_modules")
 def revert_begin_modules(document):
     i = 0
     while True:
@@ -783,23 +713,15 @@ def revert_begin_modules(document):
             break
         document.header[i : j + 1] = []
 
-def convert_flex(document):
+@line_rule("\\begin_inset CharStyle")
+def convert_flex(line):
     "Convert CharStyle to Flex"
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset CharStyle", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace('\\begin_inset CharStyle', '\\begin_inset Flex')
+    return line.replace('\\begin_inset CharStyle', '\\begin_inset Flex')
 
-def revert_flex(document):
+@line_rule("\\begin_inset Flex")
+def revert_flex(line):
     "Revert Flex to CharStyle"
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset Flex", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace('\\begin_inset Flex', '\\begin_inset CharStyle')
+    return line.replace('\\begin_inset Flex', '\\begin_inset CharStyle')
 
 
 def revert_pdf_options(document):
@@ -962,6 +884,7 @@ def revert_pdf_options(document):
                                  + setupend)
 
 
+@triggers("\\begin_inset Graphics")
 def remove_inzip_options(document):
     "Remove inzipName and embed options from the Graphics inset"
     i = 0
@@ -984,6 +907,7 @@ def remove_inzip_options(document):
         i = i + 1
 
 
+@triggers("\\begin_inset LatexCommand")
 def convert_inset_command(document):
     """
         Convert:
@@ -1021,6 +945,7 @@ def convert_inset_command(document):
         document.body[i : i+1] = insertion
 
 
+@triggers("\\begin_inset CommandInset")
 def revert_inset_command(document):
     """
         Convert:
@@ -1048,6 +973,7 @@ def revert_inset_command(document):
         document.body[i : i+2] = insertion
 
 
+@triggers("\\begin_inset Wrap figure")
 def convert_wrapfig_options(document):
     "Convert optional options for wrap floats (wrapfig)."
     # adds the tokens "lines", "placement", and "overhang"
@@ -1067,6 +993,7 @@ def convert_wrapfig_options(document):
         i = i + 1
 
 
+@triggers("\\begin_inset Wrap figure")
 def revert_wrapfig_options(document):
     "Revert optional options for wrap floats (wrapfig)."
     i = 0
@@ -1101,6 +1028,7 @@ def revert_wrapfig_options(document):
         i = k
 
 
+@triggers("\\begin_inset CommandInset index")
 def convert_latexcommand_index(document):
     "Convert from LatexCommand form to collapsable form."
     i = 0
@@ -1133,6 +1061,7 @@ def convert_latexcommand_index(document):
         i += len(linelist) - (j - i)
 
 
+@triggers("\\begin_inset Index")
 def revert_latexcommand_index(document):
     "Revert from collapsable form to LatexCommand form."
     i = 0
@@ -1152,89 +1081,29 @@ def revert_latexcommand_index(document):
         i += 5
 
 
-def revert_wraptable(document):
+@line_rule("\\begin_inset Wrap table")
+def revert_wraptable(line):
     "Revert wrap table to wrap figure."
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset Wrap table", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace('\\begin_inset Wrap table', '\\begin_inset Wrap figure')
-        i = i + 1
+    return line.replace('\\begin_inset Wrap table', '\\begin_inset Wrap figure')
 
 
-def revert_vietnamese(document):
-    "Set language Vietnamese to English"
-    # Set document language from Vietnamese to English
-    i = 0
-    if document.language == "vietnamese":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang vietnamese", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang vietnamese", "\\lang english")
-        j = j + 1
+# Set language Vietnamese to English
+revert_vietnamese = rename_language(["vietnamese"], "english")
 
 
-def convert_japanese_cjk(document):
-    "Set language japanese to japanese-cjk"
-    # Set document language from japanese-plain to japanese
-    i = 0
-    if document.language == "japanese":
-        document.language = "japanese-cjk"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language japanese-cjk"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang japanese", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang japanese", "\\lang japanese-cjk")
-        j = j + 1
+# Set language japanese to japanese-cjk
+convert_japanese_cjk = rename_language(["japanese"], "japanese-cjk")
 
 
-def revert_japanese(document):
-    "Set language japanese-plain to japanese"
-    # Set document language from japanese-plain to japanese
-    i = 0
-    if document.language == "japanese-plain":
-        document.language = "japanese"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language japanese"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang japanese-plain", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang japanese-plain", "\\lang japanese")
-        j = j + 1
+# Set language japanese-plain to japanese
+revert_japanese = rename_language(["japanese-plain"], "japanese")
 
 
-def revert_japanese_cjk(document):
-    "Set language japanese-cjk to japanese"
-    # Set document language from japanese-plain to japanese
-    i = 0
-    if document.language == "japanese-cjk":
-        document.language = "japanese"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language japanese"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang japanese-cjk", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang japanese-cjk", "\\lang japanese")
-        j = j + 1
+# Set language japanese-cjk to japanese
+revert_japanese_cjk = rename_language(["japanese-cjk"], "japanese")
 
 
+@header_rule
 def revert_japanese_encoding(document):
     "Set input encoding form EUC-JP-plain to EUC-JP etc."
     # Set input encoding form EUC-JP-plain to EUC-JP etc.
@@ -1252,6 +1121,7 @@ def revert_japanese_encoding(document):
         document.header[k] = "\\inputencoding UTF8"
 
 
+@triggers("\\begin_inset Info")
 def revert_inset_info(document):
     'Replace info inset with its content'
     i = 0
@@ -1408,6 +1278,7 @@ def convert_ams_classes(document):
       return
     i += 1
 
+@triggers("\\begin_inset CommandInset href")
 def revert_href(document):
     'Reverts hyperlink insets (href) to url insets (url)'
     i = 0
@@ -1419,6 +1290,7 @@ def revert_href(document):
         ["\\begin_inset CommandInset url", "LatexCommand url"]
       i = i + 2
 
+@triggers("\\begin_inset Flex URL")
 def revert_url(document):
     'Reverts Flex URL insets to old-style URL insets'
     i = 0
@@ -1449,6 +1321,7 @@ def revert_url(document):
         i = i + len(newinset)
 
 
+@triggers("\\begin_inset Include")
 def convert_include(document):
   'Converts include insets to new format.'
   i = 0
@@ -1478,6 +1351,7 @@ def convert_include(document):
     i += newlines
 
 
+@triggers("\\begin_inset CommandInset include")
 def revert_include(document):
   'Reverts include insets to old format.'
   i = 0
@@ -1528,74 +1402,23 @@ def revert_include(document):
     i += 2
 
 
-def revert_albanian(document):
-    "Set language Albanian to English"
-    i = 0
-    if document.language == "albanian":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang albanian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang albanian", "\\lang english")
-        j = j + 1
+# Set language Albanian to English
+revert_albanian = rename_language(["albanian"], "english")
 
 
-def revert_lowersorbian(document):
-    "Set language lower Sorbian to English"
-    i = 0
-    if document.language == "lowersorbian":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang lowersorbian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang lowersorbian", "\\lang english")
-        j = j + 1
+# Set language lower Sorbian to English
+revert_lowersorbian = rename_language(["lowersorbian"], "english")
 
 
-def revert_uppersorbian(document):
-    "Set language uppersorbian to usorbian as this was used in LyX 1.5"
-    i = 0
-    if document.language == "uppersorbian":
-        document.language = "usorbian"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language usorbian"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang uppersorbian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang uppersorbian", "\\lang usorbian")
-        j = j + 1
+# Set language uppersorbian to usorbian as this was used in LyX 1.5
+revert_uppersorbian = rename_language(["uppersorbian"], "usorbian")
 
 
-def convert_usorbian(document):
-    "Set language usorbian to uppersorbian"
-    i = 0
-    if document.language == "usorbian":
-        document.language = "uppersorbian"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language uppersorbian"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang usorbian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang usorbian", "\\lang uppersorbian")
-        j = j + 1
+# Set language usorbian to uppersorbian
+convert_usorbian = rename_language(["usorbian"], "uppersorbian")
 
 
+@triggers("\\begin_inset FormulaMacro")
 def convert_macro_global(document):
     "Remove TeX code command \global when it is in front of a macro"
     # math macros are nowadays already defined \global, so that an additional
@@ -1656,6 +1479,7 @@ def revert_hyperlinktype(document):
       i = i + 1
 
 
+@triggers("\\pagebreak")
 def revert_pagebreak(document):
     'Reverts pagebreak to ERT'
     i = 0
@@ -1669,6 +1493,7 @@ def revert_pagebreak(document):
       i = i + 1
 
 
+@triggers("\\linebreak")
 def revert_linebreak(document):
     'Reverts linebreak to ERT'
     i = 0
@@ -1682,57 +1507,19 @@ def revert_linebreak(document):
       i = i + 1
 
 
-def revert_latin(document):
-    "Set language Latin to English"
-    i = 0
-    if document.language == "latin":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang latin", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang latin", "\\lang english")
-        j = j + 1
+# Set language Latin to English
+revert_latin = rename_language(["latin"], "english")
 
 
-def revert_samin(document):
-    "Set language North Sami to English"
-    i = 0
-    if document.language == "samin":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang samin", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang samin", "\\lang english")
-        j = j + 1
+# Set language North Sami to English
+revert_samin = rename_language(["samin"], "english")
 
 
-def convert_serbocroatian(document):
-    "Set language Serbocroatian to Croatian as this was really Croatian in LyX 1.5"
-    i = 0
-    if document.language == "serbocroatian":
-        document.language = "croatian"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language croatian"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang serbocroatian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang serbocroatian", "\\lang croatian")
-        j = j + 1
+# Set language Serbocroatian to Croatian as this was really Croatian in LyX 1.5
+convert_serbocroatian = rename_language(["serbocroatian"], "croatian")
 
 
+@triggers("\\begin_inset Note Framed", "\\begin_inset Note Shaded")
 def convert_framed_notes(document):
     "Convert framed notes to boxes. "
     i = 0
@@ -1792,6 +1579,7 @@ def revert_module_names(document):
   document.set_module_list(newmodlist)
 
 
+@triggers("\\columnsep")
 def revert_colsep(document):
     i = find_token(document.header, "\\columnsep", 0)
     if i == -1:
@@ -1810,6 +1598,7 @@ def revert_colsep(document):
     add_to_preamble(document, pretext)
 
 
+@triggers("\\begin_inset Box Framed", "\\begin_inset Box Shaded")
 def revert_framed_notes(document):
     "Revert framed boxes to notes. "
     i = 0
@@ -1928,6 +1717,7 @@ def revert_nocite_key(body, start, end):
     return j - end
 
 
+@triggers("\\begin_inset CommandInset citation")
 def revert_nocite(document):
     "Revert LatexCommand nocite to ERT"
     i = 0
@@ -1995,57 +1785,19 @@ def revert_btprintall(document):
             i = j + addedlines
 
 
-def revert_bahasam(document):
-    "Set language Bahasa Malaysia to Bahasa Indonesia"
-    i = 0
-    if document.language == "bahasam":
-        document.language = "bahasa"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language bahasa"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang bahasam", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang bahasam", "\\lang bahasa")
-        j = j + 1
+# Set language Bahasa Malaysia to Bahasa Indonesia
+revert_bahasam = rename_language(["bahasam"], "bahasa")
 
 
-def revert_interlingua(document):
-    "Set language Interlingua to English"
-    i = 0
-    if document.language == "interlingua":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang interlingua", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang interlingua", "\\lang english")
-        j = j + 1
+# Set language Interlingua to English
+revert_interlingua = rename_language(["interlingua"], "english")
 
 
-def revert_serbianlatin(document):
-    "Set language Serbian-Latin to Croatian"
-    i = 0
-    if document.language == "serbian-latin":
-        document.language = "croatian"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language croatian"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang serbian-latin", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang serbian-latin", "\\lang croatian")
-        j = j + 1
+# Set language Serbian-Latin to Croatian
+revert_serbianlatin = rename_language(["serbian-latin"], "croatian")
 
 
+@triggers("\\begin_inset Float ")
 def revert_rotfloat(document):
     " Revert sideways custom floats. "
     i = 0
@@ -2109,6 +1861,7 @@ def revert_rotfloat(document):
         i += addedLines + 1
 
 
+@triggers("\\begin_inset Float ")
 def revert_widesideways(document):
     " Revert wide sideways floats. "
     i = 0
@@ -2226,6 +1979,7 @@ def convert_subfig(document):
         i += addedLines + 1
 
 
+@triggers("\\begin_inset Float ", "\\begin_inset Wrap")
 def revert_subfig(document):
     " Revert subfloats. "
     i = 0
@@ -2313,14 +2067,20 @@ def revert_subfig(document):
                 else:
                     opt = capend
                     optend = capend
+                # the lines of the label and of the short caption
+                skipped = dict.fromkeys(document.body[lbl:lblend] + document.body[opt:optend])
+                parts = []
                 for line in document.body[cap:capend]:
-                    if line in document.body[lbl:lblend]:
-                        continue
-                    elif line in document.body[opt:optend]:
+                    if line in skipped:
                         continue
                     else:
                         inert = True
-                        caption += lyxline2latex(document, line, inert)
+                        line = lyxline2latex(document, line, inert)
+                        if line is not None:
+                            parts.append(line)
+                if parts:
+                    add_textcomp_to_preamble(document)
+                caption = "".join(parts)
                 if len(label) > 0:
                     caption += "\n\\backslash\nlabel{" + label + "}"
             subst = '\\begin_layout PlainLayout\n\\begin_inset ERT\nstatus collapsed\n\n' \
@@ -2355,6 +2115,7 @@ def revert_subfig(document):
         i += addedLines + 1
 
 
+@triggers("\\begin_inset Wrap figure")
 def revert_wrapplacement(document):
     " Revert placement options wrap floats (wrapfig). "
     i = 0
@@ -2377,6 +2138,7 @@ def revert_wrapplacement(document):
         i = j
 
 
+@triggers("\\extra_embedded_files")
 def remove_extra_embedded_files(document):
     " Remove \extra_embedded_files from buffer params "
     i = find_token(document.header, '\\extra_embedded_files', 0)
@@ -2400,6 +2162,7 @@ def convert_spaceinset(document):
             i = i + 1
 
 
+@triggers("\\begin_inset Space")
 def revert_spaceinset(document):
     " Revert '\\begin_inset Space foo\n\\end_inset' to '\\InsetSpace foo' "
     i = 0
@@ -2416,6 +2179,7 @@ def revert_spaceinset(document):
         del document.body[j]
 
 
+@triggers("\\hfill")
 def convert_hfill(document):
     " Convert hfill to space inset "
     i = 0
@@ -2430,6 +2194,7 @@ def convert_hfill(document):
         i += len(subst)
 
 
+@triggers("\\InsetSpace")
 def revert_hfills(document):
     ' Revert \\hfill commands '
     hfill = re.compile(r'\\hfill')
@@ -2465,6 +2230,7 @@ def revert_hfills(document):
             continue
         i += 1
 
+@triggers("\\InsetSpace \\hspace")
 def revert_hspace(document):
     ' Revert \\InsetSpace \\hspace{} to ERT '
     i = 0
@@ -2503,6 +2269,7 @@ def revert_hspace(document):
         i += 1
 
 
+@triggers("\\begin_inset Space \\hspace*{\\fill}")
 def revert_protected_hfill(document):
     ' Revert \\begin_inset Space \\hspace*{\\fill} to ERT '
     i = 0
@@ -2525,6 +2292,7 @@ def revert_protected_hfill(document):
         i += len(subst)
 
 
+@triggers("\\begin_inset Space \\leftarrowfill{}")
 def revert_leftarrowfill(document):
     ' Revert \\begin_inset Space \\leftarrowfill{} to ERT '
     i = 0
@@ -2547,6 +2315,7 @@ def revert_leftarrowfill(document):
         i += len(subst)
 
 
+@triggers("\\begin_inset Space \\rightarrowfill{}")
 def revert_rightarrowfill(document):
     ' Revert \\begin_inset Space \\rightarrowfill{} to ERT '
     i = 0
@@ -2569,6 +2338,7 @@ def revert_rightarrowfill(document):
         i += len(subst)
 
 
+@triggers("\\begin_inset Space \\upbracefill{}")
 def revert_upbracefill(document):
     ' Revert \\begin_inset Space \\upbracefill{} to ERT '
     i = 0
@@ -2591,6 +2361,7 @@ def revert_upbracefill(document):
         i += len(subst)
 
 
+@triggers("\\begin_inset Space \\downbracefill{}")
 def revert_downbracefill(document):
     ' Revert \\begin_inset Space \\downbracefill{} to ERT '
     i = 0
@@ -2613,6 +2384,7 @@ def revert_downbracefill(document):
         i += len(subst)
 
 
+@triggers("\\begin_local_layout")
 def revert_local_layout(document):
     ' Revert local layout headers.'
     i = 0
@@ -2659,6 +2431,7 @@ def convert_pagebreaks(document):
                                 '\\end_inset']
 
 
+@triggers("\\begin_inset Newpage")
 def revert_pagebreaks(document):
     ' Revert \\begin_inset Newpage to previous inline format '
     i = 0
@@ -2696,6 +2469,7 @@ def convert_linebreaks(document):
                                 '\\end_inset']
 
 
+@triggers("\\begin_inset Newline")
 def revert_linebreaks(document):
     ' Revert \\begin_inset Newline to previous inline format '
     i = 0
@@ -2713,23 +2487,11 @@ def revert_linebreaks(document):
         document.body[i] = document.body[i].replace('\\begin_inset Newline linebreak', '\\linebreak')
 
 
-def convert_japanese_plain(document):
-    ' Set language japanese-plain to japanese '
-    i = 0
-    if document.language == "japanese-plain":
-        document.language = "japanese"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language japanese"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang japanese-plain", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang japanese-plain", "\\lang japanese")
-        j = j + 1
+# Set language japanese-plain to japanese
+convert_japanese_plain = rename_language(["japanese-plain"], "japanese")
 
 
+@triggers("\\begin_inset External")
 def revert_pdfpages(document):
     ' Revert pdfpages external inset to ERT '
     i = 0
@@ -2800,21 +2562,8 @@ def revert_pdfpages(document):
         i = i + 1
 
 
-def revert_mexican(document):
-    ' Set language Spanish(Mexico) to Spanish '
-    i = 0
-    if document.language == "spanish-mexico":
-        document.language = "spanish"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language spanish"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang spanish-mexico", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang spanish-mexico", "\\lang spanish")
-        j = j + 1
+# Set language Spanish(Mexico) to Spanish
+revert_mexican = rename_language(["spanish-mexico"], "spanish")
 
 
 def remove_embedding(document):
@@ -2832,6 +2581,7 @@ def revert_master(document):
         del document.header[i]
 
 
+@triggers("\\begin_inset Graphics")
 def revert_graphics_group(document):
     ' Revert group information from graphics insets '
     i = 0
@@ -2904,24 +2654,16 @@ def revert_paper_sizes(document):
         document.header[j] = "\\papersize executivepaper"
 
 
-def convert_InsetSpace(document):
+@line_rule("\\begin_inset Space")
+def convert_InsetSpace(line):
     " Convert '\\begin_inset Space foo' to '\\begin_inset space foo'"
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset Space", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace('\\begin_inset Space', '\\begin_inset space')
+    return line.replace('\\begin_inset Space', '\\begin_inset space')
 
 
-def revert_InsetSpace(document):
+@line_rule("\\begin_inset space")
+def revert_InsetSpace(line):
     " Revert '\\begin_inset space foo' to '\\begin_inset Space foo'"
-    i = 0
-    while True:
-        i = find_token(document.body, "\\begin_inset space", i)
-        if i == -1:
-            return
-        document.body[i] = document.body[i].replace('\\begin_inset space', '\\begin_inset Space')
+    return line.replace('\\begin_inset space', '\\begin_inset Space')
 
 
 def convert_display_enum(document):
@@ -2969,6 +2711,7 @@ def remove_fontsCJK(document):
         del document.header[i]
 
 
+@triggers("\\begin_layout PlainLayout")
 def convert_plain_layout(document):
     " Convert 'PlainLayout' to 'Plain Layout'"
     i = 0
@@ -2981,6 +2724,7 @@ def convert_plain_layout(document):
         i += 1
 
 
+@triggers("\\begin_layout Plain Layout")
 def revert_plain_layout(document):
     " Revert 'Plain Layout' to 'PlainLayout'"
     i = 0
@@ -2993,6 +2737,7 @@ def revert_plain_layout(document):
         i += 1
 
 
+@triggers("\\begin_layout PlainLayout")
 def revert_plainlayout(document):
     " Revert 'PlainLayout' to 'Standard'"
     i = 0
@@ -3008,23 +2753,11 @@ def revert_plainlayout(document):
         i += 1
 
 
-def revert_polytonicgreek(document):
-    "Set language polytonic Greek to Greek"
-    i = 0
-    if document.language == "polutonikogreek":
-        document.language = "greek"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language greek"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang polutonikogreek", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang polutonikogreek", "\\lang greek")
-        j = j + 1
+# Set language polytonic Greek to Greek
+revert_polytonicgreek = rename_language(["polutonikogreek"], "greek")
 
 
+@triggers("\\begin_remove_modules")
 def revert_removed_modules(document):
     i = 0
     while True:
@@ -3038,6 +2771,7 @@ def revert_removed_modules(document):
         document.header[i : j + 1] = []
 
 
+@triggers("\\begin_layout")
 def add_plain_layout(document):
     i = 0
     while True:
@@ -3079,21 +2813,8 @@ def revert_tabsize(document):
         j += 1
 
 
-def revert_mongolian(document):
-    "Set language Mongolian to English"
-    i = 0
-    if document.language == "mongolian":
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language english"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang mongolian", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang mongolian", "\\lang english")
-        j = j + 1
+# Set language Mongolian to English
+revert_mongolian = rename_language(["mongolian"], "english")
 
 
 def revert_default_options(document):
@@ -26,11 +26,14 @@ import sys, os
 from parser_tools import find_token, find_end_of, find_tokens, \
   find_token_exact, find_end_of_inset, find_end_of_layout, \
   find_token_backwards, is_in_inset, get_value, get_quoted_value, \
-  del_token, check_token, get_option_value
+  del_token, check_token
+from parser_tools import triggers
   
 from lyx2lyx_tools import add_to_preamble, insert_to_preamble, \
   put_cmd_in_ert, lyx2latex, latex_length, revert_flex_inset, \
-  revert_font_attrs, hex2ratio, str2bool
+  revert_font_attrs, hex2ratio, str2bool, rename_language
+
+from tabular import Tabular
 
 ####################################################################
 # Private helper functions
@@ -51,23 +54,11 @@ def remove_option(lines, m, option):
 ###
 ###############################################################################
 
-def revert_swiss(document):
-    " Set language german-ch to ngerman "
-    i = 0
-    if document.language == "german-ch":
-        document.language = "ngerman"
-        i = find_token(document.header, "\\language", 0)
-        if i != -1:
-            document.header[i] = "\\language ngerman"
-    j = 0
-    while True:
-        j = find_token(document.body, "\\lang german-ch", j)
-        if j == -1:
-            return
-        document.body[j] = document.body[j].replace("\\lang german-ch", "\\lang ngerman")
-        j = j + 1
+# Set language german-ch to ngerman
+revert_swiss = rename_language(["german-ch"], "ngerman")
 
 
+@triggers("\\begin_inset Tabular")
 def revert_tabularvalign(document):
    " Revert the tabular valign option "
    i = 0
@@ -297,6 +288,7 @@ def revert_outputformat(document):
         document.warning("Malformed LyX document: Missing \\default_output_format.")
 
 
+@triggers("\\backgroundcolor")
 def revert_backgroundcolor(document):
     " Reverts background color to preamble code "
     i = find_token(document.header, "\\backgroundcolor", 0)
@@ -483,6 +475,7 @@ def revert_strikeout(document):
         '\\usepackage{ulem}'])
 
 
+@triggers("\\bar under")
 def revert_ulinelatex(document):
     " Reverts \\uline font attribute "
     i = find_token(document.body, '\\bar under', 0)
@@ -508,6 +501,7 @@ def revert_custom_processors(document):
         document.warning("Malformed LyX document: Missing \\index_command.")
 
 
+@triggers("\\begin_inset CommandInset nomencl_print")
 def convert_nomencl_width(document):
     " Add set_width param to nomencl_print "
     i = 0
@@ -519,6 +513,7 @@ def convert_nomencl_width(document):
       i = i + 1
 
 
+@triggers("\\begin_inset CommandInset nomencl_print")
 def revert_nomencl_width(document):
     " Remove set_width param from nomencl_print "
     i = 0
@@ -532,6 +527,7 @@ def revert_nomencl_width(document):
       i = j
 
 
+@triggers("\\begin_inset CommandInset nomencl_print")
 def revert_nomencl_cwidth(document):
     " Remove width param from nomencl_print "
     i = 0
@@ -561,6 +557,7 @@ def revert_applemac(document):
         document.header[i] = "\\encoding auto"
 
 
+@triggers("\\begin_inset Tabular")
 def revert_longtable_align(document):
     " Remove longtable alignment setting "
     i = 0
@@ -590,6 +587,7 @@ def revert_longtable_align(document):
       i += 1
 
 
+@triggers("\\filename_suffix")
 def revert_branch_filename(document):
     " Remove \\filename_suffix parameter from branches "
     i = 0
@@ -600,6 +598,7 @@ def revert_branch_filename(document):
         del document.header[i]
 
 
+@triggers("\\paragraph_indentation")
 def revert_paragraph_indentation(document):
     " Revert custom paragraph indentation to preamble code "
     i = find_token(document.header, "\\paragraph_indentation", 0)
@@ -614,6 +613,7 @@ def revert_paragraph_indentation(document):
     del document.header[i]
 
 
+@triggers("\\defskip")
 def revert_percent_skip_lengths(document):
     " Revert relative lengths for paragraph skip separation to preamble code "
     i = find_token(document.header, "\\defskip", 0)
@@ -632,6 +632,7 @@ def revert_percent_skip_lengths(document):
         document.header[i] = "\\defskip medskip"
 
 
+@triggers("\\begin_inset VSpace")
 def revert_percent_vspace_lengths(document):
     " Revert relative VSpace lengths to ERT "
     i = 0
@@ -792,6 +793,7 @@ def revert_author_id(document):
         i += 1
 
 
+@triggers("\\suppress_date")
 def revert_suppress_date(document):
     " Revert suppressing of default document date to preamble code "
     i = find_token(document.header, "\\suppress_date", 0)
@@ -930,6 +932,7 @@ def revert_html_options(document):
     del_token(document.header, '\\html_be_strict', 0)
 
 
+@triggers("\\begin_includeonly")
 def revert_includeonly(document):
     i = 0
     while True:
@@ -948,12 +951,16 @@ def revert_includeall(document):
     del_token(document.header, '\\maintain_unincluded_children', 0)
 
 
-def revert_multirow(document):
-    " Revert multirow cells in tables to TeX-code"
+def revert_multirow_cells(document, offsets):
+    """ Reverts the multirow cells of the tables to TeX-code, only those
+    with an offset if offsets is True, all of them otherwise."""
 
     # first, let's find out if we need to do anything
     # cell type 3 is multirow begin cell
-    i = find_token(document.body, '<cell multirow="3"', 0)
+    if offsets:
+        i = find_token(document.body, '<cell multirow="3" mroffset=', 0)
+    else:
+        i = find_token(document.body, '<cell multirow="3"', 0)
     if i == -1:
       return
 
@@ -965,99 +972,63 @@ def revert_multirow(document):
         begin_table = find_token(document.body, '<lyxtabular version=', begin_table)
         if begin_table == -1:
             break
-        end_table = find_end_of(document.body, begin_table, '<lyxtabular', '</lyxtabular>')
-        if end_table == -1:
+        table = Tabular(document.body, begin_table)
+        if table.end == -1:
             document.warning("Malformed LyX document: Could not find end of table.")
             begin_table += 1
             continue
-        # does this table have multirow?
-        i = find_token(document.body, '<cell multirow="3"', begin_table, end_table)
-        if i == -1:
-            begin_table = end_table
-            continue
-        
-        # store the number of rows and columns
-        numrows = get_option_value(document.body[begin_table], "rows")
-        numcols = get_option_value(document.body[begin_table], "columns")
-        try:
-          numrows = int(numrows)
-          numcols = int(numcols)
-        except:
-          document.warning("Unable to determine rows and columns!")
-          begin_table = end_table
-          continue
 
+        # the first cells of the multirows, with the ERT that starts them
         mrstarts = []
-        multirows = []
-        # collect info on rows and columns of this table.
-        begin_row = begin_table
-        for row in range(numrows):
-            begin_row = find_token(document.body, '<row>', begin_row, end_table)
-            if begin_row == -1:
-              document.warning("Can't find row " + str(row + 1))
-              break
-            end_row = find_end_of(document.body, begin_row, '<row>', '</row>')
-            if end_row == -1:
-              document.warning("Can't find end of row " + str(row + 1))
-              break
-            begin_cell = begin_row
-            multirows.append([])
-            for column in range(numcols):            
-                begin_cell = find_token(document.body, '<cell ', begin_cell, end_row)
-                if begin_cell == -1:
-                  document.warning("Can't find column " + str(column + 1) + \
-                    "in row " + str(row + 1))
-                  break
-                # NOTE 
-                # this will fail if someone puts "</cell>" in a cell, but
-                # that seems fairly unlikely.
-                end_cell = find_end_of(document.body, begin_cell, '<cell', '</cell>')
-                if end_cell == -1:
-                  document.warning("Can't find end of column " + str(column + 1) + \
-                    "in row " + str(row + 1))
-                  break
-                multirows[row].append([begin_cell, end_cell, 0])
-                if document.body[begin_cell].find('multirow="3"') != -1:
-                  multirows[row][column][2] = 3 # begin multirow
-                  mrstarts.append([row, column])
-                elif document.body[begin_cell].find('multirow="4"') != -1:
-                  multirows[row][column][2] = 4 # in multirow
-                begin_cell = end_cell
-            begin_row = end_row
-        # end of table info collection
+        for row, tag in enumerate(table.rows):
+            for col, bcell in enumerate(tag.cells):
+                if bcell.get("multirow") != "3":
+                    continue
+                offset = bcell.get("mroffset")
+                if offsets and offset is None:
+                    continue
+                # get column width
+                col_width = ""
+                if col < len(table.columns):
+                    col_width = table.columns[col].get("width", "")
+                # "0pt" means that no width is specified
+                if not col_width or col_width == "0pt":
+                  col_width = "*"
+                # determine the number of cells that are part of the multirow
+                nummrs = 1
+                for r in range(row + 1, len(table.rows)):
+                    cell = table.cell(r, col)
+                    if cell is None or cell.get("multirow") != "4":
+                      break
+                    nummrs += 1
+                    # take the opportunity to revert this cell
+                    cell.remove("multirow")
+                    if cell.get("valignment") == "middle":
+                      cell.set("valignment", "top")
+                    if cell.get("topline") == "true":
+                      cell.remove("topline")
+                    # remove bottom line of previous multirow-part cell
+                    cell = table.cell(r - 1, col)
+                    if cell.get("bottomline") == "true":
+                      cell.remove("bottomline")
+                # revert beginning cell
+                bcell.remove("multirow")
+                if bcell.get("valignment") == "middle":
+                  bcell.set("valignment", "top")
+                if offsets:
+                  # remove mroffset option
+                  bcell.remove("mroffset")
+                  ert = "\\multirow{" + str(nummrs) + "}{" + col_width + "}[" \
+                      + offset + "]{"
+                else:
+                  ert = "\\multirow{" + str(nummrs) + "}{" + col_width + "}{"
+                mrstarts.append((bcell, ert))
+        table.write()
 
         # work from the back to avoid messing up numbering
         mrstarts.reverse()
-        for m in mrstarts:
-            row = m[0]
-            col = m[1]
-            # get column width
-            col_width = get_option_value(document.body[begin_table + 2 + col], "width")
-            # "0pt" means that no width is specified
-            if not col_width or col_width == "0pt":
-              col_width = "*"
-            # determine the number of cells that are part of the multirow
-            nummrs = 1
-            for r in range(row + 1, numrows):
-                if multirows[r][col][2] != 4:
-                  break
-                nummrs += 1
-                # take the opportunity to revert this line
-                lineno = multirows[r][col][0]
-                document.body[lineno] = document.body[lineno].\
-                  replace(' multirow="4" ', ' ').\
-                  replace('valignment="middle"', 'valignment="top"').\
-                  replace(' topline="true" ', ' ')
-                # remove bottom line of previous multirow-part cell
-                lineno = multirows[r-1][col][0]
-                document.body[lineno] = document.body[lineno].replace(' bottomline="true" ', ' ')
-            # revert beginning cell
-            bcell = multirows[row][col][0]
-            ecell = multirows[row][col][1]
-            document.body[bcell] = document.body[bcell].\
-              replace(' multirow="3" ', ' ').\
-              replace('valignment="middle"', 'valignment="top"')
-            blay = find_token(document.body, "\\begin_layout", bcell, ecell)
+        for bcell, ert in mrstarts:
+            blay = find_token(document.body, "\\begin_layout", bcell.line, bcell.end)
             if blay == -1:
               document.warning("Can't find layout for cell!")
               continue
@@ -1070,12 +1041,18 @@ def revert_multirow(document):
             # so before the end of the layout...
             document.body[bend:bend] = put_cmd_in_ert("}")
             # ...and after the beginning
-            document.body[blay + 1:blay + 1] = \
-              put_cmd_in_ert("\\multirow{" + str(nummrs) + "}{" + col_width + "}{")
+            document.body[blay + 1:blay + 1] = put_cmd_in_ert(ert)
 
-        begin_table = end_table
+        # on to the next table, there could be one inside this one
+        begin_table += 1
 
 
+def revert_multirow(document):
+    " Revert multirow cells in tables to TeX-code"
+    revert_multirow_cells(document, False)
+
+
+@triggers("\\html_use_mathml")
 def convert_math_output(document):
     " Convert \html_use_mathml to \html_math_output "
     i = find_token(document.header, "\\html_use_mathml", 0)
@@ -1093,6 +1070,7 @@ def convert_math_output(document):
     document.header[i] = "\\html_math_output " + newval
 
 
+@triggers("\\html_math_output")
 def revert_math_output(document):
     " Revert \html_math_output to \html_use_mathml "
     i = find_token(document.header, "\\html_math_output", 0)
@@ -1111,6 +1089,7 @@ def revert_math_output(document):
                 
 
 
+@triggers("\\begin_inset Preview")
 def revert_inset_preview(document):
     " Dissolves the preview inset "
     i = 0
@@ -1221,6 +1200,7 @@ def revert_equalspacing_xymatrix(document):
         add_to_preamble(document, ['\\usepackage[all]{xy}'])
 
 
+@triggers("\\notefontcolor")
 def revert_notefontcolor(document):
     " Reverts greyed-out note font color to preamble code "
 
@@ -1250,24 +1230,11 @@ def revert_notefontcolor(document):
         ' {\\textcolor{note_fontcolor}\\bgroup}{\\egroup}'])
 
 
-def revert_turkmen(document):
-    "Set language Turkmen to English" 
-
-    if document.language == "turkmen": 
-        document.language = "english" 
-        i = find_token(document.header, "\\language", 0) 
-        if i != -1: 
-            document.header[i] = "\\language english" 
-
-    j = 0 
-    while True: 
-        j = find_token(document.body, "\\lang turkmen", j) 
-        if j == -1: 
-            return 
-        document.body[j] = document.body[j].replace("\\lang turkmen", "\\lang english") 
-        j += 1 
+# Set language Turkmen to English
+revert_turkmen = rename_language(["turkmen"], "english")
 
 
+@triggers("\\fontcolor")
 def revert_fontcolor(document):
     " Reverts font color to preamble code "
     i = find_token(document.header, "\\fontcolor", 0)
@@ -1290,6 +1257,7 @@ def revert_fontcolor(document):
       '\\color{document_fontcolor}'])
 
 
+@triggers("\\boxbgcolor")
 def revert_shadedboxcolor(document):
     " Reverts shaded box color to preamble code "
     i = find_token(document.header, "\\boxbgcolor", 0)
@@ -1434,6 +1402,7 @@ def revert_output_sync(document):
   del_token(document.header, '\\output_sync', 0)
 
 
+@triggers("\\begin_inset Tabular")
 def revert_align_decimal(document):
   i = 0
   while True:
@@ -1464,6 +1433,7 @@ def revert_align_decimal(document):
       k += 1
 
 
+@triggers("\\begin_inset OptArg")
 def convert_optarg(document):
   " Convert \\begin_inset OptArg to \\begin_inset Argument "
   i = 0
@@ -1475,6 +1445,7 @@ def convert_optarg(document):
     i += 1
 
 
+@triggers("\\begin_inset Argument")
 def revert_argument(document):
   " Convert \\begin_inset Argument to \\begin_inset OptArg "
   i = 0
@@ -1486,6 +1457,7 @@ def revert_argument(document):
     i += 1
 
 
+@triggers("\\begin_inset Box")
 def revert_makebox(document):
   " Convert \\makebox to TeX code "
   i = 0
@@ -1533,6 +1505,7 @@ def revert_makebox(document):
     i += 1
 
 
+@triggers("\\begin_inset Box")
 def convert_use_makebox(document):
   " Adds use_makebox option for boxes "
   i = 0
@@ -1713,6 +1686,7 @@ def revert_mathrsfs(document):
         return
 
 
+@triggers("\\begin_inset Flex")
 def convert_flexnames(document):
     "Convert \\begin_inset Flex Custom:Style to \\begin_inset Flex Style and similarly for CharStyle and Element."
     
@@ -1926,6 +1900,7 @@ def convert_rule(document):
       i += len(inset)
 
 
+@triggers("\\begin_inset CommandInset line")
 def revert_rule(document):
     " Revert line insets to Tex code "
     i = 0
@@ -1954,6 +1929,7 @@ def revert_rule(document):
       i += len(subst) - (j - i)
 
 
+@triggers("\\begin_inset Formula")
 def revert_diagram(document):
   " Add the feyn package if \\Diagram is used in math "
   i = 0
@@ -2192,139 +2168,7 @@ def revert_passthru(document):
 
 def revert_multirowOffset(document):
     " Revert multirow cells with offset in tables to TeX-code"
-    # this routine is the same as the revert_multirow routine except that
-    # it checks additionally for the offset
-
-    # first, let's find out if we need to do anything
-    i = find_token(document.body, '<cell multirow="3" mroffset=', 0)
-    if i == -1:
-      return
-
-    add_to_preamble(document, ["\\usepackage{multirow}"])
-
-    rgx = re.compile(r'mroffset="[^"]+?"')
-    begin_table = 0
-
-    while True:
-        # find begin/end of table
-        begin_table = find_token(document.body, '<lyxtabular version=', begin_table)
-        if begin_table == -1:
-            break
-        end_table = find_end_of(document.body, begin_table, '<lyxtabular', '</lyxtabular>')
-        if end_table == -1:
-            document.warning("Malformed LyX document: Could not find end of table.")
-            begin_table += 1
-            continue
-        # does this table have multirow?
-        i = find_token(document.body, '<cell multirow="3"', begin_table, end_table)
-        if i == -1:
-            begin_table = end_table
-            continue
-        
-        # store the number of rows and columns
-        numrows = get_option_value(document.body[begin_table], "rows")
-        numcols = get_option_value(document.body[begin_table], "columns")
-        try:
-          numrows = int(numrows)
-          numcols = int(numcols)
-        except:
-          document.warning("Unable to determine rows and columns!")
-          begin_table = end_table
-          continue
-
-        mrstarts = []
-        multirows = []
-        # collect info on rows and columns of this table.
-        begin_row = begin_table
-        for row in range(numrows):
-            begin_row = find_token(document.body, '<row>', begin_row, end_table)
-            if begin_row == -1:
-              document.warning("Can't find row " + str(row + 1))
-              break
-            end_row = find_end_of(document.body, begin_row, '<row>', '</row>')
-            if end_row == -1:
-              document.warning("Can't find end of row " + str(row + 1))
-              break
-            begin_cell = begin_row
-            multirows.append([])
-            for column in range(numcols):            
-                begin_cell = find_token(document.body, '<cell ', begin_cell, end_row)
-                if begin_cell == -1:
-                  document.warning("Can't find column " + str(column + 1) + \
-                    "in row " + str(row + 1))
-                  break
-                # NOTE 
-                # this will fail if someone puts "</cell>" in a cell, but
-                # that seems fairly unlikely.
-                end_cell = find_end_of(document.body, begin_cell, '<cell', '</cell>')
-                if end_cell == -1:
-                  document.warning("Can't find end of column " + str(column + 1) + \
-                    "in row " + str(row + 1))
-                  break
-                multirows[row].append([begin_cell, end_cell, 0])
-                if document.body[begin_cell].find('multirow="3" mroffset=') != -1:
-                  multirows[row][column][2] = 3 # begin multirow
-                  mrstarts.append([row, column])
-                elif document.body[begin_cell].find('multirow="4"') != -1:
-                  multirows[row][column][2] = 4 # in multirow
-                begin_cell = end_cell
-            begin_row = end_row
-        # end of table info collection
-
-        # work from the back to avoid messing up numbering
-        mrstarts.reverse()
-        for m in mrstarts:
-            row = m[0]
-            col = m[1]
-            # get column width
-            col_width = get_option_value(document.body[begin_table + 2 + col], "width")
-            # "0pt" means that no width is specified
-            if not col_width or col_width == "0pt":
-              col_width = "*"
-            # determine the number of cells that are part of the multirow
-            nummrs = 1
-            for r in range(row + 1, numrows):
-                if multirows[r][col][2] != 4:
-                  break
-                nummrs += 1
-                # take the opportunity to revert this line
-                lineno = multirows[r][col][0]
-                document.body[lineno] = document.body[lineno].\
-                  replace(' multirow="4" ', ' ').\
-                  replace('valignment="middle"', 'valignment="top"').\
-                  replace(' topline="true" ', ' ')
-                # remove bottom line of previous multirow-part cell
-                lineno = multirows[r-1][col][0]
-                document.body[lineno] = document.body[lineno].replace(' bottomline="true" ', ' ')
-            # revert beginning cell
-            bcell = multirows[row][col][0]
-            ecell = multirows[row][col][1]
-            offset = get_option_value(document.body[bcell], "mroffset")
-            document.body[bcell] = document.body[bcell].\
-              replace(' multirow="3" ', ' ').\
-              replace('valignment="middle"', 'valignment="top"')
-            # remove mroffset option
-            document.body[bcell] = rgx.sub('', document.body[bcell])
-            
-            blay = find_token(document.body, "\\begin_layout", bcell, ecell)
-            if blay == -1:
-              document.warning("Can't find layout for cell!")
-              continue
-            bend = find_end_of_layout(document.body, blay)
-            if bend == -1:
-              document.warning("Can't find end of layout for cell!")
-              continue
-            # do the later one first, so as not to mess up the numbering
-            # we are wrapping the whole cell in this ert
-            # so before the end of the layout...
-            document.body[bend:bend] = put_cmd_in_ert("}")
-            # ...and after the beginning
-            document.body[blay + 1:blay + 1] = \
-              put_cmd_in_ert("\\multirow{" + str(nummrs) + "}{" + col_width + "}[" \
-                  + offset + "]{")
-
-        # on to the next table
-        begin_table = end_table
+    revert_multirow_cells(document, True)
 
 
 def revert_script(document):
@@ -2371,6 +2215,7 @@ def revert_script(document):
         add_to_preamble(document, ['\\usepackage{subscript}'])
 
 
+@triggers("\\use_xetex")
 def convert_use_xetex(document):
     " convert \\use_xetex to \\use_non_tex_fonts "
     i = 0
@@ -2428,6 +2273,7 @@ def convert_langpack(document):
     document.header.insert(i + 1, "\\language_package default")
 
 
+@triggers("\\begin_inset Tabular")
 def revert_tabularwidth(document):
   i = 0
   while True:
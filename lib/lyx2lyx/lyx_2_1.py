@@ -27,13 +27,16 @@ import sys, os
 
 from parser_tools import count_pars_in_inset, del_token, find_token, find_token_exact, \
     find_token_backwards, find_end_of, find_end_of_inset, find_end_of_layout, find_re, \
-    get_option_value, get_containing_layout, get_value, get_quoted_value, set_option_value
+    get_containing_layout, get_value, get_quoted_value
+from parser_tools import triggers, header_rule, line_rule, paragraph_rule
+from tabular import Tabular
 
 #from parser_tools import find_token, find_end_of, find_tokens, \
   #find_end_of_inset, find_end_of_layout, \
   #is_in_inset, del_token, check_token
 
-from lyx2lyx_tools import add_to_preamble, put_cmd_in_ert, get_ert
+from lyx2lyx_tools import add_to_preamble, put_cmd_in_ert, get_ert, \
+    rename_language
 
 #from lyx2lyx_tools import insert_to_preamble, \
 #  lyx2latex, latex_length, revert_flex_inset, \
@@ -58,6 +61,8 @@ from lyx2lyx_tools import add_to_preamble, put_cmd_in_ert, get_ert
 ###
 ###############################################################################
 
+@paragraph_rule
+@triggers("\\begin_inset space \\textvisiblespace{}")
 def revert_visible_space(document):
     "Revert InsetSpace visible into its ERT counterpart"
     i = 0
@@ -70,6 +75,7 @@ def revert_visible_space(document):
       document.body[i:end + 1] = subst
 
 
+@header_rule
 def convert_undertilde(document):
     " Load undertilde automatically "
     i = find_token(document.header, "\\use_mathdots" , 0)
@@ -159,6 +165,8 @@ def revert_negative_space(document):
       reverted = True
 
 
+@paragraph_rule
+@triggers("\\begin_inset Formula")
 def revert_math_spaces(document):
     "Revert formulas with protected custom space and protected hfills to TeX-code"
     i = 0
@@ -174,6 +182,7 @@ def revert_math_spaces(document):
       i = i + 1
 
 
+@header_rule
 def convert_japanese_encodings(document):
     " Rename the japanese encodings to names understood by platex "
     jap_enc_dict = {
@@ -189,6 +198,7 @@ def convert_japanese_encodings(document):
         document.header[i] = "\\inputencoding %s" % jap_enc_dict[val]
 
 
+@header_rule
 def revert_japanese_encodings(document):
     " Revert the japanese encodings name changes "
     jap_enc_dict = {
@@ -204,34 +214,18 @@ def revert_japanese_encodings(document):
         document.header[i] = "\\inputencoding %s" % jap_enc_dict[val]
 
 
+@header_rule
 def revert_justification(document):
     " Revert the \\justification buffer param"
     if not del_token(document.header, '\\justification', 0):
         document.warning("Malformed LyX document: Missing \\justification.")
 
 
-def revert_australian(document):
-    "Set English language variants Australian and Newzealand to English" 
-
-    if document.language == "australian" or document.language == "newzealand": 
-        document.language = "english"
-        i = find_token(document.header, "\\language", 0) 
-        if i != -1: 
-            document.header[i] = "\\language english" 
-    j = 0 
-    while True: 
-        j = find_token(document.body, "\\lang australian", j) 
-        if j == -1:
-            j = find_token(document.body, "\\lang newzealand", 0)
-            if j == -1:
-                return
-            else:
-                document.body[j] = document.body[j].replace("\\lang newzealand", "\\lang english")
-        else:
-            document.body[j] = document.body[j].replace("\\lang australian", "\\lang english") 
-        j += 1
+# Set English language variants Australian and Newzealand to English
+revert_australian = rename_language(["australian", "newzealand"], "english")
 
 
+@header_rule
 def convert_biblio_style(document):
     "Add a sensible default for \\biblio_style based on the citation engine."
     i = find_token(document.header, "\\cite_engine", 0)
@@ -277,71 +271,51 @@ def handle_longtable_captions(document, forward):
         begin_table = find_token(document.body, '<lyxtabular version=', begin_table)
         if begin_table == -1:
             break
-        end_table = find_end_of(document.body, begin_table, '<lyxtabular', '</lyxtabular>')
-        if end_table == -1:
+        table = Tabular(document.body, begin_table)
+        if table.end == -1:
             document.warning("Malformed LyX document: Could not find end of table.")
             begin_table += 1
             continue
-        fline = find_token(document.body, "<features", begin_table, end_table)
-        if fline == -1:
+        if table.features is None:
             document.warning("Can't find features for inset at line " + str(begin_table))
             begin_table += 1
             continue
-        p = document.body[fline].find("islongtable")
-        if p == -1:
+        if table.features.get('islongtable') is None:
             # no longtable
             begin_table += 1
             continue
-        numrows = get_option_value(document.body[begin_table], "rows")
-        try:
-            numrows = int(numrows)
-        except:
-            document.warning(document.body[begin_table])
-            document.warning("Unable to determine rows!")
-            begin_table = end_table
-            continue
-        begin_row = begin_table
-        for row in range(numrows):
-            begin_row = find_token(document.body, '<row', begin_row, end_table)
-            if begin_row == -1:
-                document.warning("Can't find row " + str(row + 1))
-                break
-            end_row = find_end_of(document.body, begin_row, '<row', '</row>')
-            if end_row == -1:
-                document.warning("Can't find end of row " + str(row + 1))
-                break
+        for row in table.rows:
+            if row.get('caption') != 'true':
+                continue
             if forward:
-                if (get_option_value(document.body[begin_row], 'caption') == 'true' and
-                    get_option_value(document.body[begin_row], 'endfirsthead') != 'true' and
-                    get_option_value(document.body[begin_row], 'endhead') != 'true' and
-                    get_option_value(document.body[begin_row], 'endfoot') != 'true' and
-                    get_option_value(document.body[begin_row], 'endlastfoot') != 'true'):
-                    document.body[begin_row] = set_option_value(document.body[begin_row], 'caption', 'true", endfirsthead="true')
-            elif get_option_value(document.body[begin_row], 'caption') == 'true':
-                if get_option_value(document.body[begin_row], 'endfirsthead') == 'true':
-                    document.body[begin_row] = set_option_value(document.body[begin_row], 'endfirsthead', 'false')
-                if get_option_value(document.body[begin_row], 'endhead') == 'true':
-                    document.body[begin_row] = set_option_value(document.body[begin_row], 'endhead', 'false')
-                if get_option_value(document.body[begin_row], 'endfoot') == 'true':
-                    document.body[begin_row] = set_option_value(document.body[begin_row], 'endfoot', 'false')
-                if get_option_value(document.body[begin_row], 'endlastfoot') == 'true':
-                    document.body[begin_row] = set_option_value(document.body[begin_row], 'endlastfoot', 'false')
-            begin_row = end_row
+                if (row.get('endfirsthead') != 'true' and
+                    row.get('endhead') != 'true' and
+                    row.get('endfoot') != 'true' and
+                    row.get('endlastfoot') != 'true'):
+                    row.set('endfirsthead', 'true')
+            else:
+                for flag in ('endfirsthead', 'endhead', 'endfoot', 'endlastfoot'):
+                    if row.get(flag) == 'true':
+                        row.set(flag, 'false')
+        table.write()
         # since there could be a tabular inside this one, we 
         # cannot jump to end.
         begin_table += 1
 
 
+@paragraph_rule
 def convert_longtable_captions(document):
     "Add a firsthead flag to caption rows"
     handle_longtable_captions(document, True)
 
 
+@paragraph_rule
 def revert_longtable_captions(document):
     "remove head/foot flag from caption rows"
     handle_longtable_captions(document, False)
 
 
+@header_rule
 def convert_use_packages(document):
     "use_xxx yyy => use_package xxx yyy"
     packages = ["amsmath", "esint", "mathdots", "mhchem", "undertilde"]
@@ -352,6 +326,7 @@ def convert_use_packages(document):
             document.header[i] = "\\use_package %s %s" % (p, value)
 
 
+@header_rule
 def revert_use_packages(document):
     "use_package xxx yyy => use_xxx yyy"
     packages = ["amsmath", "esint", "mathdots", "mhchem", "undertilde"]
@@ -369,6 +344,7 @@ def revert_use_packages(document):
         j = j + 1
 
 
+@header_rule
 def convert_use_mathtools(document):
     "insert use_package mathtools"
     i = find_token(document.header, "\\use_package", 0)
@@ -417,6 +393,7 @@ def revert_use_mathtools(document):
             i = j
 
 
+@header_rule
 def convert_cite_engine_type(document):
     "Determine the \\cite_engine_type from the citation engine."
     i = find_token(document.header, "\\cite_engine", 0)
@@ -431,6 +408,7 @@ def convert_cite_engine_type(document):
     document.header.insert(i + 1, "\\cite_engine_type " + type)
 
 
+@header_rule
 def revert_cite_engine_type(document):
     "Natbib had the type appended with an underscore."
     engine_type = "numerical"
@@ -448,6 +426,7 @@ def revert_cite_engine_type(document):
     document.header[i] = "\\cite_engine natbib_" + engine_type
 
 
+@triggers("\\begin_inset Formula")
 def revert_cancel(document):
     "add cancel to the preamble if necessary"
     commands = ["cancelto", "cancel", "bcancel", "xcancel"]
@@ -469,6 +448,7 @@ def revert_cancel(document):
         i = j
 
 
+@triggers("\\begin_layout Verbatim")
 def revert_verbatim(document):
     " Revert verbatim einvironments completely to TeX-code. "
     i = 0
@@ -532,6 +512,7 @@ def revert_verbatim(document):
             document.body[i:i+1] = subst_begin
 
 
+@triggers("\\begin_inset IPA")
 def revert_tipa(document):
     " Revert native TIPA insets to mathed or ERT. "
     i = 0
@@ -578,31 +559,34 @@ def revert_cell_rotation(document):
   try:
     while True:
       # first, let's find out if we need to do anything
-      i = find_token(document.body, '<cell ', i)
+      i = find_token(document.body, '<lyxtabular version=', i)
       if i == -1:
         return
-      j = document.body[i].find('rotate="')
-      if j != -1:
-        k = document.body[i].find('"', j + 8)
-        value = document.body[i][j + 8 : k]
+      table = Tabular(document.body, i)
+      turned = []
+      for cell in table.cells():
+        value = cell.get("rotate")
+        if value is None:
+          continue
         if value == "0":
-          rgx = re.compile(r' rotate="[^"]+?"')
           # remove rotate option
-          document.body[i] = rgx.sub('', document.body[i])
+          cell.remove("rotate")
         elif value == "90":
-          rgx = re.compile(r' rotate="[^"]+?"')
-          document.body[i] = rgx.sub('rotate="true"', document.body[i])
+          cell.set("rotate", "true")
         else:
-          rgx = re.compile(r' rotate="[^"]+?"')
           load_rotating = True
           # remove rotate option
-          document.body[i] = rgx.sub('', document.body[i])
-          # write ERT
-          document.body[i + 5 : i + 5] = \
-            put_cmd_in_ert("\\end{turn}")
-          document.body[i + 4 : i + 4] = \
-            put_cmd_in_ert("\\begin{turn}{" + value + "}")
-        
+          cell.remove("rotate")
+          turned.append((cell.line, value))
+      table.write()
+      # write ERT, from the last cell
+      turned.reverse()
+      for j, value in turned:
+        document.body[j + 5 : j + 5] = \
+          put_cmd_in_ert("\\end{turn}")
+        document.body[j + 4 : j + 4] = \
+          put_cmd_in_ert("\\begin{turn}{" + value + "}")
+
       i += 1
         
   finally:
@@ -610,22 +594,17 @@ def revert_cell_rotation(document):
       add_to_preamble(document, ["\\@ifundefined{turnbox}{\usepackage{rotating}}{}"])
 
 
-def convert_cell_rotation(document):
-    'Convert cell rotation statements from "true" to "90"'
+# The value of a rotate option
+rotate_re = re.compile(r'rotate="[^"]+?"')
 
-    i = 0
-    while True:
-      # first, let's find out if we need to do anything
-      i = find_token(document.body, '<cell ', i)
-      if i == -1:
-        return
-      j = document.body[i].find('rotate="true"')
-      if j != -1:
-        rgx = re.compile(r'rotate="[^"]+?"')
-        # convert "true" to "90"
-        document.body[i] = rgx.sub('rotate="90"', document.body[i])
-        
-      i += 1
+
+@line_rule('<cell ')
+def convert_cell_rotation(line):
+    'Convert cell rotation statements from "true" to "90"'
+    if line.find('rotate="true"') == -1:
+        return line
+    # convert "true" to "90"
+    return rotate_re.sub('rotate="90"', line)
 
 
 def revert_table_rotation(document):
@@ -636,31 +615,35 @@ def revert_table_rotation(document):
   try:
     while True:
       # first, let's find out if we need to do anything
-      i = find_token(document.body, '<features ', i)
+      i = find_token(document.body, '<lyxtabular version=', i)
       if i == -1:
         return
-      j = document.body[i].find('rotate="')
-      if j != -1:
-        end_table = find_token(document.body, '</lyxtabular>', j)
-        k = document.body[i].find('"', j + 8)
-        value = document.body[i][j + 8 : k]
-        if value == "0":
-          rgx = re.compile(r' rotate="[^"]+?"')
-          # remove rotate option
-          document.body[i] = rgx.sub('', document.body[i])
-        elif value == "90":
-          rgx = re.compile(r'rotate="[^"]+?"')
-          document.body[i] = rgx.sub('rotate="true"', document.body[i])
-        else:
-          rgx = re.compile(r' rotate="[^"]+?"')
-          load_rotating = True
-          # remove rotate option
-          document.body[i] = rgx.sub('', document.body[i])
-          # write ERT
-          document.body[end_table + 3 : end_table + 3] = \
-            put_cmd_in_ert("\\end{turn}")
-          document.body[i - 2 : i - 2] = \
-            put_cmd_in_ert("\\begin{turn}{" + value + "}")
+      table = Tabular(document.body, i)
+      if table.features is None or table.features.get("rotate") is None:
+        i += 1
+        continue
+      if table.end == -1:
+        document.warning("Malformed LyX document: Could not find end of table.")
+        i += 1
+        continue
+      value = table.features.get("rotate")
+      if value == "0":
+        # remove rotate option
+        table.features.remove("rotate")
+        table.write()
+      elif value == "90":
+        table.features.set("rotate", "true")
+        table.write()
+      else:
+        load_rotating = True
+        # remove rotate option
+        table.features.remove("rotate")
+        table.write()
+        # write ERT
+        document.body[table.end + 3 : table.end + 3] = \
+          put_cmd_in_ert("\\end{turn}")
+        document.body[table.start - 1 : table.start - 1] = \
+          put_cmd_in_ert("\\begin{turn}{" + value + "}")
         
       i += 1
         
@@ -669,24 +652,17 @@ def revert_table_rotation(document):
       add_to_preamble(document, ["\\@ifundefined{turnbox}{\usepackage{rotating}}{}"])
 
 
-def convert_table_rotation(document):
+@line_rule('<features ')
+def convert_table_rotation(line):
     'Convert table rotation statements from "true" to "90"'
-
-    i = 0
-    while True:
-      # first, let's find out if we need to do anything
-      i = find_token(document.body, '<features ', i)
-      if i == -1:
-        return
-      j = document.body[i].find('rotate="true"')
-      if j != -1:
-        rgx = re.compile(r'rotate="[^"]+?"')
-        # convert "true" to "90"
-        document.body[i] = rgx.sub('rotate="90"', document.body[i])
-        
-      i += 1
+    if line.find('rotate="true"') == -1:
+        return line
+    # convert "true" to "90"
+    return rotate_re.sub('rotate="90"', line)
 
 
+@paragraph_rule
+@triggers("\\begin_inset ERT")
 def convert_listoflistings(document):
     'Convert ERT \lstlistoflistings to TOC lstlistoflistings inset'
     # We can support roundtrip because the command is so simple
@@ -708,6 +684,7 @@ def convert_listoflistings(document):
             i = j + 1
 
 
+@triggers("\\begin_inset CommandInset toc")
 def revert_listoflistings(document):
     'Convert TOC lstlistoflistings inset to ERT lstlistoflistings'
     i = 0
@@ -727,6 +704,7 @@ def revert_listoflistings(document):
         i = i + 1
 
 
+@header_rule
 def convert_use_amssymb(document):
     "insert use_package amssymb"
     regexp = re.compile(r'(\\use_package\s+amsmath)')
@@ -749,6 +727,7 @@ def convert_use_amssymb(document):
         del document.preamble[j]
 
 
+@header_rule
 def revert_use_amssymb(document):
     "remove use_package amssymb"
     regexp1 = re.compile(r'(\\use_package\s+amsmath)')
@@ -766,47 +745,17 @@ def revert_use_amssymb(document):
         add_to_preamble(document, ["\\usepackage{amssymb}"])
 
 
-def revert_ancientgreek(document):
-    "Set the document language for ancientgreek to greek" 
+# Set the document language for ancientgreek to greek
+revert_ancientgreek = rename_language(["ancientgreek"], "greek")
 
-    if document.language == "ancientgreek": 
-        document.language = "greek"
-        i = find_token(document.header, "\\language", 0) 
-        if i != -1: 
-            document.header[i] = "\\language greek" 
-    j = 0 
-    while True: 
-        j = find_token(document.body, "\\lang ancientgreek", j) 
-        if j == -1:
-            return
-        else:
-            document.body[j] = document.body[j].replace("\\lang ancientgreek", "\\lang greek") 
-        j += 1
-
-
-def revert_languages(document):
-    "Set the document language for new supported languages to English" 
-
-    languages = [
-                 "coptic", "divehi", "hindi", "kurmanji", "lao", "marathi", "occitan", "sanskrit",
-                 "syriac", "tamil", "telugu", "urdu"
-                ]
-    for n in range(len(languages)):
-        if document.language == languages[n]:
-            document.language = "english"
-            i = find_token(document.header, "\\language", 0) 
-            if i != -1: 
-                document.header[i] = "\\language english" 
-        j = 0
-        while j < len(document.body): 
-            j = find_token(document.body, "\\lang " + languages[n], j)
-            if j != -1:
-                document.body[j] = document.body[j].replace("\\lang " + languages[n], "\\lang english")
-                j += 1
-            else:
-                j = len(document.body)
 
+# Set the document language for new supported languages to English
+revert_languages = rename_language(["coptic", "divehi", "hindi", "kurmanji",
+    "lao", "marathi", "occitan", "sanskrit", "syriac", "tamil", "telugu",
+    "urdu"], "english")
 
+
+@header_rule
 def convert_armenian(document):
     "Use polyglossia and thus non-TeX fonts for Armenian" 
 
@@ -816,6 +765,7 @@ def convert_armenian(document):
             document.header[i] = "\\use_non_tex_fonts true" 
 
 
+@header_rule
 def revert_armenian(document):
     "Use ArmTeX and thus TeX fonts for Armenian" 
 
@@ -825,6 +775,7 @@ def revert_armenian(document):
             document.header[i] = "\\use_non_tex_fonts false" 
 
 
+@header_rule
 def revert_libertine(document):
     " Revert native libertine font definition to LaTeX " 
 
@@ -845,6 +796,7 @@ def revert_libertine(document):
             document.header[i] = "\\font_roman default"
 
 
+@header_rule
 def revert_txtt(document):
     " Revert native txtt font definition to LaTeX " 
 
@@ -856,66 +808,49 @@ def revert_txtt(document):
             document.header[i] = "\\font_typewriter default"
 
 
+@header_rule
 def revert_mathdesign(document):
     " Revert native mathdesign font definition to LaTeX " 
 
-    if find_token(document.header, "\\use_non_tex_fonts false", 0) != -1: 
+    if document.header.get("\\use_non_tex_fonts") == "false":
         mathdesign_dict = {
         "mdbch":  "charter",
         "mdput":  "utopia",
         "mdugm":  "garamond"
         }
-        i = find_token(document.header, "\\font_roman", 0)
-        if i == -1:
-            return
-        val = get_value(document.header, "\\font_roman", i)
+        val = document.header.get("\\font_roman")
         if val in mathdesign_dict.keys():
             preamble = "\\usepackage[%s" % mathdesign_dict[val]
             expert = False
-            j = find_token(document.header, "\\font_osf true", 0)
-            if j != -1:
+            if document.header.get("\\font_osf") == "true":
                 expert = True
-                document.header[j] = "\\font_osf false"
-            l = find_token(document.header, "\\font_sc true", 0)
-            if l != -1:
+                document.header.set("\\font_osf", "false")
+            if document.header.get("\\font_sc") == "true":
                 expert = True
-                document.header[l] = "\\font_sc false"
+                document.header.set("\\font_sc", "false")
             if expert:
                 preamble += ",expert"
             preamble += "]{mathdesign}"
             add_to_preamble(document, [preamble])
-            document.header[i] = "\\font_roman default"
+            document.header.set("\\font_roman", "default")
 
 
+@header_rule
 def revert_texgyre(document):
     " Revert native TeXGyre font definition to LaTeX " 
 
-    if find_token(document.header, "\\use_non_tex_fonts false", 0) != -1: 
+    if document.header.get("\\use_non_tex_fonts") == "false":
         texgyre_fonts = ["tgadventor", "tgbonum", "tgchorus", "tgcursor", \
                          "tgheros", "tgpagella", "tgschola", "tgtermes"]
-        i = find_token(document.header, "\\font_roman", 0)
-        if i != -1:
-            val = get_value(document.header, "\\font_roman", i)
+        for font in ("\\font_roman", "\\font_sans", "\\font_typewriter"):
+            val = document.header.get(font)
             if val in texgyre_fonts:
                 preamble = "\\usepackage{%s}" % val
                 add_to_preamble(document, [preamble])
-                document.header[i] = "\\font_roman default"
-        i = find_token(document.header, "\\font_sans", 0)
-        if i != -1:
-            val = get_value(document.header, "\\font_sans", i)
-            if val in texgyre_fonts:
-                preamble = "\\usepackage{%s}" % val
-                add_to_preamble(document, [preamble])
-                document.header[i] = "\\font_sans default"
-        i = find_token(document.header, "\\font_typewriter", 0)
-        if i != -1:
-            val = get_value(document.header, "\\font_typewriter", i)
-            if val in texgyre_fonts:
-                preamble = "\\usepackage{%s}" % val
-                add_to_preamble(document, [preamble])
-                document.header[i] = "\\font_typewriter default"
+                document.header.set(font, "default")
 
 
+@triggers("\\begin_inset IPADeco")
 def revert_ipadeco(document):
     " Revert IPA decorations to ERT "
     i = 0
@@ -986,26 +921,23 @@ def revert_ipachar(document):
         add_to_preamble(document, "\\usepackage{tone}")
 
 
+@header_rule
 def revert_minionpro(document):
     " Revert native MinionPro font definition to LaTeX " 
 
-    if find_token(document.header, "\\use_non_tex_fonts false", 0) != -1: 
-        i = find_token(document.header, "\\font_roman minionpro", 0)
-        if i != -1:
-            osf = False
-            j = find_token(document.header, "\\font_osf true", 0)
-            if j != -1:
-                osf = True
+    if document.header.get("\\use_non_tex_fonts") == "false":
+        if document.header.get("\\font_roman") == "minionpro":
             preamble = "\\usepackage"
-            if osf:
-                document.header[j] = "\\font_osf false"
+            if document.header.get("\\font_osf") == "true":
+                document.header.set("\\font_osf", "false")
             else:
                 preamble += "[lf]"
             preamble += "{MinionPro}"
             add_to_preamble(document, [preamble])
-            document.header[i] = "\\font_roman default"
+            document.header.set("\\font_roman", "default")
 
 
+@header_rule
 def revert_mathfonts(document):
     " Revert native math font definitions to LaTeX " 
 
@@ -1041,6 +973,7 @@ def revert_mathfonts(document):
     del document.header[i]
 
 
+@header_rule
 def revert_mdnomath(document):
     " Revert mathdesign and fourier without math " 
 
@@ -1066,6 +999,7 @@ def revert_mdnomath(document):
                 document.header[i] = "\\font_roman %s" % mathdesign_dict[val]
 
 
+@header_rule
 def convert_mdnomath(document):
     " Change mathdesign font name " 
 
@@ -1083,6 +1017,7 @@ def convert_mdnomath(document):
              document.header[i] = "\\font_roman %s" % mathdesign_dict[val]
 
 
+@header_rule
 def revert_newtxmath(document):
     " Revert native newtxmath definitions to LaTeX " 
 
@@ -1101,6 +1036,7 @@ def revert_newtxmath(document):
             document.header[i] = "\\font_math auto"
 
 
+@header_rule
 def revert_biolinum(document):
     " Revert native biolinum font definition to LaTeX " 
 
@@ -1119,6 +1055,7 @@ def revert_biolinum(document):
             document.header[i] = "\\font_sans default"
 
 
+@header_rule
 def revert_uop(document):
     " Revert native URW Classico (Optima) font definition to LaTeX "
 
@@ -1772,6 +1709,8 @@ def convert_literate(document):
         i = i + 1
 
 
+@paragraph_rule
+@triggers("\\begin_inset Argument item:")
 def revert_itemargs(document):
     " Reverts \\item arguments to TeX-code "
     i = 0
@@ -1796,6 +1735,7 @@ def revert_itemargs(document):
         i = i + 1
 
 
+@header_rule
 def revert_garamondx_newtxmath(document):
     " Revert native garamond newtxmath definition to LaTeX " 
 
@@ -1809,6 +1749,7 @@ def revert_garamondx_newtxmath(document):
             document.header[i] = "\\font_math auto"
 
 
+@header_rule
 def revert_garamondx(document):
     " Revert native garamond font definition to LaTeX " 
 
@@ -1991,6 +1932,7 @@ def convert_againframe_args(document):
         i = j
 
 
+@paragraph_rule
 def convert_corollary_args(document):
     " Converts beamer corrolary-style ERT arguments native InsetArgs "
     
@@ -2048,6 +1990,7 @@ def convert_corollary_args(document):
 
 
 
+@paragraph_rule
 def convert_quote_args(document):
     " Converts beamer quote style ERT args to native InsetArgs "
     
@@ -141,9 +141,180 @@ check_token(line, token):
 is_nonempty_line(line):
   Does line contain something besides whitespace?
 
+BlockList(lines):
+  A list of lines stored in blocks, where inserting and
+  deleting lines does not move all the lines after them.
+
+triggers(*tokens):
+  Decorator that declares the tokens a converter looks for,
+  so that it is not run on documents without them.
+
+LineRule(name, rewrites[, prepare]):
+line_rule(*tokens):
+header_rule(convert):
+  Converters that only rewrite single lines of the body, or
+  only change the header, so that consecutive ones can be
+  applied together.
+
+apply_rules(document, rules):
+  Applies the LineRules rules with a single pass over the body.
+
+IndexedLines(lines):
+IndexedBlocks(lines):
+  A list, or a BlockList, of lines that the functions above
+  can answer faster, using indexes that are built when the
+  list is queried often enough and dropped whenever it
+  changes. So
+    find_end_of_inset(lines, i)
+  returns the same as for a plain list, but, once the index
+  is built, without scanning the lines in between. In the
+  same way, find_token and the like look the tokens up in
+  a table of the lines on which every token starts, which
+  follows the changes of the lines.
+
+PackedBlocks(lines):
+IndexedPackedBlocks(lines):
+  A BlockList, and one with indexes, that keeps most of its
+  blocks joined and encoded, and decodes them when they are
+  read, to take less memory.
+
+intern_lines(lines[, table]):
+  Returns the lines with the short lines that repeat, as
+  "\end_layout", shared instead of copied.
+
+HeaderLines(lines):
+  The lines of a header, kept by their first word, so that
+  find_token and the like look parameters up instead of
+  scanning, and the methods get, set, delete and insert_after
+  use them by name, as in
+    document.header.get("\\textclass")
+
+ScanCounts():
+count_scans(counts):
+  Counts, while counts is set by count_scans, the calls of the
+  functions that look for lines, as find_token, find_end_of or
+  get_containing_layout, and the lines they examine, by function.
+  profiling.ConversionProfile uses them to tell the converters
+  whose scans grow faster than the document.
+
 '''
 
 import re
+import sys
+import sre_parse
+import sre_constants
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+try:
+    from itertools import chain
+    chain_blocks = chain.from_iterable
+except (ImportError, AttributeError):
+    # python < 2.6
+    def chain_blocks(blocks):
+        for block in blocks:
+            for line in block:
+                yield line
+
+
+# Counting the scans
+
+class ScanCounts:
+    """ The calls of the functions that look for lines, and the lines
+    they examined, by function, as name: [calls, lines]. The lines are
+    those that a scan of a plain list examines, even when an index
+    answers instead, so that they do not depend on when the indexes are
+    built. The functions that these functions call are part of the
+    outer call."""
+
+    def __init__(self):
+        self.counts = {}
+        # the depth of the counted calls
+        self.depth = 0
+
+
+    def add(self, function, lines):
+        " Records a call of function, that examined lines lines."
+        count = self.counts.get(function)
+        if count is None:
+            self.counts[function] = [1, lines]
+        else:
+            count[0] += 1
+            count[1] += lines
+
+
+    def snapshot(self):
+        " Returns the counts so far, as name: (calls, lines)."
+        return dict([(function, tuple(count))
+                     for function, count in self.counts.items()])
+
+
+# The ScanCounts that the scans are counted in, if any
+scan_counts = None
+
+def count_scans(counts):
+    """ Counts the scans in counts, a ScanCounts, from now on, or stops
+    counting them if counts is None."""
+    global scan_counts
+    scan_counts = counts
+
+
+def counted_scan(span):
+    """ Decorator for the functions that look for lines, that counts
+    their calls in scan_counts, while it is set, with the lines given by
+    span(result, *arguments)."""
+    def declare(function):
+        def counted(*args, **kwargs):
+            counts = scan_counts
+            if counts is None or counts.depth:
+                return function(*args, **kwargs)
+            counts.depth += 1
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                counts.depth -= 1
+            counts.add(function.__name__, span(result, *args, **kwargs))
+            return result
+        counted.__name__ = function.__name__
+        counted.__doc__ = function.__doc__
+        return counted
+    return declare
+
+
+def forward_span(result, lines, tokens, start, end = 0, *args, **kwargs):
+    " The lines examined by find_token and the like."
+    if end == 0 or end > len(lines):
+        end = len(lines)
+    if result == -1:
+        return max(end - start, 0)
+    return result - start + 1
+
+
+def backward_span(result, lines, tokens, start):
+    " The lines examined by find_token_backwards and the like."
+    if result == -1:
+        return max(start + 1, 0)
+    return start - result + 1
+
+
+def end_span(result, lines, i, *args):
+    " The lines examined by find_end_of and the like."
+    if result == -1:
+        return max(len(lines) - i, 0)
+    return result - i
+
+
+def beginning_span(result, lines, i, *args):
+    " The lines examined by find_beginning_of."
+    return max(i - max(result, 0), 0)
+
+
+def container_span(result, lines, i):
+    " The lines examined by get_containing_inset and the like."
+    if not result:
+        return max(i, 0)
+    return i - result[1]
+
 
 # Utilities for one line
 def check_token(line, token):
@@ -164,6 +335,7 @@ def is_nonempty_line(line):
 
 
 # Utilities for a list of lines
+@counted_scan(forward_span)
 def find_token(lines, token, start, end = 0, ignorews = False):
     """ find_token(lines, token, start[[, end], ignorews]) -> int
 
@@ -179,6 +351,36 @@ def find_token(lines, token, start, end = 0, ignorews = False):
     if end == 0 or end > len(lines):
         end = len(lines)
     m = len(token)
+    if not ignorews and start >= 0:
+        i = find_indexed(lines, (token,), start, end)
+        if i is not None:
+            return i
+        # Going through growing slices is faster than indexing every
+        # line, mostly for IndexedLines.
+        i = start
+        step = 64
+        while i < end:
+            for line in lines[i:min(i + step, end)]:
+                if line[:m] == token:
+                    return i
+                i += 1
+            step *= 2
+        return -1
+    if ignorews and start >= 0:
+        if isinstance(lines, HeaderLines):
+            i = lines.find((token,), start, end, True)
+            if i is not None:
+                return i
+        y = token.split()
+        i = start
+        step = 64
+        while i < end:
+            for line in lines[i:min(i + step, end)]:
+                if line.split()[:len(y)] == y:
+                    return i
+                i += 1
+            step *= 2
+        return -1
     for i in xrange(start, end):
         if ignorews:
             x = lines[i].split()
@@ -197,6 +399,7 @@ def find_token_exact(lines, token, start, end = 0):
     return find_token(lines, token, start, end, True)
 
 
+@counted_scan(forward_span)
 def find_tokens(lines, tokens, start, end = 0, ignorews = False):
     """ find_tokens(lines, tokens, start[[, end], ignorews]) -> int
 
@@ -207,6 +410,20 @@ def find_tokens(lines, tokens, start, end = 0, ignorews = False):
     if end == 0 or end > len(lines):
         end = len(lines)
 
+    if not ignorews and start >= 0:
+        i = find_indexed(lines, tokens, start, end)
+        if i is not None:
+            return i
+        i = start
+        step = 64
+        while i < end:
+            for line in lines[i:min(i + step, end)]:
+                for token in tokens:
+                    if line[:len(token)] == token:
+                        return i
+                i += 1
+            step *= 2
+        return -1
     for i in xrange(start, end):
         for token in tokens:
             if ignorews:
@@ -226,6 +443,7 @@ def find_tokens_exact(lines, tokens, start, end = 0):
     return find_tokens(lines, tokens, start, end, True)
 
 
+@counted_scan(forward_span)
 def find_re(lines, rexp, start, end = 0):
     """ find_token_re(lines, rexp, start[, end]) -> int
 
@@ -236,12 +454,31 @@ def find_re(lines, rexp, start, end = 0):
 
     if end == 0 or end > len(lines):
         end = len(lines)
+    if start >= 0:
+        prefix = literal_prefix(rexp)
+        if prefix:
+            # the matches are among the lines that start with prefix
+            i = find_indexed(lines, (prefix,), start, end)
+            while i is not None and i != -1 and not rexp.match(lines[i]):
+                i = find_indexed(lines, (prefix,), i + 1, end)
+            if i is not None:
+                return i
+        i = start
+        step = 64
+        while i < end:
+            for line in lines[i:min(i + step, end)]:
+                if rexp.match(line):
+                    return i
+                i += 1
+            step *= 2
+        return -1
     for i in xrange(start, end):
         if rexp.match(lines[i]):
                 return i
     return -1
 
 
+@counted_scan(backward_span)
 def find_token_backwards(lines, token, start):
     """ find_token_backwards(lines, token, start) -> int
 
@@ -249,6 +486,9 @@ def find_token_backwards(lines, token, start):
     element, in lines[start, end].
 
     Return -1 on failure."""
+    i = find_indexed_backwards(lines, (token,), start)
+    if i is not None:
+        return i
     m = len(token)
     for i in xrange(start, -1, -1):
         line = lines[i]
@@ -257,6 +497,7 @@ def find_token_backwards(lines, token, start):
     return -1
 
 
+@counted_scan(backward_span)
 def find_tokens_backwards(lines, tokens, start):
     """ find_tokens_backwards(lines, token, start) -> int
 
@@ -264,6 +505,9 @@ def find_tokens_backwards(lines, tokens, start):
     element, in lines[end, start].
 
     Return -1 on failure."""
+    i = find_indexed_backwards(lines, tokens, start)
+    if i is not None:
+        return i
     for i in xrange(start, -1, -1):
         line = lines[i]
         for token in tokens:
@@ -307,22 +551,33 @@ def get_quoted_value(lines, token, start, end = 0, default = ""):
     return val.strip('"')
 
 
+# The regular expressions of the options, by name
+option_regexes = {}
+
+def option_regex(option):
+    " Returns the regular expression of option=\"value\", compiled once."
+    rx = option_regexes.get(option)
+    if rx is None:
+        rx = re.compile('(' + option + '\s*=\s*")([^"]+)"')
+        if len(option_regexes) > 1000:
+            option_regexes.clear()
+        option_regexes[option] = rx
+    return rx
+
+
 def get_option_value(line, option):
-    rx = option + '\s*=\s*"([^"]+)"'
-    rx = re.compile(rx)
-    m = rx.search(line)
+    m = option_regex(option).search(line)
     if not m:
       return ""
-    return m.group(1)
+    return m.group(2)
 
 
 def set_option_value(line, option, value):
-    rx = '(' + option + '\s*=\s*")[^"]+"'
-    rx = re.compile(rx)
+    rx = option_regex(option)
     m = rx.search(line)
     if not m:
         return line
-    return re.sub(rx, '\g<1>' + value + '"', line)
+    return rx.sub('\g<1>' + value + '"', line)
 
 
 def del_token(lines, token, start, end = 0):
@@ -339,7 +594,17 @@ def del_token(lines, token, start, end = 0):
     return True
 
 
+@counted_scan(beginning_span)
 def find_beginning_of(lines, i, start_token, end_token):
+    index = structure_index(lines, start_token, end_token)
+    if index is not None and 0 <= i <= len(lines):
+        return index.find_beginning(i)
+    j = _find_beginning_of(lines, i, start_token, end_token)
+    add_scanned(lines, i - max(j, 0))
+    return j
+
+
+def _find_beginning_of(lines, i, start_token, end_token):
     count = 1
     while i > 0:
         i = find_tokens_backwards(lines, [start_token, end_token], i-1)
@@ -354,7 +619,20 @@ def find_beginning_of(lines, i, start_token, end_token):
     return -1
 
 
+@counted_scan(end_span)
 def find_end_of(lines, i, start_token, end_token):
+    index = structure_index(lines, start_token, end_token)
+    if index is not None and i >= 0:
+        return index.find_end(i)
+    j = _find_end_of(lines, i, start_token, end_token)
+    if j == -1:
+        add_scanned(lines, len(lines) - i)
+    else:
+        add_scanned(lines, j - i)
+    return j
+
+
+def _find_end_of(lines, i, start_token, end_token):
     count = 1
     n = len(lines)
     while i < n:
@@ -414,6 +692,7 @@ def is_in_inset(lines, i, inset):
     return (stins, endins)
 
 
+@counted_scan(container_span)
 def get_containing_inset(lines, i):
   ''' 
   Finds out what kind of inset line i is within. Returns a 
@@ -421,15 +700,24 @@ def get_containing_inset(lines, i):
   on which the inset begins, plus the starting and ending line.
   Returns False on any kind of error or if it isn't in an inset.
   '''
-  j = i
-  while True:
-      stins = find_token_backwards(lines, "\\begin_inset", j)
+  index = structure_index(lines, "\\begin_inset", "\\end_inset")
+  if index is not None and 0 <= i < len(lines):
+      stins = index.find_container_backwards(i)
       if stins == -1:
           return False
-      endins = find_end_of_inset(lines, stins)
-      if endins > j:
-          break
-      j = stins - 1
+      endins = index.find_end(stins)
+  else:
+      j = i
+      while True:
+          stins = find_token_backwards(lines, "\\begin_inset", j)
+          if stins == -1:
+              add_scanned(lines, i)
+              return False
+          endins = find_end_of_inset(lines, stins)
+          if endins > j:
+              break
+          j = stins - 1
+      add_scanned(lines, i - stins)
   
   inset = get_value(lines, "\\begin_inset", stins)
   if inset == "":
@@ -438,6 +726,15 @@ def get_containing_inset(lines, i):
   return (inset, stins, endins)
 
 
+# The parameters that can follow \begin_layout, before the paragraph text
+paragraph_parameters = frozenset(["\\noindent", "\\indent",
+    "\\indent-toggle", "\\leftindent", "\\start_of_appendix",
+    "\\paragraph_spacing single", "\\paragraph_spacing onehalf",
+    "\\paragraph_spacing double", "\\paragraph_spacing other", "\\align",
+    "\\labelwidthstring"])
+
+
+@counted_scan(container_span)
 def get_containing_layout(lines, i):
   ''' 
   Finds out what kind of layout line i is within. Returns a 
@@ -446,28 +743,33 @@ def get_containing_layout(lines, i):
   and the start of the apargraph (after all params).
   Returns False on any kind of error.
   '''
-  j = i
-  while True:
-      stlay = find_token_backwards(lines, "\\begin_layout", j)
+  index = structure_index(lines, "\\begin_layout", "\\end_layout")
+  if index is not None and 0 <= i < len(lines):
+      stlay = index.find_container(i)
       if stlay == -1:
           return False
-      endlay = find_end_of_layout(lines, stlay)
-      if endlay > i:
-          break
-      j = stlay - 1
+      endlay = index.find_end(stlay)
+  else:
+      j = i
+      while True:
+          stlay = find_token_backwards(lines, "\\begin_layout", j)
+          if stlay == -1:
+              add_scanned(lines, i)
+              return False
+          endlay = find_end_of_layout(lines, stlay)
+          if endlay > i:
+              break
+          j = stlay - 1
+      add_scanned(lines, i - stlay)
   
   lay = get_value(lines, "\\begin_layout", stlay)
   if lay == "":
       # shouldn't happen
       return False
-  par_params = ["\\noindent", "\\indent", "\\indent-toggle", "\\leftindent",
-                "\\start_of_appendix", "\\paragraph_spacing single",
-                "\\paragraph_spacing onehalf", "\\paragraph_spacing double",
-                "\\paragraph_spacing other", "\\align", "\\labelwidthstring"]
   stpar = stlay
   while True:
       stpar += 1
-      if lines[stpar] not in par_params:
+      if lines[stpar] not in paragraph_parameters:
           break
   return (lay, stlay, endlay, stpar)
 
@@ -486,3 +788,1608 @@ def count_pars_in_inset(lines, i):
           pars += 1
   
   return pars
+
+
+# Indexes over a list of lines
+
+class StructureIndex:
+    """ The matching of start_token and end_token (e.g. "\\begin_inset"
+    and "\\end_inset") in a list of lines, computed in one pass.
+
+    With depth(j) the number of start tokens minus the number of end
+    tokens in lines[0..j], find_end_of(lines, i, ...) is the first line
+    j > i with depth(j) == depth(i) - 1, and find_beginning_of is the
+    same going backwards. Both are stored for every line, so that the
+    answers are the same as those of the scans, even for unbalanced
+    lines."""
+
+    def __init__(self, lines, start_token, end_token):
+        n = len(lines)
+        ls = len(start_token)
+        le = len(end_token)
+        depth = array('l', [0]) * n
+        self.begins = array('l', [-1]) * (n + 1)
+        self.ends = array('l', [-1]) * n
+        self.last_starts = array('l', [-1]) * n
+
+        # last_at[d] is the last line k seen with depth(k - 1) == d
+        last_at = {}
+        d = 0
+        for k in xrange(n):
+            self.begins[k] = last_at.get(d - 1, -1)
+            last_at[d] = k
+            line = lines[k]
+            if line[:ls] == start_token:
+                d += 1
+            elif line[:le] == end_token:
+                d -= 1
+            depth[k] = d
+        self.begins[n] = last_at.get(d - 1, -1)
+
+        # next_at[d] is the first line k seen with depth(k) == d
+        next_at = {}
+        for k in xrange(n - 1, -1, -1):
+            d = depth[k]
+            self.ends[k] = next_at.get(d - 1, -1)
+            next_at[d] = k
+
+        # The start tokens that contain each line, see find_container
+        # and find_container_backwards.
+        self.containers = array('l', [-1]) * n
+        self.containers_backwards = array('l', [-1]) * n
+        open_starts = []
+        last = -1
+        d = 0
+        for k in xrange(n):
+            if depth[k] > d:
+                # a start token
+                if last == -1:
+                    self.containers_backwards[k] = -1
+                elif self.ends[last] > k - 1:
+                    self.containers_backwards[k] = last
+                else:
+                    self.containers_backwards[k] = \
+                        self.containers_backwards[last]
+                last = k
+                open_starts.append(k)
+            d = depth[k]
+            while open_starts and self.ends[open_starts[-1]] <= k:
+                # this includes the unmatched ones, with end -1
+                open_starts.pop()
+            if open_starts:
+                self.containers[k] = open_starts[-1]
+            self.last_starts[k] = last
+
+
+    def find_end(self, i):
+        " As find_end_of(lines, i, ...), for i >= 0."
+        if i >= len(self.ends):
+            return -1
+        return self.ends[i]
+
+
+    def find_beginning(self, i):
+        " As find_beginning_of(lines, i, ...), for 0 <= i <= len(lines)."
+        return self.begins[i]
+
+
+    def find_container(self, i):
+        """ The last start token at or before line i that ends after i,
+        i.e. the innermost container of line i, as searched by
+        get_containing_layout, for 0 <= i < len(lines)."""
+        return self.containers[i]
+
+
+    def find_container_backwards(self, i):
+        """ The start token found by get_containing_inset for line i, for
+        0 <= i < len(lines). If the last start token before i ends after
+        i, that is the container of i. If not, the search goes on from
+        that start token, and stops at the first one, going backwards,
+        that ends after the next start token. In a balanced document,
+        this is the container of the last start token before i."""
+        k = self.last_starts[i]
+        if k == -1 or self.ends[k] > i:
+            return k
+        return self.containers_backwards[k]
+
+
+class TokenIndex:
+    """ The lines on which every token starts, where the token of a line
+    is what comes before its first space.
+
+    The lines are split in chunks, and every chunk has a table of the
+    tokens of its lines to their sorted offsets in the chunk. A change
+    of the lines only drops the tables of the chunks it touches, and a
+    table is only built once the scans of its chunk add up to visits
+    times its size, so that the chunks that keep changing are scanned
+    as before."""
+
+    size = 512
+    visits = 2
+    # shorter lists of lines are scanned, that is as fast
+    least = 8 * size
+
+    def __init__(self, n):
+        self.sizes = [self.size] * (n // self.size)
+        if n % self.size or not self.sizes:
+            self.sizes.append(n % self.size)
+        count = len(self.sizes)
+        self.starts = [0] * count
+        # the starts of the chunks before valid are up to date
+        self.valid = 1
+        self.tables = [None] * count
+        self.keys = [None] * count
+        self.scanned = [0] * count
+        # the number of tables built
+        self.built = 0
+
+
+    def chunk(self, i):
+        """ The chunk of line i, or the last chunk if i is past the end.
+        The starts of the chunks up to it are brought up to date."""
+        starts = self.starts
+        sizes = self.sizes
+        c = self.valid - 1
+        if i < starts[c]:
+            return bisect_right(starts, i, 0, c) - 1
+        last = len(sizes) - 1
+        while c < last and i >= starts[c] + sizes[c]:
+            starts[c + 1] = starts[c] + sizes[c]
+            c += 1
+        self.valid = max(self.valid, c + 1)
+        return c
+
+
+    def drop(self, c):
+        " Drops the table of chunk c."
+        if self.tables[c] is not None:
+            self.built -= 1
+        self.tables[c] = None
+        self.keys[c] = None
+        self.scanned[c] = 0
+
+
+    def table(self, lines, c):
+        " The table of chunk c, or None if it is not worth building (yet)."
+        table = self.tables[c]
+        if table is not None or \
+           self.scanned[c] < self.visits * self.sizes[c]:
+            return table
+        table = {}
+        start = self.starts[c]
+        offset = 0
+        for line in lines[start:start + self.sizes[c]]:
+            key = line.split(' ', 1)[0]
+            offsets = table.get(key)
+            if offsets is None:
+                table[key] = array('H', (offset,))
+            else:
+                offsets.append(offset)
+            offset += 1
+        try:
+            self.keys[c] = sorted(table)
+        except UnicodeError:
+            # str and unicode lines that can not be compared, scan them
+            self.scanned[c] = -sys.maxint - 1
+            return None
+        self.tables[c] = table
+        self.built += 1
+        return table
+
+
+    def replaced(self, start, stop, count):
+        " Lines start to stop, that exist, were replaced by count lines."
+        sizes = self.sizes
+        first = c = self.chunk(start)
+        base = self.starts[first]
+        offset = start - base
+        removed = stop - start
+        self.drop(c)
+        while removed:
+            taken = min(removed, sizes[c] - offset)
+            sizes[c] -= taken
+            self.drop(c)
+            removed -= taken
+            c += 1
+            offset = 0
+        sizes[first] += count
+
+        for c in xrange(max(c, first + 1) - 1, first - 1, -1):
+            if not sizes[c] and len(sizes) > 1:
+                for chunks in (sizes, self.starts, self.tables, self.keys,
+                               self.scanned):
+                    del chunks[c]
+        if first < len(sizes) and sizes[first] > 2 * self.size:
+            n = sizes[first]
+            pieces = [self.size] * (n // self.size)
+            if n % self.size:
+                pieces.append(n % self.size)
+            sizes[first:first + 1] = pieces
+            for chunks, value in ((self.starts, 0), (self.tables, None),
+                                  (self.keys, None), (self.scanned, 0)):
+                chunks[first:first + 1] = [value] * len(pieces)
+        # the chunks from first on start where they did, or after
+        if first < len(sizes):
+            self.starts[first] = base
+        self.valid = max(1, min(self.valid, first + 1, len(sizes)))
+
+
+    def line_changed(self, i, old, new):
+        " Line i, that was old, now is new."
+        c = self.chunk(i)
+        table = self.tables[c]
+        if table is None:
+            return
+        key = old.split(' ', 1)[0]
+        if new.split(' ', 1)[0] == key:
+            return
+        offset = i - self.starts[c]
+        keys = self.keys[c]
+        offsets = table[key]
+        offsets.remove(offset)
+        if not offsets:
+            del table[key]
+            del keys[bisect_left(keys, key)]
+        key = new.split(' ', 1)[0]
+        offsets = table.get(key)
+        try:
+            if offsets is None:
+                table[key] = array('H', (offset,))
+                insort(keys, key)
+            else:
+                insort(offsets, offset)
+        except UnicodeError:
+            self.drop(c)
+
+
+    def first(self, lines, c, token, lo, hi):
+        """ The first offset in [lo, hi) of a line of chunk c, that has a
+        table, that starts with token, or hi if there is none."""
+        table = self.tables[c]
+        m = len(token)
+        space = token.find(' ')
+        if space != -1:
+            offsets = table.get(token[:space])
+            if offsets:
+                start = self.starts[c]
+                for k in xrange(bisect_left(offsets, lo), len(offsets)):
+                    offset = offsets[k]
+                    if offset >= hi:
+                        break
+                    if lines[start + offset][:m] == token:
+                        return offset
+            return hi
+        keys = self.keys[c]
+        k = bisect_left(keys, token)
+        while k < len(keys) and keys[k][:m] == token:
+            offsets = table[keys[k]]
+            j = bisect_left(offsets, lo)
+            if j < len(offsets) and offsets[j] < hi:
+                hi = offsets[j]
+            k += 1
+        return hi
+
+
+    def last(self, lines, c, token, lo, hi):
+        """ The last offset in (lo, hi] of a line of chunk c, that has a
+        table, that starts with token, or lo if there is none."""
+        table = self.tables[c]
+        m = len(token)
+        space = token.find(' ')
+        if space != -1:
+            offsets = table.get(token[:space])
+            if offsets:
+                start = self.starts[c]
+                for k in xrange(bisect_right(offsets, hi) - 1, -1, -1):
+                    offset = offsets[k]
+                    if offset <= lo:
+                        break
+                    if lines[start + offset][:m] == token:
+                        return offset
+            return lo
+        keys = self.keys[c]
+        k = bisect_left(keys, token)
+        while k < len(keys) and keys[k][:m] == token:
+            offsets = table[keys[k]]
+            j = bisect_right(offsets, hi) - 1
+            if j >= 0 and offsets[j] > lo:
+                lo = offsets[j]
+            k += 1
+        return lo
+
+
+    def scan(self, lines, tokens, i, stop):
+        """ The first line in [i, stop) that starts with one of tokens, or
+        stop if there is none, going through the lines."""
+        step = 64
+        if len(tokens) == 1:
+            token = tokens[0]
+            m = len(token)
+            while i < stop:
+                for line in lines[i:min(i + step, stop)]:
+                    if line[:m] == token:
+                        return i
+                    i += 1
+                step *= 4
+            return stop
+        while i < stop:
+            for line in lines[i:min(i + step, stop)]:
+                for token in tokens:
+                    if line[:len(token)] == token:
+                        return i
+                i += 1
+            step *= 4
+        return stop
+
+
+    def find(self, lines, tokens, start, end):
+        """ As find_tokens(lines, tokens, start, end), for 0 <= start and
+        end <= len(lines)."""
+        if start >= end:
+            return -1
+        sizes = self.sizes
+        starts = self.starts
+        c = self.chunk(start)
+        first = starts[c]
+        while first < end:
+            lo = max(start - first, 0)
+            hi = min(end - first, sizes[c])
+            if self.tables[c] is None and self.table(lines, c) is None:
+                stop = first + hi
+                i = self.scan(lines, tokens, first + lo, stop)
+                if i < stop:
+                    self.scanned[c] += i - first - lo + 1
+                    return i
+                self.scanned[c] += hi - lo
+            else:
+                best = hi
+                for token in tokens:
+                    best = self.first(lines, c, token, lo, best)
+                if best < hi:
+                    return first + best
+            first += sizes[c]
+            c += 1
+            if c == len(sizes):
+                break
+            if c == self.valid:
+                starts[c] = first
+                self.valid = c + 1
+        return -1
+
+
+    def find_backwards(self, lines, tokens, start):
+        """ As find_tokens_backwards(lines, tokens, start), for
+        0 <= start < len(lines)."""
+        sizes = self.sizes
+        starts = self.starts
+        c = self.chunk(start)
+        while c >= 0:
+            first = starts[c]
+            hi = min(start - first, sizes[c] - 1)
+            if self.tables[c] is None and self.table(lines, c) is None:
+                chunk = lines[first:first + hi + 1]
+                for k in xrange(hi, -1, -1):
+                    line = chunk[k]
+                    for token in tokens:
+                        if line[:len(token)] == token:
+                            self.scanned[c] += hi - k + 1
+                            return first + k
+                self.scanned[c] += hi + 1
+            else:
+                best = -1
+                for token in tokens:
+                    best = self.last(lines, c, token, best, hi)
+                if best != -1:
+                    return first + best
+            c -= 1
+        return -1
+
+
+def line_key(line):
+    " The first two words of line, its key in a TokenHistogram."
+    i = line.find(' ')
+    if i != -1:
+        i = line.find(' ', i + 1)
+        if i != -1:
+            return line[:i]
+    return line
+
+
+class TokenHistogram:
+    """ Counts the lines that start with a backslash by their first two
+    words, so that a token that no line starts with can be told apart
+    without scanning the lines.
+
+    Lines can be added as they show up, but the counts are not lowered
+    when lines go away: a token may still be counted after its last
+    line is gone, but a token that is not counted is in no line."""
+
+    def __init__(self, lines = ()):
+        self.counts = {}
+        # the keys, kept sorted to find those that start with a token
+        self.keys = []
+        self.add(lines)
+
+
+    def add(self, lines):
+        " Counts lines."
+        counts = self.counts
+        for line in lines:
+            if line[:1] == '\\':
+                key = line_key(line)
+                if key in counts:
+                    counts[key] += 1
+                else:
+                    counts[key] = 1
+                    insort(self.keys, key)
+
+
+    def has(self, token):
+        """ Returns False if no line starts with token, True if some line
+        may start with it."""
+        if token[:1] != '\\':
+            return True
+        # a line that starts with token has a key that starts with this
+        token = line_key(token)
+        if token in self.counts:
+            return True
+        try:
+            i = bisect_left(self.keys, token)
+            return i < len(self.keys) and self.keys[i].startswith(token)
+        except UnicodeError:
+            return True
+
+
+class BlockList(object):
+    """ A list of lines kept as a list of blocks of about size lines, so
+    that inserting or deleting lines only moves the lines of a block,
+    instead of all the lines after them.
+
+    It has all the methods of a list, and its slices are lists. Getting
+    a line is slower than from a list, so it only pays for very long
+    lists of lines that change a lot."""
+
+    size = 1024
+    __hash__ = None
+
+
+    def __init__(self, lines = ()):
+        self.set_blocks(list(lines))
+
+
+    def set_blocks(self, lines):
+        " Splits the list lines in blocks."
+        size = self.size
+        self.blocks = [lines[k:k + size]
+                       for k in xrange(0, len(lines), size)] or [[]]
+        self.starts = [0] * len(self.blocks)
+        self.valid = 1
+        self.length = len(lines)
+        self.forget()
+
+
+    def forget(self):
+        " Forgets the block last located."
+        self.lo = self.hi = 0
+        self.block = None
+
+
+    def locate(self, i):
+        """ Returns the block of line i, 0 <= i <= len(self), or the last
+        block for len(self), and makes it the block last located. The
+        starts of the blocks up to it are brought up to date."""
+        starts = self.starts
+        blocks = self.blocks
+        b = self.valid - 1
+        if i < starts[b]:
+            b = bisect_right(starts, i, 0, b) - 1
+        else:
+            last = len(blocks) - 1
+            while b < last and i >= starts[b] + len(blocks[b]):
+                starts[b + 1] = starts[b] + len(blocks[b])
+                b += 1
+            if b >= self.valid:
+                self.valid = b + 1
+        self.block = blocks[b]
+        self.lo = starts[b]
+        self.hi = self.lo + len(self.block)
+        return b
+
+
+    def position(self, i):
+        " The position of line i, that may be negative, as for a list."
+        n = self.length
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("list index out of range")
+        return i
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, i):
+        # the block last located is the likeliest to have line i, and
+        # numbers compare lower than slices, that go on to get
+        if self.lo <= i < self.hi:
+            return self.block[i - self.lo]
+        return self.get(i)
+
+
+    def get(self, i):
+        " As self[i], for a line not in the block last located, or a slice."
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                return list(self)[i]
+            return self.slice(start, stop)
+        i = self.position(i)
+        self.locate(i)
+        return self.block[i - self.lo]
+
+
+    def slice(self, start, stop):
+        " The list of lines start to stop, 0 <= start, stop <= len(self)."
+        if stop <= start:
+            return []
+        b = self.locate(start)
+        if stop <= self.hi:
+            return self.block[start - self.lo:stop - self.lo]
+        result = self.block[start - self.lo:]
+        blocks = self.blocks
+        end = self.hi
+        b += 1
+        while end < stop:
+            block = blocks[b]
+            result.extend(block[:stop - end])
+            end += len(block)
+            b += 1
+        return result
+
+
+    def bounds(self, i, j):
+        " The lines of the slice i:j, as passed to __getslice__."
+        n = self.length
+        i = min(max(i, 0), n)
+        return i, min(max(j, i), n)
+
+
+    def __getslice__(self, i, j):
+        i, j = self.bounds(i, j)
+        return self.slice(i, j)
+
+
+    def __iter__(self):
+        return chain_blocks(self.blocks)
+
+
+    def __reversed__(self):
+        for block in reversed(self.blocks):
+            for line in reversed(block):
+                yield line
+
+
+    def __setitem__(self, i, line):
+        if self.lo <= i < self.hi:
+            self.block[i - self.lo] = line
+            return
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                lines = list(self)
+                lines[i] = line
+                self.set_blocks(lines)
+            else:
+                self.splice(start, max(start, stop), list(line))
+            return
+        i = self.position(i)
+        self.locate(i)
+        self.block[i - self.lo] = line
+
+
+    def __setslice__(self, i, j, lines):
+        i, j = self.bounds(i, j)
+        self.splice(i, j, list(lines))
+
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                lines = list(self)
+                del lines[i]
+                self.set_blocks(lines)
+            else:
+                self.splice(start, max(start, stop), [])
+            return
+        i = self.position(i)
+        self.splice(i, i + 1, [])
+
+
+    def __delslice__(self, i, j):
+        i, j = self.bounds(i, j)
+        self.splice(i, j, [])
+
+
+    def splice(self, start, stop, lines):
+        """ Replaces the lines start to stop, 0 <= start <= stop <= len(self),
+        by the list lines."""
+        blocks = self.blocks
+        starts = self.starts
+        b = self.locate(start)
+        block = self.block
+        lo = self.lo
+        if stop <= self.hi:
+            block[start - lo:stop - lo] = lines
+        else:
+            # the end of the first block, the blocks in between and the
+            # start of the last one go
+            end = self.hi
+            del block[start - lo:]
+            k = b + 1
+            while end < stop:
+                size = len(blocks[k])
+                if end + size <= stop:
+                    end += size
+                    k += 1
+                else:
+                    del blocks[k][:stop - end]
+                    end = stop
+            del blocks[b + 1:k]
+            del starts[b + 1:k]
+            block.extend(lines)
+        self.length += len(lines) - (stop - start)
+
+        # keep the blocks between a quarter and twice of size
+        size = self.size
+        n = len(block)
+        if n > 2 * size:
+            pieces = [block[k:k + size] for k in xrange(0, n, size)]
+            blocks[b:b + 1] = pieces
+            starts[b:b + 1] = [lo] * len(pieces)
+        elif n < size // 4 and b + 1 < len(blocks) and \
+             n + len(blocks[b + 1]) <= 2 * size:
+            block.extend(blocks[b + 1])
+            del blocks[b + 1]
+            del starts[b + 1]
+        elif not n and len(blocks) > 1:
+            del blocks[b]
+            del starts[b]
+            if b < len(blocks):
+                starts[b] = lo
+        self.valid = max(1, min(self.valid, b + 1, len(blocks)))
+        self.forget()
+
+
+    def append(self, line):
+        block = self.blocks[-1]
+        if len(block) >= self.size:
+            block = []
+            self.blocks.append(block)
+            self.starts.append(0)
+        block.append(line)
+        self.length += 1
+        if block is self.block:
+            self.hi += 1
+
+
+    def extend(self, lines):
+        self.splice(self.length, self.length, list(lines))
+
+
+    def __iadd__(self, lines):
+        self.extend(lines)
+        return self
+
+
+    def __imul__(self, n):
+        self.set_blocks(list(self) * n)
+        return self
+
+
+    def insert(self, i, line):
+        n = self.length
+        if i < 0:
+            i = max(i + n, 0)
+        i = min(i, n)
+        self.splice(i, i, [line])
+
+
+    def pop(self, i = -1):
+        if not self.length:
+            raise IndexError("pop from empty list")
+        i = self.position(i)
+        line = self[i]
+        self.splice(i, i + 1, [])
+        return line
+
+
+    def index(self, line, start = 0, stop = None):
+        start, stop, step = slice(start, stop).indices(self.length)
+        try:
+            return start + self.slice(start, stop).index(line)
+        except ValueError:
+            raise ValueError("list.index(x): x not in list")
+
+
+    def count(self, line):
+        result = 0
+        for block in self.blocks:
+            result += block.count(line)
+        return result
+
+
+    def __contains__(self, line):
+        for block in self.blocks:
+            if line in block:
+                return True
+        return False
+
+
+    def remove(self, line):
+        try:
+            i = self.index(line)
+        except ValueError:
+            raise ValueError("list.remove(x): x not in list")
+        del self[i]
+
+
+    def reverse(self):
+        lines = list(self)
+        lines.reverse()
+        self.set_blocks(lines)
+
+
+    def sort(self, *args, **kwargs):
+        lines = list(self)
+        lines.sort(*args, **kwargs)
+        self.set_blocks(lines)
+
+
+    def __add__(self, lines):
+        return list(self) + list(lines)
+
+
+    def __radd__(self, lines):
+        return list(lines) + list(self)
+
+
+    def __mul__(self, n):
+        return list(self) * n
+
+
+    __rmul__ = __mul__
+
+
+    def __eq__(self, lines):
+        if not isinstance(lines, (list, BlockList)):
+            return NotImplemented
+        return len(self) == len(lines) and list(self) == list(lines)
+
+
+    def __ne__(self, lines):
+        result = self.__eq__(lines)
+        if result is NotImplemented:
+            return result
+        return not result
+
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class LineIndexes(object):
+    """ The indexes, used to speed up the functions of this module, of a
+    list of lines, to be mixed with the class of the list, base.
+
+    A structure index is built only once the scans of the lines since
+    their last change add up to the length of the list, so that
+    building it costs no more than the scans already done. Any change
+    that can move a start or end token drops all of them. The token
+    index follows the changes, see TokenIndex.
+
+    The lines inserted, deleted and rewritten in place since the list
+    was made are counted, for the profiles of the conversions."""
+
+    def __init__(self, lines = ()):
+        self.base.__init__(self, lines)
+        self.indexes = {}
+        self.scanned = 0
+        self.tokens = None
+        self.histogram = None
+        self.inserted = 0
+        self.deleted = 0
+        self.rewritten = 0
+
+
+    def structure_index(self, start_token, end_token):
+        """ Returns the StructureIndex for this pair of tokens, or None if
+        it is not worth building it (yet)."""
+        key = (start_token, end_token)
+        index = self.indexes.get(key)
+        if index is not None:
+            return index
+        if self.scanned < len(self):
+            return None
+        if not start_token or not end_token or \
+           start_token.startswith(end_token) or \
+           end_token.startswith(start_token):
+            # the scans disagree on lines that match both tokens
+            return None
+        index = StructureIndex(self, start_token, end_token)
+        self.indexes[key] = index
+        return index
+
+
+    def token_index(self):
+        " Returns the TokenIndex of the lines."
+        if self.tokens is None:
+            self.tokens = TokenIndex(len(self))
+        return self.tokens
+
+
+    def token_histogram(self):
+        """ Returns the TokenHistogram of the lines, that counts the new
+        lines as they are added."""
+        if self.histogram is None:
+            self.histogram = TokenHistogram(self)
+        return self.histogram
+
+
+    def changed(self):
+        " Drops all the indexes, the lines have been moved around."
+        if self.indexes:
+            self.indexes = {}
+        self.scanned = 0
+        self.tokens = None
+        self.histogram = None
+
+
+    def replaced(self, start, stop, count):
+        " Updates the indexes, lines start to stop became count lines."
+        self.inserted += count
+        self.deleted += stop - start
+        if self.indexes:
+            self.indexes = {}
+        self.scanned = 0
+        if self.tokens is not None:
+            self.tokens.replaced(start, stop, count)
+        if self.histogram is not None and count:
+            self.histogram.add(self[start:start + count])
+
+
+    def bounds(self, i, j):
+        " The lines of the slice i:j, as passed to __setslice__."
+        n = len(self)
+        i = min(max(i, 0), n)
+        return i, min(max(j, i), n)
+
+
+    def __setitem__(self, i, line):
+        if isinstance(i, slice):
+            line = list(line)
+            start, stop, step = i.indices(len(self))
+            self.base.__setitem__(self, i, line)
+            if step == 1:
+                self.replaced(start, max(start, stop), len(line))
+            else:
+                self.changed()
+            return
+
+        old = self.base.__getitem__(self, i)
+        self.base.__setitem__(self, i, line)
+        self.rewritten += 1
+        if self.indexes:
+            # replacing a line keeps the positions of all the others
+            for start_token, end_token in self.indexes:
+                if check_token(old, start_token) != \
+                       check_token(line, start_token) or \
+                   check_token(old, end_token) != \
+                       check_token(line, end_token):
+                    self.indexes = {}
+                    self.scanned = 0
+                    break
+        if self.tokens is not None and self.tokens.built:
+            if i < 0:
+                i += len(self)
+            self.tokens.line_changed(i, old, line)
+        if self.histogram is not None:
+            self.histogram.add((line,))
+
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            self.base.__delitem__(self, i)
+            if step == 1:
+                self.replaced(start, max(start, stop), 0)
+            else:
+                self.changed()
+            return
+        n = len(self)
+        self.base.__delitem__(self, i)
+        if i < 0:
+            i += n
+        self.replaced(i, i + 1, 0)
+
+
+    def __setslice__(self, i, j, lines):
+        lines = list(lines)
+        i, j = self.bounds(i, j)
+        self.base.__setslice__(self, i, j, lines)
+        self.replaced(i, j, len(lines))
+
+
+    def __delslice__(self, i, j):
+        i, j = self.bounds(i, j)
+        self.base.__delslice__(self, i, j)
+        self.replaced(i, j, 0)
+
+
+    def __iadd__(self, lines):
+        self.extend(lines)
+        return self
+
+
+    def __imul__(self, n):
+        self.changed()
+        return self.base.__imul__(self, n)
+
+
+    def append(self, line):
+        self.base.append(self, line)
+        self.replaced(len(self) - 1, len(self) - 1, 1)
+
+
+    def extend(self, lines):
+        lines = list(lines)
+        n = len(self)
+        self.base.extend(self, lines)
+        self.replaced(n, n, len(lines))
+
+
+    def insert(self, i, line):
+        n = len(self)
+        if i < 0:
+            i = max(i + n, 0)
+        i = min(i, n)
+        self.base.insert(self, i, line)
+        self.replaced(i, i, 1)
+
+
+    def pop(self, i = -1):
+        n = len(self)
+        line = self.base.pop(self, i)
+        if i < 0:
+            i += n
+        self.replaced(i, i + 1, 0)
+        return line
+
+
+    def remove(self, line):
+        del self[self.index(line)]
+
+
+    def reverse(self):
+        self.changed()
+        self.base.reverse(self)
+
+
+    def sort(self, *args, **kwargs):
+        self.changed()
+        self.base.sort(self, *args, **kwargs)
+
+
+class IndexedLines(LineIndexes, list):
+    """ A list of lines that carries indexes, see LineIndexes. So
+    find_end_of_inset(lines, i) returns the same as for a plain list,
+    but, once the index is built, without scanning the lines."""
+
+    base = list
+
+
+class IndexedBlocks(LineIndexes, BlockList):
+    """ A BlockList that carries indexes, see LineIndexes. It is faster
+    than an IndexedLines from about least lines on."""
+
+    base = BlockList
+    least = 400000
+
+
+def intern_lines(lines, table = None, longest = 40):
+    """ Returns the list of lines where the lines up to longest
+    characters that repeat are the same object, found in the dictionary
+    table, which grows with the new ones."""
+    if table is None:
+        table = {}
+    get = table.setdefault
+    return [len(line) <= longest and get(line, line) or line
+            for line in lines]
+
+
+class PackedLines(object):
+    """ The lines of a block of a PackedBlocks, joined and encoded as
+    utf-8, that only take a few bytes more than their text. The lines
+    are decoded again each time they are read."""
+
+    __slots__ = ("data", "length")
+
+    def __init__(self, data, length):
+        self.data = data
+        self.length = length
+
+
+    def pack(lines):
+        """ Returns the PackedLines of the list lines, or None if they can
+        not be packed."""
+        if not lines:
+            return None
+        try:
+            text = u"\n".join(lines)
+        except UnicodeError:
+            # a line that was not decoded
+            return None
+        if text.count(u"\n") != len(lines) - 1:
+            # a line with an end of line in it
+            return None
+        return PackedLines(text.encode("utf-8"), len(lines))
+
+    pack = staticmethod(pack)
+
+
+    def unpack(self):
+        " Returns the list of the lines."
+        return self.data.decode("utf-8").split(u"\n")
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, i):
+        return self.unpack()[i]
+
+
+    def __getslice__(self, i, j):
+        return self.unpack()[i:j]
+
+
+    def __iter__(self):
+        return iter(self.unpack())
+
+
+    def __reversed__(self):
+        return reversed(self.unpack())
+
+
+    def __contains__(self, line):
+        return line in self.unpack()
+
+
+    def count(self, line):
+        return self.unpack().count(line)
+
+
+class PackedBlocks(BlockList):
+    """ A BlockList whose blocks are kept packed, see PackedLines, but for
+    the ones last located or changed, that are packed again after
+    cache more of them. Reading the lines of a packed block does not
+    unpack it for good. So most lines only take the memory of their
+    text.
+
+    It is slower than a BlockList, as it decodes the lines it reads
+    again and again, but it takes several times less memory."""
+
+    cache = 64
+
+    def set_blocks(self, lines):
+        # the blocks unpacked or changed since the last pack_blocks
+        self.unpacked = 0
+        self.holding = False
+        BlockList.set_blocks(self, lines)
+        self.pack_blocks()
+
+
+    def pack_blocks(self, keep = None):
+        " Packs all the unpacked blocks but keep and the one last located."
+        blocks = self.blocks
+        for b in xrange(len(blocks)):
+            block = blocks[b]
+            if isinstance(block, list) and block is not self.block and \
+               block is not keep:
+                packed = PackedLines.pack(block)
+                if packed is not None:
+                    blocks[b] = packed
+        self.unpacked = 0
+
+
+    def unpack(self, b):
+        " Returns block b, unpacked for good."
+        block = self.blocks[b]
+        if isinstance(block, PackedLines):
+            block = block.unpack()
+            self.blocks[b] = block
+            self.unpacked += 1
+            if self.unpacked > self.cache and not self.holding:
+                self.pack_blocks(block)
+        return block
+
+
+    def locate(self, i):
+        b = BlockList.locate(self, i)
+        if isinstance(self.block, PackedLines):
+            # the block last located stays unpacked
+            self.block = self.unpack(b)
+        return b
+
+
+    def splice(self, start, stop, lines):
+        # unpack the blocks that BlockList.splice changes, the first one
+        # last, to be the block last located
+        self.holding = True
+        try:
+            e = self.locate(stop)
+            for k in (e + 1, e):
+                if k < len(self.blocks):
+                    self.unpack(k)
+            b = self.locate(start)
+            if b + 1 < len(self.blocks):
+                self.unpack(b + 1)
+        finally:
+            self.holding = False
+        BlockList.splice(self, start, stop, lines)
+        self.unpacked += 1 + len(lines) // self.size
+        if self.unpacked > self.cache:
+            self.pack_blocks()
+
+
+    def append(self, line):
+        self.unpack(len(self.blocks) - 1)
+        BlockList.append(self, line)
+
+
+class IndexedPackedBlocks(LineIndexes, PackedBlocks):
+    """ A PackedBlocks that carries indexes, see LineIndexes, for the
+    documents converted with the least memory."""
+
+    base = PackedBlocks
+
+
+def first_word(line):
+    " The first word of line, its key in a HeaderLines."
+    words = line.split(None, 1)
+    if words:
+        return words[0]
+    return ''
+
+
+class HeaderLines(LineIndexes, list):
+    """ The lines of the header of a document, that keep the positions of
+    the lines by their first word. So find_token(header, "\\\\textclass", 0)
+    and the like look the parameter up instead of scanning the header,
+    and the methods below get and change the parameters by name.
+
+    The positions are kept while lines are replaced by lines with the
+    same first word, as when a parameter is set, and found again after
+    any other change."""
+
+    base = list
+
+    def __init__(self, lines = ()):
+        LineIndexes.__init__(self, lines)
+        self.positions = None
+        self.words = None
+
+
+    def index_words(self):
+        " Finds the positions of the lines by their first word."
+        positions = {}
+        for i in xrange(len(self)):
+            positions.setdefault(first_word(self[i]), []).append(i)
+        words = positions.keys()
+        try:
+            words.sort()
+        except UnicodeError:
+            # non ascii words that were not decoded, looked up by scanning
+            words = None
+        self.positions = positions
+        self.words = words
+
+
+    def candidates(self, token, ignorews = False):
+        """ Returns the sorted positions of the lines that can start with
+        token, as find_token(self, token, 0, 0, ignorews) looks for it, or
+        None if they are not known."""
+        if self.positions is None:
+            self.index_words()
+        word = first_word(token)
+        if ignorews:
+            if not word:
+                return None
+            return self.positions.get(word, ())
+        if not word or token[0].isspace():
+            return None
+        if word != token:
+            # the lines that go on with the rest of token after the word
+            return self.positions.get(word, ())
+        if self.words is None:
+            return None
+        # the lines whose first word starts with token
+        words = self.words
+        k = bisect_left(words, token)
+        found = []
+        while k < len(words) and words[k].startswith(token):
+            found.extend(self.positions[words[k]])
+            k += 1
+        if len(found) > 1:
+            found.sort()
+        return found
+
+
+    def find(self, tokens, start, end, ignorews = False):
+        """ As find_tokens(self, tokens, start, end, ignorews), or None if
+        the lines are to be scanned instead."""
+        best = -1
+        try:
+            for token in tokens:
+                positions = self.candidates(token, ignorews)
+                if positions is None:
+                    return None
+                if ignorews:
+                    words = token.split()
+                for i in positions[bisect_left(positions, start):]:
+                    if i >= end or best != -1 and i >= best:
+                        break
+                    line = self[i]
+                    if ignorews:
+                        if line.split()[:len(words)] == words:
+                            best = i
+                            break
+                    elif line[:len(token)] == token:
+                        best = i
+                        break
+        except UnicodeError:
+            return None
+        return best
+
+
+    def find_backwards(self, tokens, start):
+        """ As find_tokens_backwards(self, tokens, start), or None if the
+        lines are to be scanned instead."""
+        best = -1
+        try:
+            for token in tokens:
+                positions = self.candidates(token)
+                if positions is None:
+                    return None
+                k = bisect_right(positions, start)
+                while k > 0 and positions[k - 1] > best:
+                    k -= 1
+                    i = positions[k]
+                    if self[i][:len(token)] == token:
+                        best = i
+                        break
+        except UnicodeError:
+            return None
+        return best
+
+
+    def position(self, name):
+        """ Returns the position of the line of the parameter name, as
+        "\\\\textclass", or -1 if there is none."""
+        if self.positions is None:
+            self.index_words()
+        positions = self.positions.get(name)
+        if positions:
+            return positions[0]
+        return -1
+
+
+    def get(self, name, default = ""):
+        """ Returns the value of the parameter name, what follows it on its
+        line, or default if there is no such line."""
+        i = self.position(name)
+        if i == -1:
+            return default
+        words = self[i].split(None, 1)
+        if len(words) > 1:
+            return words[1].strip()
+        return default
+
+
+    def set(self, name, value):
+        """ Sets the value of the parameter name. Returns False if the
+        header has no such parameter."""
+        i = self.position(name)
+        if i == -1:
+            return False
+        self[i] = "%s %s" % (name, value)
+        return True
+
+
+    def delete(self, name):
+        """ Deletes the line of the parameter name. Returns False if the
+        header has no such parameter."""
+        i = self.position(name)
+        if i == -1:
+            return False
+        del self[i]
+        return True
+
+
+    def insert_after(self, name, lines):
+        """ Inserts lines after the line of the parameter name. Returns
+        False if the header has no such parameter."""
+        i = self.position(name)
+        if i == -1:
+            return False
+        self[i + 1:i + 1] = lines
+        return True
+
+
+    def changed(self):
+        LineIndexes.changed(self)
+        self.positions = None
+
+
+    def replaced(self, start, stop, count):
+        LineIndexes.replaced(self, start, stop, count)
+        self.positions = None
+
+
+    def __setitem__(self, i, line):
+        if self.positions is not None and not isinstance(i, slice) and \
+           first_word(self.base.__getitem__(self, i)) != first_word(line):
+            self.positions = None
+        LineIndexes.__setitem__(self, i, line)
+
+
+def add_scanned(lines, count):
+    " Records that a scan went through count lines of lines."
+    if isinstance(lines, LineIndexes):
+        lines.scanned += count
+
+
+def structure_index(lines, start_token, end_token):
+    """ Returns the StructureIndex of lines for the pair of tokens, if
+    lines carries indexes and has it, else None."""
+    if not isinstance(lines, LineIndexes):
+        return None
+    return lines.structure_index(start_token, end_token)
+
+
+def triggers(*tokens):
+    """ Decorator for the converters that do nothing unless a line of the
+    document (header, preamble or body) starts with one of tokens, as
+    found by find_token. LyX_base.convert skips them when the document
+    has no such line, see TokenHistogram."""
+    def declare(convert):
+        convert.triggers = tokens
+        return convert
+    return declare
+
+
+class LineRule:
+    """ A converter that rewrites lines of the body one at a time.
+
+    rewrites is a list of pairs (token, rewrite), where rewrite(line)
+    returns the new line for a line that starts with token. The pairs
+    act as many passes over the body, in order. prepare(document), if
+    given, is called first: it may change the header, the preamble and
+    the settings of the document, but must not look at the body.
+
+    Called as any other converter, a LineRule makes its own pass over
+    the body. LyX_base.convert gathers the consecutive LineRules of the
+    conversion tables and applies them together, see apply_rules."""
+
+    def __init__(self, name, rewrites, prepare = None):
+        self.name = name
+        self.rewrites = list(rewrites)
+        self.prepare = prepare
+
+
+    def __call__(self, document):
+        apply_rules(document, [self])
+
+
+    def __str__(self):
+        return "<line rule %s>" % self.name
+
+
+def line_rule(*tokens):
+    """ Decorator that makes a LineRule of rewrite(line), for the lines
+    that start with one of tokens."""
+    def declare(rewrite):
+        return LineRule(rewrite.__name__,
+                        [(token, rewrite) for token in tokens])
+    return declare
+
+
+def header_rule(convert):
+    """ Decorator for the converters that only change the header, the
+    preamble or the settings of the document, without looking at the
+    body, so that they can be applied along with LineRules."""
+    return LineRule(convert.__name__, (), convert)
+
+
+def apply_rules(document, rules):
+    """ Applies the LineRules rules, in order, with a single pass over
+    the body: every line gets the rewrites of all the rules whose tokens
+    it starts with, as it would with one pass per rewrite."""
+    rewrites = []
+    for rule in rules:
+        if rule.prepare is not None:
+            rule.prepare(document)
+        rewrites.extend(rule.rewrites)
+    if rewrites:
+        rewrite_lines(document.body, rewrites)
+
+
+def rewrite_lines(lines, rewrites):
+    """ Applies the (token, rewrite) pairs of LineRules, in order, to the
+    lines that start with their tokens, in a single pass over lines."""
+    tokens = [token for token, rewrite in rewrites]
+    # the empty token is in every line
+    every = "" in tokens
+    i = 0
+    while True:
+        if not every:
+            i = find_tokens(lines, tokens, i)
+            if i == -1:
+                return
+        elif i >= len(lines):
+            return
+        line = new = lines[i]
+        for token, rewrite in rewrites:
+            if new[:len(token)] == token:
+                new = rewrite(new)
+        if new is not line:
+            lines[i] = new
+        i += 1
+
+
+# The locality classes of the converters, from the least to the most of
+# the document that they need to see at once. A converter is
+#  header_only: if it changes only the header, the preamble or the
+#    settings, without looking at the body (header_rule);
+#  line_local: if it rewrites lines of the body one at a time (LineRule);
+#  paragraph_local: if it reads and changes only the lines of one
+#    outermost paragraph at a time, see iter_paragraphs. It may read the
+#    header and the settings, but not change them (paragraph_rule);
+#  non_local: otherwise, the default.
+# LyX_base streams the body through the chains of converters that are
+# at most paragraph_local, instead of loading it.
+header_only = 0
+line_local = 1
+paragraph_local = 2
+non_local = 3
+
+
+def paragraph_rule(convert):
+    """ Decorator for the converters that are paragraph_local: run on the
+    lines of a single outermost paragraph, they give the lines that they
+    would give for the whole body."""
+    convert.locality = paragraph_local
+    return convert
+
+
+def get_locality(convert):
+    " Returns the locality class of the converter convert."
+    if isinstance(convert, LineRule):
+        if convert.rewrites:
+            return line_local
+        return header_only
+    return getattr(convert, "locality", non_local)
+
+
+def iter_paragraphs(lines):
+    """ Yields the lines in lists, each one with an outermost paragraph,
+    a \\begin_layout line out of any inset, and the lines that follow it
+    up to the next one. The lines before the first paragraph, if any,
+    come in a list of their own."""
+    chunk = []
+    depth = 0
+    for line in lines:
+        if line[:1] == "\\":
+            if line.startswith("\\begin_inset"):
+                depth += 1
+            elif line.startswith("\\end_inset"):
+                depth -= 1
+            elif depth == 0 and line.startswith("\\begin_layout") and chunk:
+                yield chunk
+                chunk = []
+        chunk.append(line)
+    if chunk:
+        yield chunk
+
+
+# The tokens that can be looked up in a TokenIndex, the others are
+# looked for by scanning the lines.
+indexed = {}
+
+def indexed_token(token):
+    " Returns True if token can be looked up in a TokenIndex."
+    result = indexed.get(token)
+    if result is None:
+        # only ascii tokens compare with both str and unicode lines
+        try:
+            if isinstance(token, unicode):
+                token.encode('ascii')
+            else:
+                token.decode('ascii')
+            result = token != ''
+        except UnicodeError:
+            result = False
+        if len(indexed) > 10000:
+            indexed.clear()
+        indexed[token] = result
+    return result
+
+
+def find_indexed(lines, tokens, start, end):
+    """ As find_tokens(lines, tokens, start, end) using the TokenIndex of
+    lines, or None if lines has none or it can not be used."""
+    if isinstance(lines, HeaderLines):
+        return lines.find(tokens, start, end)
+    if not isinstance(lines, LineIndexes) or len(lines) < TokenIndex.least:
+        return None
+    for token in tokens:
+        if not indexed.get(token) and not indexed_token(token):
+            return None
+    index = lines.tokens
+    if index is None:
+        index = lines.token_index()
+    try:
+        return index.find(lines, tokens, start, end)
+    except UnicodeError:
+        return None
+
+
+def find_indexed_backwards(lines, tokens, start):
+    """ As find_tokens_backwards(lines, tokens, start) using the
+    TokenIndex of lines, or None if lines has none or it can not be
+    used."""
+    if not isinstance(lines, LineIndexes) or not 0 <= start < len(lines):
+        return None
+    if isinstance(lines, HeaderLines):
+        return lines.find_backwards(tokens, start)
+    if len(lines) < TokenIndex.least:
+        return None
+    for token in tokens:
+        if not indexed.get(token) and not indexed_token(token):
+            return None
+    try:
+        return lines.token_index().find_backwards(lines, tokens, start)
+    except UnicodeError:
+        return None
+
+
+literal_prefixes = {}
+
+def literal_prefix(rexp):
+    """ Returns the text that starts every line matched by the regular
+    expression rexp, which is empty if it is not known."""
+    prefix = literal_prefixes.get(rexp)
+    if prefix is not None:
+        return prefix
+    prefix = ''
+    flags = getattr(rexp, 'flags', re.IGNORECASE)
+    if not flags & re.IGNORECASE:
+        try:
+            parsed = sre_parse.parse(rexp.pattern, flags)
+        except Exception:
+            parsed = []
+        for op, av in parsed:
+            if not prefix and op == sre_constants.AT and \
+               av in (sre_constants.AT_BEGINNING,
+                      sre_constants.AT_BEGINNING_STRING):
+                continue
+            if op != sre_constants.LITERAL or av > 127:
+                break
+            prefix += chr(av)
+    if len(literal_prefixes) > 1000:
+        literal_prefixes.clear()
+    literal_prefixes[rexp] = prefix
+    return prefix
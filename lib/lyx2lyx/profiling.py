@@ -16,18 +16,37 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
-# We need all this because lyx2lyx does not have the .py termination
-import imp
-lyx2lyx = imp.load_source("lyx2lyx", "lyx2lyx", open("lyx2lyx"))
+"""
+The cost of every converter of a conversion, to find the ones that
+dominate on real documents.
 
-# Profiler used in the study
-import hotshot, hotshot.stats
+ConversionProfile([stats]):
+  Given to LyX.File as profile, records a row for every converter of the
+  conversion: the format of its step, its wall and CPU time, the length
+  of the body before and after it, and the lines it inserted, deleted
+  and rewrote in place. These are counted by the indexed bodies (see
+  parser_tools.LineIndexes) and are empty for the others. The converters
+  skipped because the document has none of their triggers have a row
+  too, with status "skipped".
+  Between enable() and disable(), the scans of the lines are counted,
+  see parser_tools.ScanCounts: every row also has the calls of the
+  functions that look for lines, as scans, and the lines they examined,
+  as scanned, and in JSON, the counts of every function, as functions.
+  write(output) writes the rows as CSV if output ends in .csv, as JSON
+  otherwise. If stats is a file name, the whole run, between enable()
+  and disable(), is also profiled with cProfile, and the statistics
+  written there, in the format read by pstats and by viewers such as
+  snakeviz.
+  From the command line: lyx2lyx --profile report.json [--profile-stats
+  lyx2lyx.prof] ...
 
-import sys
-import os
+sweep(input, factors, ...):
+  Converts the document input with its body repeated every number of
+  times in factors, and returns the converters whose scanned lines grow
+  faster than the body, see the function. From the command line:
+        ./profiling.py --sweep [-V 1.5] [-t format] file.lyx
 
-"""
-This program profiles lyx2lyx.
+This program profiles lyx2lyx with cProfile.
 Usage:
         ./profiling.py option_to_lyx2lyx
 
@@ -35,20 +54,268 @@ Example:
         ./profiling.py -ou.lyx ../doc/UserGuide.lyx
 """
 
+import os
+import re
+import csv
+import sys
+import math
+import time
+import parser_tools
+
+try:
+    import cProfile
+except ImportError:
+    # python < 2.5, the same interface, only slower
+    import profile as cProfile
+
+try:
+    import json
+except ImportError:
+    # python < 2.6, the report is written as CSV
+    json = None
+
+
+# The name of a converter, without the address of the function
+function_re = re.compile(r"<function (\S+) at 0x[0-9a-f]+>")
+
+
+# Scans that grow as the power threshold of the size of the body, or
+# faster, are flagged by sweep
+threshold = 1.5
+
+
+def cpu_time():
+    " The CPU time, user and system, used by the process so far."
+    times = os.times()
+    return times[0] + times[1]
+
+
+def edits(lines):
+    """ The counts of inserted, deleted and rewritten lines of lines, or
+    None if lines does not keep them."""
+    if not hasattr(lines, "inserted"):
+        return None
+    return (lines.inserted, lines.deleted, lines.rewritten)
+
+
+class ConversionProfile:
+    " The rows of the converters run on a document, see the module help."
+
+    fields = ["format", "converter", "status", "wall", "cpu",
+              "lines_before", "lines_after", "inserted", "deleted",
+              "rewritten", "scans", "scanned"]
+
+    def __init__(self, stats = None):
+        self.rows = []
+        self.stats = stats
+        self.profiler = None
+        self.scans = None
+
+
+    def enable(self):
+        """ Starts counting the scans, and the cProfile profiler, if there
+        are stats to write."""
+        self.scans = parser_tools.ScanCounts()
+        parser_tools.count_scans(self.scans)
+        if self.stats:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+
+    def disable(self):
+        " Stops the cProfile profiler and writes its statistics."
+        if self.scans is not None:
+            parser_tools.count_scans(None)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.stats)
+            self.profiler = None
+
+
+    def start(self, document):
+        """ Returns what is measured of document before a converter runs,
+        to be given to stop after it."""
+        body = document.body
+        scans = None
+        if self.scans is not None:
+            scans = self.scans.snapshot()
+        return (time.time(), cpu_time(), body, len(body), edits(body),
+                scans)
+
+
+    def stop(self, start, document, name, version, status = "ok"):
+        " Records the row of the converter name, run since start."
+        wall, cpu, body, before, counts, scans = start
+        row = {"format": version, "converter": function_re.sub(r"\1", name),
+               "status": status,
+               "wall": time.time() - wall, "cpu": cpu_time() - cpu,
+               "lines_before": before, "lines_after": len(document.body),
+               "inserted": None, "deleted": None, "rewritten": None,
+               "scans": None, "scanned": None}
+        after = edits(document.body)
+        if counts is not None and document.body is body:
+            row["inserted"] = after[0] - counts[0]
+            row["deleted"] = after[1] - counts[1]
+            row["rewritten"] = after[2] - counts[2]
+        if scans is not None:
+            functions = {}
+            for function, (calls, lines) in self.scans.snapshot().items():
+                calls_before, lines_before = scans.get(function, (0, 0))
+                if calls > calls_before:
+                    functions[function] = (calls - calls_before,
+                                           lines - lines_before)
+            row["functions"] = functions
+            row["scans"] = sum([calls for calls, lines in functions.values()])
+            row["scanned"] = sum([lines for calls, lines in functions.values()])
+        self.rows.append(row)
+
+
+    def skipped(self, document, name, version):
+        " Records the row of the converter name, skipped."
+        lines = len(document.body)
+        self.rows.append({"format": version,
+                          "converter": function_re.sub(r"\1", name),
+                          "status": "skipped", "wall": 0.0, "cpu": 0.0,
+                          "lines_before": lines, "lines_after": lines,
+                          "inserted": 0, "deleted": 0, "rewritten": 0,
+                          "scans": 0, "scanned": 0, "functions": {}})
+
+
+    def write(self, output):
+        " Writes the rows to the file named output, as CSV or JSON."
+        stream = open(output, "wb")
+        try:
+            if output.endswith(".csv") or json is None:
+                self.write_csv(stream)
+            else:
+                self.write_json(stream)
+        finally:
+            stream.close()
+
+
+    def write_csv(self, stream):
+        " Writes the rows to stream as CSV, one line per converter."
+        writer = csv.writer(stream)
+        writer.writerow(self.fields)
+        for row in self.rows:
+            values = []
+            for field in self.fields:
+                value = row[field]
+                if value is None:
+                    value = ""
+                elif type(value) is float:
+                    value = "%.6f" % value
+                values.append(value)
+            writer.writerow(values)
+
+
+    def write_json(self, stream):
+        " Writes the rows to stream as JSON, with the totals."
+        report = {"wall": sum([row["wall"] for row in self.rows]),
+                  "cpu": sum([row["cpu"] for row in self.rows]),
+                  "converters": self.rows}
+        json.dump(report, stream, indent = 1, sort_keys = True)
+        stream.write("\n")
+
+
+def scaled_body(body, factor):
+    " Repeats the paragraphs of body factor times, in place."
+    start = parser_tools.find_token(body, "\\begin_body", 0)
+    end = parser_tools.find_token(body, "\\end_body", start + 1)
+    if start == -1 or end == -1:
+        return
+    body[start + 1:end] = body[start + 1:end] * factor
+
+
+def growth(sizes, counts):
+    """ The power of the sizes that the counts grow as, from the first
+    to the last one that is not zero, or None if there are not two."""
+    points = [(size, count) for size, count in zip(sizes, counts) if count]
+    if len(points) < 2 or points[0][0] == points[-1][0]:
+        return None
+    (small, low), (large, high) = points[0], points[-1]
+    return math.log(float(high) / low) / math.log(float(large) / small)
+
+
+def sweep(input, factors = (1, 2, 4, 8), end_format = 0,
+          final_version = '', least = 1000):
+    """ Converts input with its body repeated every number of times in
+    factors, and returns the converters whose scanned lines grow as the
+    power threshold of the size of the body, or faster, as a list of
+    (power, format, converter, scanned lines at every factor), the
+    fastest growing first. The converters that scan fewer than least
+    lines at the last factor are left out."""
+    import LyX
+    sizes = []
+    scanned = {}
+    for factor in factors:
+        profile = ConversionProfile()
+        document = LyX.File(end_format, input, os.devnull, os.devnull,
+                            final_version = final_version, profile = profile)
+        scaled_body(document.body, factor)
+        sizes.append(len(document.body))
+        profile.enable()
+        try:
+            document.convert()
+        finally:
+            profile.disable()
+        for row in profile.rows:
+            key = (row["format"], row["converter"])
+            lines = scanned.setdefault(key, [0] * len(factors))
+            lines[len(sizes) - 1] += row["scanned"] or 0
+    flagged = []
+    for (version, converter), lines in scanned.items():
+        power = growth(sizes, lines)
+        if power is not None and power >= threshold and lines[-1] >= least:
+            flagged.append((power, version, converter, lines))
+    flagged.sort()
+    flagged.reverse()
+    return flagged
+
+
+def main_sweep(args):
+    " Prints the converters flagged by sweep for the options args."
+    import optparse
+    parser = optparse.OptionParser(usage = "usage: %prog --sweep "
+                                   "[options] file")
+    parser.add_option("--sweep", action="store_true")
+    parser.add_option("-t", "--to", dest="end_format", default=0)
+    parser.add_option("-V", "--final_version", default='')
+    parser.add_option("--factors", default="1,2,4,8",
+                      help = "the numbers of copies of the body")
+    (options, args) = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("one file to sweep")
+    factors = [int(factor) for factor in options.factors.split(",")]
+    flagged = sweep(args[0], factors, options.end_format,
+                    options.final_version)
+    for power, version, converter, lines in flagged:
+        sys.stdout.write("%.2f %s %s: %s\n" % (power, version, converter,
+                         " ".join([str(count) for count in lines])))
+    return len(flagged) != 0
+
+
 def main():
-    # This will only work with python >= 2.2, the version where this module was added
-    prof = hotshot.Profile("lyx2lyx.prof") # Use temporary file, here?
-    benchtime = prof.runcall(lyx2lyx.main)
-    prof.close()
+    if "--sweep" in sys.argv[1:]:
+        sys.exit(main_sweep(sys.argv[1:]))
+
+    # We need all this because lyx2lyx does not have the .py termination
+    import imp
+    lyx2lyx = imp.load_source("lyx2lyx", "lyx2lyx", open("lyx2lyx"))
+    import pstats
+
+    prof = cProfile.Profile()
+    try:
+        prof.runcall(lyx2lyx.main)
+    except SystemExit:
+        pass
 
     # After the tests, show the profile analysis.
-    stats = hotshot.stats.load("lyx2lyx.prof")
+    stats = pstats.Stats(prof)
     stats.strip_dirs()
     stats.sort_stats('time', 'calls')
     stats.print_stats(20)
 
-    os.unlink("lyx2lyx.prof")
-
 
 if __name__ == "__main__":
     main()
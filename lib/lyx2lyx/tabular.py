@@ -0,0 +1,202 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+The table of a Tabular inset, parsed once into its columns, rows and
+cells and their attributes.
+
+Tabular(lines, i):
+  The table that starts on line i of lines, the <lyxtabular ...> line
+  or the \\begin_inset Tabular line before it. The lines of the table
+  are read in one pass, end is the position of the </lyxtabular> line,
+  or -1 if it is missing. The tables nested in the cells are not part
+  of it, they are tables of their own.
+
+Tag:
+  A line of the table as <cell alignment="center" usebox="none">, with
+  its attributes in order. The attributes are changed with set and
+  remove, and only the lines of the tags that changed are written back
+  to lines, by Tabular.write(). Example, the multirow cells of all the
+  tables of the body:
+    i = find_token(document.body, "<lyxtabular", 0)
+    while i != -1:
+        table = Tabular(document.body, i)
+        for cell in table.cells():
+            if cell.get("multirow") == "4":
+                cell.remove("topline")
+        table.write()
+        i = find_token(document.body, "<lyxtabular", i + 1)
+  The tags keep the positions of their lines, so the lines that are
+  added or deleted should be, after write(), from the last table
+  line to the first one.
+'''
+
+import re
+
+# The attributes of a tag, as name="value"
+attribute_re = re.compile(r'(\w+)="([^"]*)"')
+
+
+class Tag(object):
+    """ A tag line of a table, named name, on line line of the lines.
+    Rows also have their cells and the lines of rows and cells where
+    they end, the </row> and </cell> lines, as end."""
+
+    __slots__ = ("name", "attributes", "line", "end", "cells", "changed")
+
+    def __init__(self, text, line):
+        self.name = text[1:].split(" ", 1)[0].rstrip(">")
+        self.attributes = attribute_re.findall(text)
+        self.line = line
+        self.end = -1
+        self.cells = []
+        self.changed = False
+
+
+    def __repr__(self):
+        return "<%s %d>" % (self.name, self.line)
+
+
+    def get(self, name, default = None):
+        " Returns the value of the attribute name, or default."
+        for attribute, value in self.attributes:
+            if attribute == name:
+                return value
+        return default
+
+
+    def set(self, name, value):
+        """ Sets the value of the attribute name, which is added after the
+        others if the tag does not have it."""
+        for k, (attribute, old) in enumerate(self.attributes):
+            if attribute == name:
+                if old != value:
+                    self.attributes[k] = (name, value)
+                    self.changed = True
+                return
+        self.attributes.append((name, value))
+        self.changed = True
+
+
+    def remove(self, name):
+        " Removes the attribute name, returns True if the tag had it."
+        for k, (attribute, value) in enumerate(self.attributes):
+            if attribute == name:
+                del self.attributes[k]
+                self.changed = True
+                return True
+        return False
+
+
+    def to_line(self):
+        " Returns the line of the tag."
+        return "<" + self.name + "".join([' %s="%s"' % attribute
+                                         for attribute in self.attributes]) + ">"
+
+
+class Tabular(object):
+    """ The table that starts on line i of lines: table is the tag of
+    the <lyxtabular> line, features the <features> tag, or None, and
+    columns and rows the lists of their tags."""
+
+    def __init__(self, lines, i):
+        self.lines = lines
+        if lines[i][:11] != "<lyxtabular":
+            i += 1
+        self.start = i
+        self.end = -1
+        self.table = Tag(lines[i], i)
+        self.features = None
+        self.columns = []
+        self.rows = []
+        self.read()
+
+
+    def read(self):
+        " Reads the tags of the table, from start to the </lyxtabular> line."
+        lines = self.lines
+        row = cell = None
+        # the depth of the tables nested in the current cell
+        nested = 0
+        for k in xrange(self.start + 1, len(lines)):
+            line = lines[k]
+            if line[:1] != "<":
+                continue
+            if cell is not None:
+                if line[:12] == "<lyxtabular ":
+                    nested += 1
+                elif line[:13] == "</lyxtabular>":
+                    nested -= 1
+                elif line[:7] == "</cell>" and nested == 0:
+                    cell.end = k
+                    cell = None
+            elif line[:5] == "<cell":
+                cell = Tag(line, k)
+                if row is not None:
+                    row.cells.append(cell)
+            elif line[:6] == "</row>":
+                if row is not None:
+                    row.end = k
+                    row = None
+            elif line[:4] == "<row":
+                row = Tag(line, k)
+                self.rows.append(row)
+            elif line[:7] == "<column":
+                self.columns.append(Tag(line, k))
+            elif line[:9] == "<features":
+                self.features = Tag(line, k)
+            elif line[:13] == "</lyxtabular>":
+                self.end = k
+                return
+
+
+    def cell(self, row, column):
+        " Returns the cell of column in row, or None if there is none."
+        if 0 <= row < len(self.rows):
+            cells = self.rows[row].cells
+            if 0 <= column < len(cells):
+                return cells[column]
+        return None
+
+
+    def cells(self):
+        " Yields the cells of the table, row by row."
+        for row in self.rows:
+            for cell in row.cells:
+                yield cell
+
+
+    def tags(self):
+        " Yields all the tags of the table, in order."
+        yield self.table
+        if self.features is not None:
+            yield self.features
+        for column in self.columns:
+            yield column
+        for row in self.rows:
+            yield row
+            for cell in row.cells:
+                yield cell
+
+
+    def write(self):
+        " Writes the lines of the tags that changed back to lines."
+        for tag in self.tags():
+            if tag.changed:
+                self.lines[tag.line] = tag.to_line()
+                tag.changed = False
@@ -0,0 +1,49 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+" This modules tests the scenarios of the benchmarks."
+
+import re
+import unittest
+
+import LyX
+from benchmark import inputs, scenarios
+
+format_re = re.compile(r"\\lyxformat (\d+)")
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_scenarios(self):
+        latest = LyX.get_end_format()
+        modes = {}
+        for name, features, mode, format in scenarios:
+            modes[name] = (mode, format)
+        timed = list(inputs(paragraphs = 5))
+        self.assertEquals(len(timed), len(scenarios))
+        for name, data, end_format in timed:
+            source = int(format_re.search(data).group(1))
+            mode, format = modes[name]
+            if mode == "convert":
+                self.assertEquals((source, int(end_format)), (format, latest))
+            else:
+                self.assertEquals((source, int(end_format)), (latest, format))
+            self.assertTrue(name.endswith("-%s-%d" % (mode, format)))
+
+
+if __name__ == '__main__':
+    unittest.main()
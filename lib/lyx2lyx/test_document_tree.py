@@ -0,0 +1,173 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+" This modules tests the tree view of the body of a document."
+
+from document_tree import Tree
+from parser_tools import find_end_of, find_end_of_inset, \
+    find_end_of_layout, get_containing_layout
+
+import os
+import unittest
+
+frames = r"""
+\begin_layout Frame
+\begin_inset Argument 4
+status open
+
+\begin_layout Plain Layout
+First
+\end_layout
+
+\end_inset
+
+\end_layout
+
+\begin_deeper
+\begin_layout Standard
+Text
+\begin_inset Argument 1
+status open
+
+\begin_layout Plain Layout
+Not of a frame
+\end_layout
+
+\end_inset
+\end_layout
+
+\end_deeper
+\begin_layout Frame
+\begin_inset Argument 4
+status open
+
+\begin_layout Plain Layout
+Second
+\end_layout
+
+\end_inset
+
+\end_layout
+""".strip("\n").split("\n")
+
+# A layout that is not ended inside an inset
+malformed = r"""
+\begin_layout Standard
+\begin_inset Note Note
+status open
+
+\begin_layout Plain Layout
+Unended
+\end_inset
+
+\end_layout
+""".strip("\n").split("\n")
+
+
+def read_body(name):
+    " The body of the document name of the documentation."
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, "doc", name)
+    stream = open(path)
+    try:
+        lines = stream.read().split("\n")
+    finally:
+        stream.close()
+    return lines[lines.index("\\begin_body") + 1:lines.index("\\end_body")]
+
+
+class TestDocumentTree(unittest.TestCase):
+
+    def test_find_all(self):
+        tree = Tree(frames)
+        args = [arg for frame in tree.find_all("layout", "Frame")
+                for arg in frame.find_all("inset", "Argument")]
+        self.assertEquals([arg.start for arg in args], [1, 27])
+        self.assertEquals([arg.name for arg in args],
+                          ["Argument 4", "Argument 4"])
+        self.assertEquals(args[1].to_lines(), frames[27:35])
+        self.assertEquals(len(list(tree.find_all("inset", "Argument"))), 3)
+        self.assertEquals(len(list(tree.find_all("inset", "Arg"))), 0)
+        self.assertEquals([node.kind for node in tree.children()],
+                          ["layout", "deeper", "layout"])
+
+        node = tree.containing(20)
+        self.assertEquals(node.kind, "layout")
+        self.assertEquals(node.name, "Plain Layout")
+        self.assertEquals(node.ancestor("inset").name, "Argument 1")
+        self.assertEquals(node.ancestor("layout").name, "Standard")
+        self.assertEquals(node.ancestor("deeper").start, 12)
+        self.assertEquals(node.ancestor("layout", "Frame"), None)
+        self.assertEquals(tree.containing(11), tree)
+
+
+    def test_document(self):
+        body = read_body("EmbeddedObjects.lyx")
+        tree = Tree(body)
+        self.assertEquals(tree.to_lines(), body)
+
+        for node in tree.walk():
+            if node.kind == "inset":
+                end = find_end_of_inset(body, node.start)
+            elif node.kind == "layout":
+                end = find_end_of_layout(body, node.start)
+            else:
+                end = find_end_of(body, node.start,
+                                  "\\begin_deeper", "\\end_deeper")
+            self.assertEquals(node.end, end)
+
+        for i in range(0, len(body), 7):
+            # get_containing_layout leaves out the line that ends a layout
+            if body[i] == "\\end_layout":
+                continue
+            node = tree.containing(i)
+            if not node.is_a("layout"):
+                node = node.ancestor("layout")
+            layout = get_containing_layout(body, i)
+            if node is None:
+                self.assertEquals(layout, False)
+            else:
+                self.assertEquals(tuple(layout[:3]),
+                                  (node.name, node.start, node.end))
+
+
+    def test_malformed(self):
+        tree = Tree(malformed)
+        self.assertEquals(tree.to_lines(), malformed)
+        [layout] = tree.children()
+        self.assertEquals((layout.start, layout.end), (0, 8))
+        # the \end_inset does not end the innermost node, the layout, so
+        # the nodes that are not ended are cut at the end of their parent
+        [inset] = layout.children()
+        self.assertEquals((inset.start, inset.end), (1, 7))
+        [plain] = inset.children()
+        self.assertEquals((plain.name, plain.start, plain.end),
+                          ("Plain Layout", 4, 6))
+        self.assertEquals(plain.to_lines(), ["\\begin_layout Plain Layout",
+                                             "Unended", "\\end_inset"])
+        self.assertEquals(tree.containing(5), plain)
+
+        # at the top, the node goes on to the last line
+        tree = Tree(malformed[:5])
+        [layout] = tree.children()
+        self.assertEquals((layout.start, layout.end), (0, 4))
+        self.assertEquals(layout.children()[0].end, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,7 @@
 
 from parser_tools import *
 
+import re
 import unittest
 
 ug = r"""
@@ -89,5 +90,223 @@ class TestParserTools(unittest.TestCase):
         self.assertEquals(find_tokens(lines, tokens, 0, 4), -1)
 
 
+    def test_indexed_lines(self):
+        indexed = IndexedLines(lines)
+        # pretend it was scanned enough for the index to be built
+        indexed.scanned = len(indexed)
+        for i in range(len(lines) + 1):
+            self.assertEquals(find_end_of_inset(indexed, i),
+                              find_end_of_inset(lines, i))
+            self.assertEquals(
+                find_beginning_of(indexed, i, "\\begin_inset", "\\end_inset"),
+                find_beginning_of(lines, i, "\\begin_inset", "\\end_inset"))
+        self.assertEquals(find_end_of_inset(indexed, 3), 4)
+        self.assertNotEquals(indexed.indexes, {})
+
+        indexed.scanned = len(indexed)
+        for i in range(len(lines) - 1):
+            self.assertEquals(get_containing_inset(indexed, i),
+                              get_containing_inset(lines, i))
+            self.assertEquals(get_containing_layout(indexed, i),
+                              get_containing_layout(lines, i))
+        self.assertEquals(get_containing_layout(indexed, 20),
+                          ("Standard", 1, 32, 2))
+
+        # a change that moves the lines drops the index
+        del indexed[3]
+        self.assertEquals(indexed.indexes, {})
+        self.assertEquals(find_end_of_inset(indexed, 19), 20)
+
+
+    def test_token_index(self):
+        many = lines * 200
+        indexed = IndexedLines(many)
+        tokens = ["\\begin_inset", "\\begin_inset Quotes erd",
+                  "\\emph", "\\end_layout", "describes", "nothing"]
+        # scan enough for the tables to be built
+        for visit in range(TokenIndex.visits + 1):
+            find_token(indexed, "nothing", 0)
+        self.assertNotEquals(indexed.tokens.built, 0)
+
+        for change in range(3):
+            for i in range(0, len(many), 97):
+                for token in tokens:
+                    self.assertEquals(find_token(indexed, token, i),
+                                      find_token(many, token, i))
+                    self.assertEquals(find_token_backwards(indexed, token, i),
+                                      find_token_backwards(many, token, i))
+                self.assertEquals(find_tokens(indexed, tokens[1:3], i),
+                                  find_tokens(many, tokens[1:3], i))
+                self.assertEquals(find_re(indexed, re.compile(r"\\emph d"), i),
+                                  find_re(many, re.compile(r"\\emph d"), i))
+            # the index follows the changes of the lines
+            for lst in (indexed, many):
+                lst[1000:1010] = ["\\emph on"]
+                del lst[3000]
+                lst.insert(5000, "\\begin_inset Quotes erd")
+                lst[6000] = "nothing"
+
+
+    def test_block_list(self):
+        many = lines * 10
+        blocks = BlockList(many)
+        self.assertEquals(len(blocks), len(many))
+        self.assertEquals(list(blocks), many)
+        for lst in (blocks, many):
+            lst[3:3] = ["\\begin_inset Note", "\\end_inset"]
+            del lst[1000:3000]
+            lst.insert(-1, "\\emph on")
+            lst[-5] = "text"
+            del lst[7]
+            lst.append("\\end_body")
+            lst.extend(lines)
+        self.assertEquals(blocks.pop(100), many.pop(100))
+        self.assertEquals(list(blocks), many)
+        self.assertEquals(blocks[5:500], many[5:500])
+        self.assertEquals(blocks[-3], many[-3])
+        self.assertEquals(blocks, many)
+        self.assertEquals(blocks.index("\\emph on"), many.index("\\emph on"))
+
+        indexed = IndexedBlocks(many)
+        indexed.scanned = len(indexed)
+        for i in range(0, len(many), 7):
+            self.assertEquals(find_end_of_inset(indexed, i),
+                              find_end_of_inset(many, i))
+            self.assertEquals(find_token(indexed, "\\end_layout", i),
+                              find_token(many, "\\end_layout", i))
+
+
+    def test_packed_blocks(self):
+        many = lines * 10
+        packed = IndexedPackedBlocks(many)
+        packed.size = 16
+        packed.cache = 2
+        packed.set_blocks(many)
+        self.assertEquals(packed, many)
+        for lst in (packed, many):
+            lst[3:3] = ["\\begin_inset Note", "\\end_inset"]
+            del lst[100:300]
+            lst[-5] = u"text \xe9"
+            lst.insert(7, "\\emph on")
+            lst.append("\\end_body")
+        self.assertEquals(list(packed), many)
+        self.assertEquals(packed[5:50], many[5:50])
+        self.assertEquals(packed.count(""), many.count(""))
+        for i in range(0, len(many), 7):
+            self.assertEquals(find_token(packed, "\\end_layout", i),
+                              find_token(many, "\\end_layout", i))
+        self.assertNotEquals([block for block in packed.blocks
+                              if isinstance(block, PackedLines)], [])
+        self.assertEquals(intern_lines(["\\end_layout", "\\end_layout"]),
+                          ["\\end_layout"] * 2)
+
+
+    def test_token_histogram(self):
+        indexed = IndexedLines(lines)
+        histogram = indexed.token_histogram()
+        for token in ("\\begin_inset Quotes", "\\begin_inset Quo",
+                      "\\begin_layout", "\\emph on", "text"):
+            self.assertTrue(histogram.has(token))
+        for token in ("\\begin_inset Formula", "\\color"):
+            self.assertFalse(histogram.has(token))
+        indexed.insert(5, "\\begin_inset Formula $x$")
+        self.assertTrue(histogram.has("\\begin_inset Formula"))
+        indexed[6] = "\\color red"
+        self.assertTrue(histogram.has("\\color"))
+
+
+    def test_line_rules(self):
+        class Document:
+            pass
+        emph = LineRule("emph", [("\\emph on", lambda line: "\\emph off"),
+                                 ("\\emph off", lambda line: "\\emph")])
+        quotes = line_rule("\\begin_inset Quotes")(lambda line: line.upper())
+        for rules in ([emph, quotes], [quotes, emph]):
+            fused = Document()
+            fused.body = IndexedLines(lines)
+            apply_rules(fused, rules)
+            single = Document()
+            single.body = lines[:]
+            for rule in rules:
+                rule(single)
+            self.assertEquals(fused.body, single.body)
+        self.assertEquals(single.body.count("\\emph"), 2)
+
+
+    def test_iter_paragraphs(self):
+        body = ["\\begin_body", ""] + lines[1:] + \
+               ["\\begin_layout Standard", "\\begin_inset Note",
+                "\\begin_layout Plain Layout", "\\end_layout", "",
+                "\\end_inset", "\\end_layout", "\\end_body"]
+        paragraphs = list(iter_paragraphs(body))
+        self.assertEquals(sum(paragraphs, []), body)
+        self.assertEquals(len(paragraphs), 3)
+        self.assertEquals(paragraphs[2][0], "\\begin_layout Standard")
+        def convert(document):
+            pass
+        self.assertEquals(get_locality(convert), non_local)
+        self.assertEquals(get_locality(header_rule(convert)), header_only)
+        self.assertEquals(get_locality(paragraph_rule(convert)),
+                          paragraph_local)
+
+
+    def test_header_lines(self):
+        header = ["#LyX 2.1 created this file.", "\\lyxformat 474",
+                  "\\textclass article", "\\begin_modules", "theorems-ams",
+                  "\\end_modules", "\\font_roman default",
+                  "\\font_sans default", "\\font_sc false",
+                  "\\font_sf_scale 100", "\\use_non_tex_fonts false"]
+        indexed = HeaderLines(header)
+        tokens = ["\\font", "\\font_s", "\\font_sc", "\\font_sc false",
+                  "\\use_non_tex_fonts false", "\\use_non_tex_fonts true",
+                  "theorems", "\\end", "#LyX", "\\nothing"]
+        for change in range(2):
+            for i in range(len(header)):
+                for token in tokens:
+                    self.assertEquals(find_token(indexed, token, i),
+                                      find_token(header, token, i))
+                    self.assertEquals(find_token_exact(indexed, token, i),
+                                      find_token_exact(header, token, i))
+                    self.assertEquals(find_token_backwards(indexed, token, i),
+                                      find_token_backwards(header, token, i))
+                self.assertEquals(find_tokens(indexed, tokens[2:5], i),
+                                  find_tokens(header, tokens[2:5], i))
+            for lst in (indexed, header):
+                lst.insert(3, "\\font_sc true")
+                lst[-1] = "\\use_non_tex_fonts true"
+                del lst[0]
+
+        self.assertEquals(indexed.get("\\font_sc"), "true")
+        self.assertEquals(indexed.get("\\font"), "")
+        self.assertEquals(indexed.set("\\font_sans", "cmss"), True)
+        self.assertEquals(indexed.position("\\font_sans"),
+                          indexed.index("\\font_sans cmss"))
+        self.assertEquals(indexed.insert_after("\\textclass", ["\\a b"]),
+                          True)
+        self.assertEquals(indexed[1], "\\a b")
+        self.assertEquals(indexed.delete("\\a"), True)
+        self.assertEquals(indexed.delete("\\a"), False)
+        self.assertEquals(indexed.set("\\a", "b"), False)
+
+
+    def test_scan_counts(self):
+        counts = ScanCounts()
+        count_scans(counts)
+        try:
+            self.assertEquals(find_token(lines, '\\emph', 2), 7)
+            self.assertEquals(find_token(lines, 'nothing', 0, 10), -1)
+            self.assertEquals(find_token_backwards(lines, '\\emph', 10), 9)
+            self.assertEquals(find_end_of_inset(lines, 3), 4)
+            self.assertEquals(get_containing_layout(lines, 20)[1], 1)
+        finally:
+            count_scans(None)
+        find_token(lines, '\\emph', 0)
+        self.assertEquals(counts.snapshot(),
+                          {"find_token": (2, 16),
+                           "find_token_backwards": (1, 2),
+                           "find_end_of": (1, 1),
+                           "get_containing_layout": (1, 19)})
+
+
 if __name__ == '__main__':  
     unittest.main() 
@@ -0,0 +1,410 @@
+# This file is part of lyx2lyx
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 The LyX team
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+" This modules tests the table model and the table converters."
+
+from tabular import Tag, Tabular
+
+import lyx_1_6
+import lyx_2_0
+import lyx_2_1
+import unittest
+
+# A table of one cell, with a table of two cells inside, in format 1.5
+nested = r"""
+\begin_inset Tabular
+<lyxtabular version="3" rows="1" columns="1">
+<features>
+<column alignment="center" valignment="top" leftline="true" rightline="true" width="0pt">
+<row topline="true" bottomline="true">
+<cell alignment="center" valignment="top" usebox="none">
+\begin_inset Text
+
+\begin_layout Standard
+\begin_inset Tabular
+<lyxtabular version="3" rows="1" columns="2">
+<features>
+<column alignment="center" valignment="top" leftline="true" width="0pt">
+<column alignment="center" valignment="top" width="0pt">
+<row bottomline="true">
+<cell alignment="center" valignment="top" usebox="none">
+\begin_inset Text
+
+\begin_layout Standard
+a
+\end_layout
+
+\end_inset
+</cell>
+<cell alignment="center" valignment="top" usebox="none">
+\begin_inset Text
+
+\begin_layout Standard
+b
+\end_layout
+
+\end_inset
+</cell>
+</row>
+</lyxtabular>
+
+\end_inset
+
+\end_layout
+
+\end_inset
+</cell>
+</row>
+</lyxtabular>
+
+\end_inset
+"""
+
+# The tags of nested with the lines of the columns and rows on the cells
+nested_tags_1_6 = r"""
+<lyxtabular version="3" rows="1" columns="1">
+<features>
+<column alignment="center" valignment="top" width="0pt">
+<row>
+<cell alignment="center" valignment="top" usebox="none" topline="true" bottomline="true" leftline="true" rightline="true">
+<lyxtabular version="3" rows="1" columns="2">
+<features>
+<column alignment="center" valignment="top" width="0pt">
+<column alignment="center" valignment="top" width="0pt">
+<row>
+<cell alignment="center" valignment="top" usebox="none" topline="false" bottomline="true" leftline="true" rightline="false">
+</cell>
+<cell alignment="center" valignment="top" usebox="none" topline="false" bottomline="true" leftline="false" rightline="false">
+</cell>
+</row>
+</lyxtabular>
+</cell>
+</row>
+</lyxtabular>
+"""
+
+# The tags of nested_tags_1_6 reverted, the cells keep their lines
+nested_tags_1_5 = r"""
+<lyxtabular version="3" rows="1" columns="1">
+<features>
+<column alignment="center" valignment="top" width="0pt" leftline="true" rightline="true">
+<row topline="true" bottomline="true">
+<cell alignment="center" valignment="top" usebox="none" topline="true" bottomline="true" leftline="true" rightline="true">
+<lyxtabular version="3" rows="1" columns="2">
+<features>
+<column alignment="center" valignment="top" width="0pt" leftline="true" rightline="false">
+<column alignment="center" valignment="top" width="0pt" leftline="false" rightline="false">
+<row topline="false" bottomline="true">
+<cell alignment="center" valignment="top" usebox="none" topline="false" bottomline="true" leftline="true" rightline="false">
+</cell>
+<cell alignment="center" valignment="top" usebox="none" topline="false" bottomline="true" leftline="false" rightline="false">
+</cell>
+</row>
+</lyxtabular>
+</cell>
+</row>
+</lyxtabular>
+"""
+
+# A longtable with a caption row
+caption = r"""
+\begin_inset Tabular
+<lyxtabular version="3" rows="2" columns="1">
+<features tabularvalignment="middle" islongtable="true">
+<column alignment="center" valignment="top">
+<row caption="true">
+<cell alignment="center" valignment="top" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+a
+\end_layout
+
+\end_inset
+</cell>
+</row>
+<row endhead="true">
+<cell alignment="center" valignment="top" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+b
+\end_layout
+
+\end_inset
+</cell>
+</row>
+</lyxtabular>
+
+\end_inset
+"""
+
+# A multirow of two cells with an offset, in a row with attributes
+multirow = r"""
+\begin_inset Tabular
+<lyxtabular version="3" rows="2" columns="1">
+<features tabularvalignment="middle">
+<column alignment="center" valignment="top" width="2cm">
+<row endhead="true">
+<cell multirow="3" mroffset="1ex" alignment="center" valignment="middle" topline="true" bottomline="true" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+a
+\end_layout
+
+\end_inset
+</cell>
+</row>
+<row>
+<cell multirow="4" alignment="center" valignment="middle" topline="true" bottomline="true" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+
+\end_layout
+
+\end_inset
+</cell>
+</row>
+</lyxtabular>
+
+\end_inset
+"""
+
+multirow_reverted = r"""
+\begin_inset Tabular
+<lyxtabular version="3" rows="2" columns="1">
+<features tabularvalignment="middle">
+<column alignment="center" valignment="top" width="2cm">
+<row endhead="true">
+<cell alignment="center" valignment="top" topline="true" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+\begin_inset ERT
+status collapsed
+
+\begin_layout Plain Layout
+
+\backslash
+multirow{2}{2cm}[1ex]{
+\end_layout
+
+\end_inset
+a
+\begin_inset ERT
+status collapsed
+
+\begin_layout Plain Layout
+
+}
+\end_layout
+
+\end_inset
+\end_layout
+
+\end_inset
+</cell>
+</row>
+<row>
+<cell alignment="center" valignment="top" bottomline="true" usebox="none">
+\begin_inset Text
+
+\begin_layout Plain Layout
+
+\end_layout
+
+\end_inset
+</cell>
+</row>
+</lyxtabular>
+
+\end_inset
+"""
+
+
+def split(text):
+    " The lines of text, without the newlines around it."
+    return text.strip("\n").split("\n")
+
+
+def tags(lines):
+    " The tag lines of lines."
+    return [line for line in lines if line[:1] == "<"]
+
+
+def others(lines):
+    " The lines of lines that are not tags."
+    return [line for line in lines if line[:1] != "<"]
+
+
+class Document:
+    " The parts of a document that the table converters use."
+
+    def __init__(self, body):
+        self.body = split(body)
+        self.preamble = []
+        self.warnings = []
+
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+class TestTabular(unittest.TestCase):
+
+    def test_tag(self):
+        line = '<cell alignment="center" valignment="top" usebox="none">'
+        tag = Tag(line, 3)
+        self.assertEquals(tag.name, "cell")
+        self.assertEquals(tag.line, 3)
+        self.assertEquals(tag.to_line(), line)
+        self.assertEquals(tag.get("valignment"), "top")
+        self.assertEquals(tag.get("rotate"), None)
+        self.assertEquals(tag.get("rotate", "0"), "0")
+
+        tag.set("valignment", "top")
+        self.assertFalse(tag.changed)
+        tag.set("valignment", "middle")
+        tag.set("rotate", "90")
+        self.assertTrue(tag.changed)
+        self.assertEquals(tag.to_line(), '<cell alignment="center" '
+                          'valignment="middle" usebox="none" rotate="90">')
+        self.assertEquals(tag.remove("alignment"), True)
+        self.assertEquals(tag.remove("alignment"), False)
+        self.assertEquals(tag.to_line(),
+                          '<cell valignment="middle" usebox="none" rotate="90">')
+        self.assertEquals(Tag("<row>", 0).to_line(), "<row>")
+        self.assertEquals(Tag("<features>", 0).name, "features")
+
+
+    def test_read(self):
+        lines = split(nested)
+        table = Tabular(lines, 0)
+        self.assertEquals(table.start, 1)
+        self.assertEquals(table.end, len(lines) - 3)
+        self.assertEquals(len(table.columns), 1)
+        self.assertEquals(len(table.rows), 1)
+        # the cells of the inner table are not cells of the outer one
+        self.assertEquals(len(list(table.cells())), 1)
+        cell = table.cell(0, 0)
+        self.assertEquals(lines[cell.end], "</cell>")
+        self.assertEquals(lines[table.rows[0].end], "</row>")
+        self.assertEquals(cell.end, table.rows[0].end - 1)
+        self.assertEquals(table.cell(0, 1), None)
+        self.assertEquals(table.cell(1, 0), None)
+
+        inner = Tabular(lines, lines.index("\\begin_inset Tabular", 1))
+        self.assertEquals(len(inner.columns), 2)
+        self.assertEquals([tag.get("usebox") for tag in inner.cells()],
+                          ["none", "none"])
+        self.assertEquals(inner.end, cell.end - 7)
+
+        # a table without its end
+        self.assertEquals(Tabular(lines[:inner.end], inner.start).end, -1)
+
+
+    def test_write(self):
+        lines = split(nested)
+        original = lines[:]
+        table = Tabular(lines, 0)
+        table.write()
+        self.assertEquals(lines, original)
+        table.rows[0].set("topline", "false")
+        table.cell(0, 0).remove("usebox")
+        # the line of an unchanged tag is not rewritten
+        lines[table.columns[0].line] = "not rewritten"
+        table.write()
+        self.assertEquals(lines[table.rows[0].line],
+                          '<row topline="false" bottomline="true">')
+        self.assertEquals(lines[table.cell(0, 0).line],
+                          '<cell alignment="center" valignment="top">')
+        self.assertEquals(lines[table.columns[0].line], "not rewritten")
+        self.assertFalse(table.rows[0].changed)
+        changed = [k for k in range(len(lines)) if lines[k] != original[k]]
+        self.assertEquals(changed, [table.columns[0].line, table.rows[0].line,
+                                    table.cell(0, 0).line])
+
+
+    def test_tablines(self):
+        document = Document(nested)
+        lyx_1_6.convert_tablines(document)
+        self.assertEquals(tags(document.body), split(nested_tags_1_6))
+        self.assertEquals(others(document.body), others(split(nested)))
+        lyx_1_6.revert_tablines(document)
+        self.assertEquals(tags(document.body), split(nested_tags_1_5))
+        self.assertEquals(others(document.body), others(split(nested)))
+        self.assertEquals(document.warnings, [])
+
+
+    def test_longtable_captions(self):
+        document = Document(caption)
+        lyx_2_1.handle_longtable_captions(document, True)
+        self.assertEquals(document.body, split(caption.replace(
+            '<row caption="true">',
+            '<row caption="true" endfirsthead="true">')))
+
+        document = Document(caption.replace('<row caption="true">',
+            '<row caption="true" endfirsthead="true" endhead="false">'))
+        lyx_2_1.handle_longtable_captions(document, False)
+        self.assertEquals(document.body, split(caption.replace(
+            '<row caption="true">',
+            '<row caption="true" endfirsthead="false" endhead="false">')))
+
+        # the caption rows of the other tables are left alone
+        document = Document(caption.replace(' islongtable="true"', ''))
+        lyx_2_1.handle_longtable_captions(document, True)
+        self.assertEquals(document.body,
+                          split(caption.replace(' islongtable="true"', '')))
+
+
+    def test_multirow_offset(self):
+        document = Document(multirow)
+        lyx_2_0.revert_multirowOffset(document)
+        self.assertEquals(document.body, split(multirow_reverted))
+        self.assertEquals(document.preamble,
+                          ["% Added by lyx2lyx", "\\usepackage{multirow}"])
+
+        # the multirows without offset are left to revert_multirow
+        plain = multirow.replace(' mroffset="1ex"', '')
+        document = Document(plain)
+        lyx_2_0.revert_multirowOffset(document)
+        self.assertEquals(document.body, split(plain))
+
+
+    def test_table_rotation(self):
+        rotated = nested.replace("<features>", '<features rotate="45">', 1)
+        document = Document(rotated)
+        lyx_2_1.revert_table_rotation(document)
+        body = document.body
+        self.assertEquals(tags(body), tags(split(nested)))
+        ert = ["\\begin_inset ERT", "status collapsed", "",
+               "\\begin_layout Plain Layout", "", "\\backslash", "turn",
+               "\\end_layout", "", "\\end_inset"]
+        ert[6] = "begin{turn}{45}"
+        self.assertEquals(body[:len(ert)], ert)
+        # the end of the turn follows the end of the outer table, not the
+        # end of the one inside
+        ert[6] = "end{turn}"
+        self.assertEquals(body[-len(ert):], ert)
+        self.assertEquals(body[len(ert):-len(ert)], split(nested))
+
+
+if __name__ == '__main__':
+    unittest.main()
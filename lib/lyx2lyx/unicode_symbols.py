@@ -16,46 +16,268 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
-" Import unicode_reps from this module for access to the unicode<->LaTeX mapping. "
+""" Access to the unicode<->LaTeX mapping of the unicodesymbols file.
 
-import sys, os, re
+The file is parsed once, on first use, into the views needed by the
+converters:
 
-def read_unicodesymbols():
-    " Read the unicodesymbols list of unicode characters and corresponding commands."
-    pathname = os.path.abspath(os.path.dirname(sys.argv[0]))
-    fp = open(os.path.join(pathname.strip('lyx2lyx'), 'unicodesymbols'))
-    spec_chars = []
+get_unicode_reps():
+    A list of [command, character], including the escaped variants of the
+    accent commands (\\\\"u and \\\\" u for \\"{u}), in file order.
+
+get_latex_reps():
+    The same list, with the commands written as in LaTeX (\\\\ -> \\).
+
+get_unicode_chars():
+    A dictionary character -> [command, preamble flags, other flags].
+
+The conversions between text and commands are done in a single pass over
+the text by chars2commands, chars2latex and commands2chars.
+
+The parsed table is kept in a marshal cache in the user cache directory,
+keyed on the path, modification time and size of the unicodesymbols file,
+so that later runs do not need to parse the file again."""
+
+import sys, os, re, marshal, tempfile
+
+# Bump this when the cached views change.
+cache_version = 1
+
+tables = None
+engines = {}
+
+
+def unicodesymbols_path():
+    " Returns the path of the unicodesymbols file, in the parent of lyx2lyx."
+    pathname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(pathname, 'unicodesymbols')
+
+
+def cache_path():
+    " Returns the path of the cache file for the parsed unicodesymbols file."
+    cachedir = os.environ.get('XDG_CACHE_HOME')
+    if not cachedir:
+        cachedir = os.environ.get('LOCALAPPDATA')
+    if not cachedir:
+        cachedir = os.path.join(os.path.expanduser('~'), '.cache')
+    # marshal formats and the result of unichr depend on the python build
+    name = 'unicodesymbols-py%d%d-%d.marshal' % (sys.version_info[0],
+        sys.version_info[1], sys.maxunicode)
+    return os.path.join(cachedir, 'lyx2lyx', name)
+
+
+def parse_unicodesymbols(lines):
+    " Parse the lines of the unicodesymbols file into (reps, latex reps, chars)."
+    reps = []
+    chars = {}
     # Two backslashes, followed by some non-word character, and then a character
     # in brackets. The idea is to check for constructs like: \"{u}, which is how
     # they are written in the unicodesymbols file; but they can also be written
     # as: \"u or even \" u.
     r = re.compile(r'\\\\(\W)\{(\w)\}')
-    for line in fp.readlines():
-        if line[0] != '#' and line.strip() != "":
-            line=line.replace(' "',' ') # remove all quotation marks with spaces before
-            line=line.replace('" ',' ') # remove all quotation marks with spaces after
-            line=line.replace(r'\"','"') # replace \" by " (for characters with diaeresis)
-            try:
-                [ucs4,command,dead] = line.split(None,2)
-                if command[0:1] != "\\":
-                    continue
-                spec_chars.append([command, unichr(eval(ucs4))])
-            except:
+    for line in lines:
+        if line[0] == '#':
+            continue
+        line=line.replace(' "',' ') # remove all quotation marks with spaces before
+        line=line.replace('" ',' ') # remove all quotation marks with spaces after
+        line=line.replace(r'\"','"') # replace \" by " (for characters with diaeresis)
+        try:
+            # flag1 and flag2 are preamble and other flags
+            [ucs4,command,flag1,flag2] = line.split(None,3)
+            chars[unichr(int(ucs4, 0))] = [command, flag1, flag2]
+        except ValueError:
+            pass
+        if line.strip() == "":
+            continue
+        try:
+            [ucs4,command,dead] = line.split(None,2)
+            if command[0:1] != "\\":
+                continue
+            char = unichr(int(ucs4, 0))
+        except ValueError:
+            continue
+        reps.append([command, char])
+        m = r.match(command)
+        if m != None:
+            command = "\\\\"
+            # If the character is a double-quote, then we need to escape it, too,
+            # since it is done that way in the LyX file.
+            if m.group(1) == "\"":
+                command += "\\"
+            commandbl = command
+            command += m.group(1) + m.group(2)
+            commandbl += m.group(1) + ' ' + m.group(2)
+            reps.append([command, char])
+            reps.append([commandbl, char])
+    latex_reps = [[rep[0].replace('\\\\', '\\'), rep[1]] for rep in reps]
+    return reps, latex_reps, chars
+
+
+def read_cache(path, key):
+    " Returns the views stored in the cache file path for key, or None."
+    try:
+        fp = open(path, 'rb')
+        try:
+            data = marshal.loads(fp.read())
+        finally:
+            fp.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if type(data) is not tuple or len(data) != 4 or data[0] != key:
+        return None
+    return data[1:]
+
+
+def write_cache(path, key, views):
+    " Stores views for key in the cache file path, if it can be written."
+    dirname = os.path.dirname(path)
+    tmp = None
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp = tempfile.mkstemp(dir = dirname, prefix = '.unicodesymbols')
+        os.write(fd, marshal.dumps((key,) + tuple(views)))
+        os.close(fd)
+        if os.name == 'nt' and os.path.exists(path):
+            # rename does not replace existing files on Windows
+            os.remove(path)
+        os.rename(tmp, path)
+        tmp = None
+    except (IOError, OSError):
+        pass
+    if tmp is not None:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def read_unicodesymbols():
+    " Read the unicodesymbols file, or its cache, and return all its views."
+    global tables
+    if tables is not None:
+        return tables
+    path = unicodesymbols_path()
+    st = os.stat(path)
+    key = (cache_version, path, int(st.st_mtime), st.st_size)
+    cache = cache_path()
+    views = read_cache(cache, key)
+    if views is None:
+        fp = open(path)
+        try:
+            views = parse_unicodesymbols(fp.readlines())
+        finally:
+            fp.close()
+        write_cache(cache, key, views)
+    tables = views
+    return tables
+
+
+def get_unicode_reps():
+    " Returns the list of [command, character] of the unicodesymbols file."
+    return read_unicodesymbols()[0]
+
+
+def get_latex_reps():
+    " Returns the list of [LaTeX command, character] of the unicodesymbols file."
+    return read_unicodesymbols()[1]
+
+
+def get_unicode_chars():
+    " Returns the dictionary character -> [command, flag1, flag2]."
+    return read_unicodesymbols()[2]
+
+
+def char_engine(latex, suffix):
+    " Returns the (finder, replace) pair used to replace characters by commands."
+    key = (latex, suffix)
+    if key in engines:
+        return engines[key]
+    if latex:
+        reps = get_latex_reps()
+    else:
+        reps = get_unicode_reps()
+    table = {}
+    for command, char in reps:
+        # the first command of a character wins
+        if char not in table:
+            table[char] = command + suffix
+    ascii = [re.escape(char) for char in table if char < u'\x80']
+    finder = re.compile(u'[%s\x80-%s]' % (u''.join(ascii), unichr(sys.maxunicode)))
+
+    def replace(m):
+        char = m.group()
+        return table.get(char, char)
+
+    engines[key] = (finder, replace)
+    return engines[key]
+
+
+def chars2commands(text, suffix = ""):
+    """ Replaces the characters of text by their commands, as written in
+    the unicodesymbols file, followed by suffix."""
+    finder, replace = char_engine(False, suffix)
+    return finder.sub(replace, unicode(text))
+
+
+def chars2latex(text, suffix = ""):
+    """ Replaces the characters of text by their LaTeX commands, followed
+    by suffix."""
+    finder, replace = char_engine(True, suffix)
+    return finder.sub(replace, unicode(text))
+
+
+def command_engine():
+    " Returns the (table, lengths, key length, hard commands) used by commands2chars."
+    if None in engines:
+        return engines[None]
+    # Commands of this sort need to be checked to make sure they are
+    # followed by a non-alpha character, lest we replace too much.
+    hardone = re.compile(r'^\\\\[a-zA-Z]+$')
+    reps = get_unicode_reps()
+    keylen = min([len(rep[0]) for rep in reps] + [3])
+    table = {}
+    lengths = {}
+    hard = {}
+    for command, char in reps:
+        if command in table:
+            continue
+        table[command] = char
+        lengths.setdefault(command[:keylen], {})[len(command)] = None
+        if hardone.match(command):
+            hard[command] = None
+    for prefix in lengths:
+        # longest first
+        lengths[prefix] = sorted(lengths[prefix].keys(), reverse = True)
+    engines[None] = (table, lengths, keylen, hard)
+    return engines[None]
+
+
+def commands2chars(text):
+    """ Replaces the commands of the unicodesymbols file in text by their
+    characters. At every position the longest command wins, and commands
+    made of letters only are not replaced when followed by a letter."""
+    table, lengths, keylen, hard = command_engine()
+    text = unicode(text)
+    pos = text.find('\\')
+    if pos == -1:
+        return text
+    result = []
+    last = 0
+    size = len(text)
+    while pos != -1:
+        for length in lengths.get(text[pos:pos + keylen], ()):
+            end = pos + length
+            command = text[pos:end]
+            if command not in table:
+                continue
+            if command in hard and end < size and text[end].isalpha():
+                # not the end of that command
                 continue
-            m = r.match(command)
-            if m != None:
-                command = "\\\\"
-                # If the character is a double-quote, then we need to escape it, too,
-                # since it is done that way in the LyX file.
-                if m.group(1) == "\"":
-                    command += "\\"
-                commandbl = command
-                command += m.group(1) + m.group(2)
-                commandbl += m.group(1) + ' ' + m.group(2)
-                spec_chars.append([command, unichr(eval(ucs4))])
-                spec_chars.append([commandbl, unichr(eval(ucs4))])
-    fp.close()
-    return spec_chars
-
-
-unicode_reps = read_unicodesymbols()
+            result.append(text[last:pos])
+            result.append(table[command])
+            last = end
+            break
+        pos = text.find('\\', max(last, pos + 1))
+    result.append(text[last:])
+    return u''.join(result)